@@ -1,3 +1,4 @@
+import logging
 import subprocess
 from dataclasses import dataclass
 from datetime import datetime
@@ -7,15 +8,6 @@ from typing import Optional
 import typer
 
 from jkrimporter import __version__
-from jkrimporter.providers.db.dbprovider import DbProvider
-from jkrimporter.providers.db.services.tiedontuottaja import (
-    get_tiedontuottaja,
-    insert_tiedontuottaja,
-    list_tiedontuottajat,
-    remove_tiedontuottaja,
-    rename_tiedontuottaja,
-)
-
 from jkrimporter.providers.lahti.lahtiprovider import (
     IlmoitusTranslator,
     LahtiTranslator,
@@ -33,19 +25,40 @@ from jkrimporter.providers.nokia.siirtotiedosto import NokiaSiirtotiedosto
 from jkrimporter.providers.pjh.pjhprovider import PjhTranslator
 from jkrimporter.providers.pjh.siirtotiedosto import PjhSiirtotiedosto
 from jkrimporter.utils.date import parse_date_string
+from jkrimporter.utils.jkrdata_cache import (
+    CachedJkrData,
+    get_cache_key,
+    read_jkr_data,
+    write_jkr_data,
+)
+from jkrimporter.utils.kuljetus import read_kohdentumattomat, write_kohdentumattomat
+from jkrimporter.utils.osoite import osoite_cache
+from jkrimporter.utils.xlsx import collect_exports
+
+# The database modules are imported in the commands that need them. Importing them
+# is slow, as the database schema is reflected when the models are first used.
 
 
 @dataclass
 class Provider:
     Translator: type
     Siirtotiedosto: type
+    # Siirtotiedosto may be parsed in multiple processes
+    supports_workers: bool = False
+    # Translator may stream asiakkaat to the database import
+    supports_stream: bool = False
 
 
 PROVIDERS = {
     # we may also add other providers using the *same* formats
     "PJH": Provider(Translator=PjhTranslator, Siirtotiedosto=PjhSiirtotiedosto),
     "HKO": Provider(Translator=NokiaTranslator, Siirtotiedosto=NokiaSiirtotiedosto),
-    "LSJ": Provider(Translator=LahtiTranslator, Siirtotiedosto=LahtiSiirtotiedosto)
+    "LSJ": Provider(
+        Translator=LahtiTranslator,
+        Siirtotiedosto=LahtiSiirtotiedosto,
+        supports_workers=True,
+        supports_stream=True,
+    ),
 }
 
 
@@ -55,6 +68,14 @@ def version_callback(value: bool):
         raise typer.Exit()
 
 
+def log_level_callback(value: str):
+    level = logging.getLevelName(value.upper())
+    if not isinstance(level, int):
+        raise typer.BadParameter(f"Tuntematon lokitustaso {value}")
+    logging.getLogger().setLevel(level)
+    return value
+
+
 def main_callback(
     version: Optional[bool] = typer.Option(
         None,
@@ -63,6 +84,12 @@ def main_callback(
         is_eager=True,
         help="Kertoo lataustyökalun versionumeron.",
     ),
+    log_level: str = typer.Option(
+        "WARNING",
+        "--log-level",
+        callback=log_level_callback,
+        help="Lokituksen taso, esim. DEBUG, INFO tai WARNING.",
+    ),
 ):
     ...
 
@@ -98,7 +125,43 @@ def import_data(
     ),
     alkupvm: str = typer.Argument(None, help="Importoitavan datan alkupvm"),
     loppupvm: str = typer.Argument(None, help="Importoitavan datan loppupvm"),
+    massatuonti: bool = typer.Option(
+        False,
+        "--massatuonti",
+        help="Hae asiakasnumerot ja tallenna kuljetukset massatuontina.",
+    ),
+    commit_every: int = typer.Option(
+        1,
+        "--commit_every",
+        help="Tallenna tietokantaan aina näin monen asiakkaan jälkeen.",
+    ),
+    workers: int = typer.Option(
+        1,
+        "--workers",
+        help="Lue siirtotiedosto näin monessa prosessissa.",
+    ),
+    cache: bool = typer.Option(
+        False,
+        "--cache",
+        help=(
+            "Käytä aiemman tuonnin käännettyä dataa, jos siirtotiedosto ei ole "
+            "muuttunut. Tuonti lukee myös kohdentumattomien tiedoston ja kirjoittaa "
+            "sen uudelleen, joten välimuistia käytetään vain, jos tiedosto on "
+            "ennallaan."
+        ),
+    ),
+    stream: bool = typer.Option(
+        False,
+        "--stream",
+        help=(
+            "Käännä asiakkaat tuonnin aikana, jolloin muistissa on kerrallaan vain "
+            "osa asiakkaista. Siirtotiedoston rivit luetaan silti kaikki muistiin."
+        ),
+    ),
 ):
+    from jkrimporter.providers.db.dbprovider import DbProvider
+    from jkrimporter.providers.db.services.tiedontuottaja import get_tiedontuottaja
+
     tiedontuottaja = get_tiedontuottaja(tiedontuottajatunnus)
     if not tiedontuottaja:
         typer.echo(
@@ -106,18 +169,71 @@ def import_data(
         )
         raise typer.Exit()
     provider = PROVIDERS[tiedontuottajatunnus]
-    data = provider.Siirtotiedosto(siirtotiedosto)
+    if provider.supports_workers:
+        data = provider.Siirtotiedosto(siirtotiedosto, workers=workers)
+    else:
+        if workers > 1:
+            typer.echo(
+                f"Tiedontuottajan {tiedontuottajatunnus} siirtotiedosto luetaan "
+                "yhdessä prosessissa."
+            )
+        data = provider.Siirtotiedosto(siirtotiedosto)
 
     if alkupvm:
         alkupvm = parse_date_string(alkupvm)
     if loppupvm:
         loppupvm = parse_date_string(loppupvm)
 
-    translator = provider.Translator(data, tiedontuottajatunnus)
-    jkr_data = translator.as_jkr_data(alkupvm, loppupvm)
-    print('writing to db...')
-    db = DbProvider()
-    db.write(jkr_data, tiedontuottajatunnus, not luo_uudet, ala_paivita_yhteystietoja, ala_paivita_kohdetta, siirtotiedosto)
+    if stream and not provider.supports_stream:
+        typer.echo(
+            f"Tiedontuottajan {tiedontuottajatunnus} siirtotiedosto käännetään "
+            "kokonaan ennen tuontia."
+        )
+        stream = False
+
+    # When streaming, addresses are parsed during the database import
+    with osoite_cache.persisted():
+        if stream:
+            # The asiakkaat are not all in memory, so they are not cached either
+            translator = provider.Translator(data, tiedontuottajatunnus)
+            jkr_data = translator.as_jkr_data_stream(alkupvm, loppupvm)
+        else:
+            jkr_data = None
+            if cache:
+                cache_key = get_cache_key(
+                    data.input_files(),
+                    tiedontuottajatunnus,
+                    provider.Translator,
+                    alkupvm,
+                    loppupvm,
+                )
+                cached = read_jkr_data(cache_key)
+                if cached is not None:
+                    jkr_data = cached.jkr_data
+                    # The siirtotiedosto is not parsed, so the rows failing
+                    # validation are written as parsing would write them
+                    if cached.kohdentumattomat is not None:
+                        write_kohdentumattomat(siirtotiedosto, cached.kohdentumattomat)
+            if jkr_data is None:
+                translator = provider.Translator(data, tiedontuottajatunnus)
+                jkr_data = translator.as_jkr_data(alkupvm, loppupvm)
+                if cache:
+                    write_jkr_data(
+                        cache_key,
+                        CachedJkrData(jkr_data, read_kohdentumattomat(siirtotiedosto)),
+                    )
+        print('writing to db...')
+        db = DbProvider()
+        db.write(
+            jkr_data,
+            tiedontuottajatunnus,
+            not luo_uudet,
+            ala_paivita_yhteystietoja,
+            ala_paivita_kohdetta,
+            siirtotiedosto,
+            massatuonti,
+            commit_every,
+        )
 
     print("VALMIS!")
 
@@ -129,6 +245,8 @@ def create_dvv_kohteet(
         None, help="Perusmaksurekisteritiedosto"
     ),
 ):
+    from jkrimporter.providers.db.dbprovider import DbProvider
+
     db = DbProvider()
     # Currently, typer does not support Union[datetime, None] argument type, so we will
     # have to parse the datetime string ourselves.
@@ -187,10 +305,13 @@ def update_huoneistomaara(
 def import_paatokset(
     siirtotiedosto: Path = typer.Argument(..., help="Polku siirtotiedostoon")
 ):
-    translator = PaatosTranslator(Paatostiedosto(siirtotiedosto))
-    paatos_data = translator.as_jkr_data()
-    db = DbProvider()
-    db.write_paatokset(paatos_data, siirtotiedosto)
+    from jkrimporter.providers.db.dbprovider import DbProvider
+
+    with collect_exports():
+        translator = PaatosTranslator(Paatostiedosto(siirtotiedosto))
+        paatos_data = translator.as_jkr_data()
+        db = DbProvider()
+        db.write_paatokset(paatos_data, siirtotiedosto)
 
     print("VALMIS!")
 
@@ -199,10 +320,13 @@ def import_paatokset(
 def import_ilmoitukset(
     siirtotiedosto: Path = typer.Argument(..., help="Kompostointi ilmoitus-tiedoston sijainti.")
 ):
-    translator = IlmoitusTranslator(Ilmoitustiedosto(siirtotiedosto))
-    ilmoitus_data = translator.as_jkr_data()
-    db = DbProvider()
-    db.write_ilmoitukset(ilmoitus_data, siirtotiedosto)
+    from jkrimporter.providers.db.dbprovider import DbProvider
+
+    with collect_exports():
+        translator = IlmoitusTranslator(Ilmoitustiedosto(siirtotiedosto))
+        ilmoitus_data = translator.as_jkr_data()
+        db = DbProvider()
+        db.write_ilmoitukset(ilmoitus_data, siirtotiedosto)
 
     print("VALMIS!")
 
@@ -211,10 +335,15 @@ def import_ilmoitukset(
 def import_lopetusilmoitukset(
     siirtotiedosto: Path = typer.Argument(..., help="Kompostoinnin lopetusilmoitus-tiedoston sijainti.")
 ):
-    translator = LopetusIlmoitusTranslator(LopetusIlmoitustiedosto(siirtotiedosto))
-    lopetusilmoitus_data = translator.as_jkr_data()
-    db = DbProvider()
-    db.write_lopetusilmoitukset(lopetusilmoitus_data, siirtotiedosto)
+    from jkrimporter.providers.db.dbprovider import DbProvider
+
+    with collect_exports():
+        translator = LopetusIlmoitusTranslator(
+            LopetusIlmoitustiedosto(siirtotiedosto)
+        )
+        lopetusilmoitus_data = translator.as_jkr_data()
+        db = DbProvider()
+        db.write_lopetusilmoitukset(lopetusilmoitus_data, siirtotiedosto)
 
     print("VALMIS!")
 
@@ -224,6 +353,8 @@ def tiedontuottaja_add_new(
     tunnus: str = typer.Argument(..., help="Tiedontuottajan tunnus. Esim. 'PJH'"),
     name: str = typer.Argument(..., help="Tiedontuottajan nimi."),
 ):
+    from jkrimporter.providers.db.services.tiedontuottaja import insert_tiedontuottaja
+
     insert_tiedontuottaja(tunnus.upper(), name)
 
 
@@ -232,6 +363,8 @@ def tiedontuottaja_rename(
     tunnus: str = typer.Argument(..., help="Tiedontuottajan tunnus. Esim. 'PJH'"),
     name: str = typer.Argument(..., help="Tiedontuottajan uusi nimi."),
 ):
+    from jkrimporter.providers.db.services.tiedontuottaja import rename_tiedontuottaja
+
     rename_tiedontuottaja(tunnus.upper(), name)
 
 
@@ -239,11 +372,15 @@ def tiedontuottaja_rename(
 def tiedontuottaja_remove(
     tunnus: str = typer.Argument(..., help="Tiedontuottajan tunnus. Esim. 'PJH'")
 ):
+    from jkrimporter.providers.db.services.tiedontuottaja import remove_tiedontuottaja
+
     remove_tiedontuottaja(tunnus.upper())
 
 
 @provider_app.command("list", help="Listaa järjestelmästä löytyvät tiedontuottajat.")
 def tiedontuottaja_list():
+    from jkrimporter.providers.db.services.tiedontuottaja import list_tiedontuottajat
+
     for tiedontuottaja in list_tiedontuottajat():
         print(f"{tiedontuottaja.tunnus}\t{tiedontuottaja.nimi}")
 
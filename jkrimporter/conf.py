@@ -4,8 +4,11 @@ import sys
 from dotenv import dotenv_values
 
 
+# The user's %APPDATA%/jkr directory
+config_dir = os.path.join(os.getenv("APPDATA"), "jkr")
+
 # Path to the .env file in the user's %APPDATA%/jkr directory
-dotenv_path = os.path.join(os.getenv("APPDATA"), "jkr", ".env")
+dotenv_path = os.path.join(config_dir, ".env")
 
 # Read the environment variables from the .env file
 env = {
@@ -30,6 +33,13 @@ if (
     dbconf["password"] = env.get("JKR_TEST_PASSWORD", None)
     dbconf["dbname"] = env.get("JKR_TEST_DB", None)
 
+# Read the reflected database schema from a snapshot in config_dir, if one exists
+# for the current schema version.
+schema_snapshot = env.get("JKR_SCHEMA_SNAPSHOT", "").lower() in ("1", "true", "yes")
+
+# Keep parsed addresses in a cache file in config_dir between runs.
+osoite_cache = env.get("JKR_OSOITE_CACHE", "").lower() in ("1", "true", "yes")
+
 __all__ = ["dbconf"]
 
 kohdentumattomat_filename = "kohdentumattomat"
@@ -1,7 +1,7 @@
 from dataclasses import dataclass, field
 from datetime import date
 from enum import Enum
-from typing import Dict, List, NamedTuple, Optional, Union
+from typing import Dict, Iterator, List, NamedTuple, Optional, Union
 
 from jkrimporter.utils.intervals import Interval
 
@@ -210,6 +210,29 @@ class Asiakas:
     tyhjennystapahtumat: List[Tyhjennystapahtuma] = field(default_factory=list)
 
 
+@dataclass
+class AsiakasAvain:
+    """
+    The fields of Asiakas needed for finding kohteet before importing any asiakas.
+    """
+
+    asiakasnumero: Tunnus
+    voimassa: Interval
+    haltija: Yhteystieto
+    kiinteistot: List[Kiinteistonumero] = field(default_factory=list)
+    rakennukset: List[Rakennustunnus] = field(default_factory=list)
+
+    @classmethod
+    def from_asiakas(cls, asiakas: Asiakas) -> "AsiakasAvain":
+        return cls(
+            asiakasnumero=asiakas.asiakasnumero,
+            voimassa=asiakas.voimassa,
+            haltija=asiakas.haltija,
+            kiinteistot=asiakas.kiinteistot,
+            rakennukset=asiakas.rakennukset,
+        )
+
+
 ToimituspaikkaID = int
 
 
@@ -239,6 +262,20 @@ class JkrData:
     toimitukset: List[Toimitus] = field(default_factory=list)
 
 
+@dataclass
+class JkrDataStream:
+    """
+    JkrData read in two passes, so that all asiakkaat need not be in memory at
+    once. The avaimet of all asiakkaat are read first. The asiakkaat are then
+    yielded in the same order.
+    """
+
+    alkupvm: Optional[date]
+    loppupvm: Optional[date]
+    avaimet: List[AsiakasAvain]
+    asiakkaat: Iterator[Asiakas]
+
+
 class Tapahtumalaji(Enum):
     PERUSMAKSU = "Perusmaksu"
     AKP = "AKP"
@@ -1,4 +1,5 @@
 import json
+from functools import lru_cache
 
 from sqlalchemy import create_engine
 
@@ -10,9 +11,20 @@ def json_dumps(value):
     return json.dumps(value, cls=JSONEncoderWithDateSupport)
 
 
-engine = create_engine(
-    "postgresql://{username}:{password}@{host}:{port}/{dbname}".format(**conf.dbconf),
-    future=True,
-    json_serializer=json_dumps
-    # echo=False,
-)
+@lru_cache(maxsize=None)
+def get_engine():
+    return create_engine(
+        "postgresql://{username}:{password}@{host}:{port}/{dbname}".format(
+            **conf.dbconf
+        ),
+        future=True,
+        json_serializer=json_dumps
+        # echo=False,
+    )
+
+
+def __getattr__(name):
+    # The engine is created when first used, not when the module is imported.
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,19 +1,18 @@
-import csv
 import logging
 import os
 from collections import defaultdict
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Union
 
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from jkrimporter.conf import get_kohdentumattomat_siirtotiedosto_filename
-from jkrimporter.datasheets import get_siirtotiedosto_headers
 from jkrimporter.model import (
     Asiakas,
+    AsiakasAvain,
     JkrData,
+    JkrDataStream,
     JkrIlmoitukset,
     Paatos,
     LopetusIlmoitus
@@ -23,7 +22,8 @@ from jkrimporter.utils.ilmoitus import (
     export_kohdentumattomat_ilmoitukset,
     export_kohdentumattomat_lopetusilmoitukset
 )
-from jkrimporter.utils.intervals import IntervalCounter
+from jkrimporter.utils.intervals import IntervalCounter, IntervalIndex
+from jkrimporter.utils.kuljetus import KohdentumattomatKuljetukset
 from jkrimporter.utils.paatos import export_kohdentumattomat_paatokset
 from jkrimporter.utils.progress import Progress
 
@@ -44,12 +44,18 @@ from .models import (
 )
 from .services.buildings import counts as building_counts
 from .services.buildings import (
+    address_index,
     find_building_candidates_for_kohde,
     find_buildings_for_kohde,
     find_osoite_by_prt,
     find_single_building_id_by_prt,
+    geometry_cache,
 )
+from .services.indexes import building_index
 from .services.kohde import (
+    AsiakasKohdeResolver,
+    DvvSnapshot,
+    UlkoinenAsiakastietoResolver,
     add_ulkoinen_asiakastieto_for_kohde,
     create_new_kohde,
     create_perusmaksurekisteri_kohteet,
@@ -59,6 +65,7 @@ from .services.kohde import (
     find_kohteet_by_prt,
     get_or_create_multiple_and_uninhabited_kohteet,
     get_or_create_paritalo_kohteet,
+    get_or_create_pseudokohde,
     get_or_create_single_asunto_kohteet,
     get_ulkoinen_asiakastieto,
     update_kohde,
@@ -69,16 +76,36 @@ from .services.osapuoli import (
     create_or_update_komposti_yhteyshenkilo,
 )
 from .services.sopimus import update_sopimukset_for_kohde
+from .services.staging import KULJETUS_BATCH_SIZE, AsiakasStaging
 
 logger = logging.getLogger(__name__)
 
 
-def count(jkr_data: JkrData):
+class TranslationError(Exception):
+    """
+    Translating the streamed asiakkaat failed during the import.
+    """
+
+
+def _translated(asiakkaat: "Iterable[Asiakas]") -> "Iterator[Asiakas]":
+    """
+    Yields the streamed asiakkaat. Errors in translating them are raised as
+    TranslationError, as they are not errors of a single asiakas.
+    """
+    try:
+        yield from asiakkaat
+    except Exception as e:
+        raise TranslationError(
+            "Asiakkaiden kääntäminen epäonnistui kesken tuonnin."
+        ) from e
+
+
+def count(asiakkaat: "Iterable[Union[Asiakas, AsiakasAvain]]"):
     prt_counts: Dict[str, IntervalCounter] = defaultdict(IntervalCounter)
     kitu_counts: Dict[str, IntervalCounter] = defaultdict(IntervalCounter)
     address_counts: Dict[str, IntervalCounter] = defaultdict(IntervalCounter)
 
-    for asiakas in jkr_data.asiakkaat.values():
+    for asiakas in asiakkaat:
         for prt in asiakas.rakennukset:
             prt_counts[prt].append(asiakas.voimassa)
         for kitu in asiakas.kiinteistot:
@@ -88,20 +115,28 @@ def count(jkr_data: JkrData):
         if addr:
             address_counts[addr].append(asiakas.voimassa)
 
-    return prt_counts, kitu_counts, address_counts
+    # The counts are queried for every asiakas
+    return _index(prt_counts), _index(kitu_counts), _index(address_counts)
 
 
-def insert_kuljetukset(
-    session,
-    kohde,
+def _index(counts: Dict[str, IntervalCounter]) -> Dict[str, IntervalIndex]:
+    indexes = defaultdict(IntervalIndex)
+    for key, counter in counts.items():
+        indexes[key] = IntervalIndex(counter)
+    return indexes
+
+
+def parse_kuljetukset(
     tyhjennystapahtumat: List[JkrTyhjennystapahtuma],
     raportointi_alkupvm: Optional[datetime.date],
     raportointi_loppupvm: Optional[datetime.date],
-    urakoitsija: Tiedontuottaja,
 ):
+    """
+    Yields the tyhjennystapahtumat with known jätetyyppi, together with the
+    jätetyyppi, dates and massa to be saved in kuljetus.
+    """
     for tyhjennys in tyhjennystapahtumat:
-        print("importing tyhjennys")
-        print(tyhjennys)
+        logger.debug("importing tyhjennys %s", tyhjennys)
         if not tyhjennys.alkupvm:
             # In many cases, only one date is known for tyhjennys. Looks like
             # in those cases the date is marked as the end date.
@@ -122,6 +157,20 @@ def insert_kuljetukset(
         else:
             massa = tyhjennys.massa
 
+        yield tyhjennys, jatetyyppi, alkupvm, loppupvm, massa
+
+
+def insert_kuljetukset(
+    session,
+    kohde,
+    tyhjennystapahtumat: List[JkrTyhjennystapahtuma],
+    raportointi_alkupvm: Optional[datetime.date],
+    raportointi_loppupvm: Optional[datetime.date],
+    urakoitsija: Tiedontuottaja,
+):
+    for tyhjennys, jatetyyppi, alkupvm, loppupvm, massa in parse_kuljetukset(
+        tyhjennystapahtumat, raportointi_alkupvm, raportointi_loppupvm
+    ):
         exists = any(
             k.jatetyyppi == jatetyyppi
             and k.alkupvm == alkupvm
@@ -143,6 +192,29 @@ def insert_kuljetukset(
             session.add(db_kuljetus)
 
 
+def stage_kuljetukset(
+    staging: AsiakasStaging,
+    kohde,
+    tyhjennystapahtumat: List[JkrTyhjennystapahtuma],
+    raportointi_alkupvm: Optional[datetime.date],
+    raportointi_loppupvm: Optional[datetime.date],
+    urakoitsija: Tiedontuottaja,
+):
+    for tyhjennys, jatetyyppi, alkupvm, loppupvm, massa in parse_kuljetukset(
+        tyhjennystapahtumat, raportointi_alkupvm, raportointi_loppupvm
+    ):
+        staging.add_kuljetus(
+            kohde,
+            jatetyyppi,
+            alkupvm,
+            loppupvm,
+            tyhjennys.tyhjennyskerrat,
+            massa,
+            tyhjennys.tilavuus,
+            urakoitsija,
+        )
+
+
 def find_and_update_kohde(
     session: "Session",
     asiakas: "Asiakas",
@@ -151,23 +223,36 @@ def find_and_update_kohde(
     prt_counts: Dict[str, int],
     kitu_counts: Dict[str, int],
     address_counts: Dict[str, int],
+    resolver: Optional[UlkoinenAsiakastietoResolver] = None,
+    kohde_resolver: Optional[AsiakasKohdeResolver] = None,
 ) -> Union[Kohde, None]:
 
     kohde = None
-    ulkoinen_asiakastieto = get_ulkoinen_asiakastieto(session, asiakas.asiakasnumero)
+    if resolver is not None:
+        ulkoinen_asiakastieto = resolver.get(asiakas.asiakasnumero)
+    else:
+        ulkoinen_asiakastieto = get_ulkoinen_asiakastieto(
+            session, asiakas.asiakasnumero
+        )
     if ulkoinen_asiakastieto:
-        print("Kohde found by customer id.")
+        logger.debug("Kohde found by customer id.")
         update_ulkoinen_asiakastieto(ulkoinen_asiakastieto, asiakas)
 
         kohde = ulkoinen_asiakastieto.kohde
         if do_update:
             update_kohde(kohde, asiakas)
     else:
-        print("Customer id not found. Searching for kohde by customer data...")
+        logger.debug("Customer id not found. Searching for kohde by customer data...")
         if asiakas.rakennukset:
-            kohde = find_kohde_by_prt(session, asiakas)
+            if kohde_resolver:
+                kohde = kohde_resolver.find_kohde_by_prt(asiakas)
+            else:
+                kohde = find_kohde_by_prt(session, asiakas)
         if not kohde and asiakas.kiinteistot:
-            kohde = find_kohde_by_kiinteisto(session, asiakas)
+            if kohde_resolver:
+                kohde = kohde_resolver.find_kohde_by_kiinteisto(asiakas)
+            else:
+                kohde = find_kohde_by_kiinteisto(session, asiakas)
         if (
             not kohde
             and asiakas.haltija.osoite.postinumero
@@ -178,15 +263,19 @@ def find_and_update_kohde(
             update_kohde(kohde, asiakas)
         elif do_create:
             # this creates kohde without buildings
-            print("Kohde not found, creating new one...")
+            logger.debug("Kohde not found, creating new one...")
             kohde = create_new_kohde(session, asiakas)
         if kohde:
-            add_ulkoinen_asiakastieto_for_kohde(session, kohde, asiakas)
+            asiakastieto = add_ulkoinen_asiakastieto_for_kohde(
+                session, kohde, asiakas
+            )
+            if resolver is not None:
+                resolver.add(asiakastieto)
         else:
-            print("Could not find kohde.")
+            logger.debug("Could not find kohde.")
 
     if do_create and not kohde.rakennus_collection:
-        print("New kohde created. Looking for buildings...")
+        logger.debug("New kohde created. Looking for buildings...")
         buildings = find_buildings_for_kohde(
             session, asiakas, prt_counts, kitu_counts, address_counts
         )
@@ -222,9 +311,12 @@ def import_asiakastiedot(
     do_create: bool,
     do_update_contact: bool,
     do_update_kohde: bool,
-    prt_counts: Dict[str, IntervalCounter],
-    kitu_counts: Dict[str, IntervalCounter],
-    address_counts: Dict[str, IntervalCounter],
+    prt_counts: Dict[str, IntervalIndex],
+    kitu_counts: Dict[str, IntervalIndex],
+    address_counts: Dict[str, IntervalIndex],
+    staging: Optional[AsiakasStaging] = None,
+    resolver: Optional[UlkoinenAsiakastietoResolver] = None,
+    kohde_resolver: Optional[AsiakasKohdeResolver] = None,
 ):
 
     kohde = find_and_update_kohde(
@@ -235,9 +327,11 @@ def import_asiakastiedot(
         prt_counts,
         kitu_counts,
         address_counts,
+        resolver,
+        kohde_resolver,
     )
     if not kohde:
-        print(f"Could not find kohde for asiakas {asiakas}, skipping...")
+        logger.info("Could not find kohde for asiakas %s, skipping...", asiakas)
         return asiakas
 
     # Update osapuolet from the same tiedontuottaja. This function will not
@@ -245,16 +339,26 @@ def import_asiakastiedot(
     create_or_update_haltija_osapuoli(session, kohde, asiakas, do_update_contact)
 
     update_sopimukset_for_kohde(session, kohde, asiakas, loppupvm, urakoitsija)
-    insert_kuljetukset(
-        session,
-        kohde,
-        asiakas.tyhjennystapahtumat,
-        alkupvm,
-        loppupvm,
-        urakoitsija,
-    )
-
-    session.commit()
+    if kohde_resolver:
+        kohde_resolver.set_osapuolet_updated(kohde)
+    if staging:
+        stage_kuljetukset(
+            staging,
+            kohde,
+            asiakas.tyhjennystapahtumat,
+            alkupvm,
+            loppupvm,
+            urakoitsija,
+        )
+    else:
+        insert_kuljetukset(
+            session,
+            kohde,
+            asiakas.tyhjennystapahtumat,
+            alkupvm,
+            loppupvm,
+            urakoitsija,
+        )
 
 
 def import_dvv_kohteet(
@@ -269,72 +373,105 @@ def import_dvv_kohteet(
     if poimintapvm is not None:
         set_end_dates_to_kohteet(session, poimintapvm)
 
+    # Building coordinates are needed in clustering over and over again.
+    geometry_cache.load(session)
+    try:
+        _import_dvv_kohteet(session, poimintapvm, loppupvm, perusmaksutiedosto)
+    finally:
+        geometry_cache.clear()
+
+
+def _import_dvv_kohteet(
+    session: Session,
+    poimintapvm: Optional[datetime.date],
+    loppupvm: Optional[datetime.date],
+    perusmaksutiedosto: Optional[Path],
+):
+    # All stages use the same DVV buildings, loaded only once
+    dvv_snapshot = DvvSnapshot(session, poimintapvm, loppupvm)
+
     # 1) Yhden asunnon kohteet
     single_asunto_kohteet = get_or_create_single_asunto_kohteet(
-        session, poimintapvm, loppupvm
+        session, poimintapvm, loppupvm, dvv_snapshot
     )
     session.commit()
-    print(f"Imported {len(single_asunto_kohteet)} single kohteet")
+    logger.info("Imported %s single kohteet", len(single_asunto_kohteet))
 
     # 2) Perusmaksurekisterin kohteet
     if perusmaksutiedosto:
         perusmaksukohteet = create_perusmaksurekisteri_kohteet(
-            session, perusmaksutiedosto, poimintapvm, loppupvm
+            session, perusmaksutiedosto, poimintapvm, loppupvm, dvv_snapshot
         )
         session.commit()
-        print(f"Imported {len(perusmaksukohteet)} kohteet with perusmaksu data")
+        logger.info("Imported %s kohteet with perusmaksu data", len(perusmaksukohteet))
     else:
-        print("No perusmaksu data")
+        logger.info("No perusmaksu data")
 
     # 3) Paritalokohteet
-    paritalo_kohteet = get_or_create_paritalo_kohteet(session, poimintapvm, loppupvm)
+    paritalo_kohteet = get_or_create_paritalo_kohteet(
+        session, poimintapvm, loppupvm, dvv_snapshot
+    )
     session.commit()
-    print(f"Imported {len(paritalo_kohteet)} paritalokohteet")
+    logger.info("Imported %s paritalokohteet", len(paritalo_kohteet))
 
     # 4) Muut kohteet
     multiple_and_uninhabited_kohteet = get_or_create_multiple_and_uninhabited_kohteet(
-        session, poimintapvm, loppupvm
+        session, poimintapvm, loppupvm, dvv_snapshot
     )
     session.commit()
-    print(f"Imported {len(multiple_and_uninhabited_kohteet)} remaining kohteet")
+    logger.info(
+        "Imported %s remaining kohteet", len(multiple_and_uninhabited_kohteet)
+    )
 
 
 class DbProvider:
     def write(
         self,
-        jkr_data: JkrData,
+        jkr_data: Union[JkrData, JkrDataStream],
         tiedontuottaja_lyhenne: str,
         ala_luo: bool,
         ala_paivita_yhteystietoja: bool,
         ala_paivita_kohdetta: bool,
         siirtotiedosto: Path,
+        massatuonti: bool = False,
+        commit_every: int = 1,
     ):
         try:
-            kohdentumattomat = []
-            print(len(jkr_data.asiakkaat))
-            progress = Progress(len(jkr_data.asiakkaat))
-
-            prt_counts, kitu_counts, address_counts = count(jkr_data)
-            with Session(engine) as session:
+            if isinstance(jkr_data, JkrDataStream):
+                # Only the avaimet of all asiakkaat are needed before the import
+                avaimet = jkr_data.avaimet
+                asiakkaat = _translated(jkr_data.asiakkaat)
+            else:
+                avaimet = jkr_data.asiakkaat.values()
+                asiakkaat = jkr_data.asiakkaat.values()
+            logger.info("%s asiakasta", len(avaimet))
+            progress = Progress(len(avaimet))
+
+            prt_counts, kitu_counts, address_counts = count(avaimet)
+            # The preloaded rows are kept for the whole import. Expiring them on
+            # commit would refresh them from the database one by one.
+            with Session(engine, expire_on_commit=False) as session:
                 init_code_objects(session)
 
                 tiedoston_tuottaja = session.get(Tiedontuottaja, tiedontuottaja_lyhenne)
 
                 # The same tiedontuottaja may contain data from multiple
                 # urakoitsijat. Create all urakoitsijat in the db first.
-                print("Importoidaan urakoitsijat")
+                logger.info("Importoidaan urakoitsijat")
                 urakoitsijat: Set[str] = set()
-                for asiakas in jkr_data.asiakkaat.values():
+                for asiakas in avaimet:
                     if asiakas.asiakasnumero.jarjestelma not in urakoitsijat:
-                        print(f"found urakoitsija {asiakas.asiakasnumero.jarjestelma}")
+                        logger.debug(
+                            "found urakoitsija %s", asiakas.asiakasnumero.jarjestelma
+                        )
                         urakoitsijat.add(asiakas.asiakasnumero.jarjestelma)
                 tiedontuottajat: Dict[str, Tiedontuottaja] = {}
                 for urakoitsija_tunnus in urakoitsijat:
-                    print("checking or adding urakoitsija")
+                    logger.debug("checking or adding urakoitsija")
                     tiedontuottaja = session.get(Tiedontuottaja, urakoitsija_tunnus)
-                    print(tiedontuottaja)
+                    logger.debug(tiedontuottaja)
                     if not tiedontuottaja:
-                        print("not found, adding")
+                        logger.debug("not found, adding")
                         tiedontuottaja = Tiedontuottaja(
                             # let's create the urakoitsijat using only y-tunnus for now.
                             # We can create tiedontuottaja-nimi maps later.
@@ -345,195 +482,106 @@ class DbProvider:
                     tiedontuottajat[urakoitsija_tunnus] = tiedontuottaja
                 session.commit()
 
-                print("Importoidaan asiakastiedot")
-                for asiakas in jkr_data.asiakkaat.values():
-                    print("---------")
-                    print("importing")
-                    print(asiakas)
-                    progress.tick()
-
-                    # Asiakastieto may come from different urakoitsija than the
-                    # immediate tiedontuottaja. In such a case, the asiakas
-                    # information takes precedence.
-                    urakoitsija_tunnus = asiakas.asiakasnumero.jarjestelma
-
-                    kohdentumaton = import_asiakastiedot(
-                        session,
-                        asiakas,
-                        jkr_data.alkupvm,
-                        jkr_data.loppupvm,
-                        tiedontuottajat[urakoitsija_tunnus],
-                        not ala_luo,
-                        not ala_paivita_yhteystietoja,
-                        not ala_paivita_kohdetta,
-                        prt_counts,
-                        kitu_counts,
-                        address_counts,
+                staging = None
+                kohde_resolver = None
+                if massatuonti:
+                    logger.info("Haetaan asiakasnumerot massatuontina")
+                    staging = AsiakasStaging(session)
+                    staging.stage(avaimet)
+                    session.commit()
+                    resolver = staging.resolver
+                else:
+                    logger.info("Haetaan urakoitsijoiden asiakastiedot")
+                    resolver = UlkoinenAsiakastietoResolver()
+                    resolver.load(session, urakoitsijat)
+                if ala_luo and ala_paivita_kohdetta:
+                    # Kohteet don't change, so they may be found a chunk of
+                    # asiakkaat at a time
+                    kohde_resolver = AsiakasKohdeResolver(session, avaimet)
+
+                if not ala_luo:
+                    logger.info("Haetaan asiakkaiden rakennukset")
+                    building_index.load(session, avaimet)
+                    address_index.load(session, avaimet)
+
+                # Kohdentumattomat are written to the file during the import, so
+                # they need not be kept in memory
+                with KohdentumattomatKuljetukset(siirtotiedosto) as sink:
+                    logger.info("Importoidaan asiakastiedot")
+                    uncommitted = 0
+                    for asiakas in asiakkaat:
+                        logger.debug("importing %s", asiakas)
+                        progress.tick()
+
+                        # Asiakastieto may come from different urakoitsija than the
+                        # immediate tiedontuottaja. In such a case, the asiakas
+                        # information takes precedence.
+                        urakoitsija_tunnus = asiakas.asiakasnumero.jarjestelma
+
+                        uusi_asiakas = resolver.get(asiakas.asiakasnumero) is None
+                        kuljetukset_count = staging.kuljetukset_count if staging else 0
+                        try:
+                            # Each asiakas has its own savepoint, so that a failing
+                            # asiakas does not roll back the whole batch.
+                            with session.begin_nested():
+                                kohdentumaton = import_asiakastiedot(
+                                    session,
+                                    asiakas,
+                                    jkr_data.alkupvm,
+                                    jkr_data.loppupvm,
+                                    tiedontuottajat[urakoitsija_tunnus],
+                                    not ala_luo,
+                                    not ala_paivita_yhteystietoja,
+                                    not ala_paivita_kohdetta,
+                                    prt_counts,
+                                    kitu_counts,
+                                    address_counts,
+                                    staging,
+                                    resolver,
+                                    kohde_resolver,
+                                )
+                        except Exception as e:
+                            logger.exception(e)
+                            kohdentumaton = asiakas
+                            # Forget anything created for the asiakas
+                            if uusi_asiakas:
+                                resolver.discard(asiakas.asiakasnumero)
+                            if staging:
+                                staging.discard_kuljetukset(kuljetukset_count)
+                            get_or_create_pseudokohde.cache_clear()
+                        if kohdentumaton:
+                            sink.add(kohdentumaton)
+
+                        if staging and staging.kuljetukset_count >= KULJETUS_BATCH_SIZE:
+                            staging.insert_kuljetukset()
+                        uncommitted += 1
+                        if uncommitted >= commit_every:
+                            session.commit()
+                            uncommitted = 0
+                    if staging:
+                        staging.insert_kuljetukset()
+                    session.commit()
+                    progress.complete()
+
+                if sink.count:
+                    logger.info(
+                        "Kohdentumattomat tiedot lisätty CSV-tiedostoon: %s",
+                        sink.path,
                     )
-                    if kohdentumaton:
-                        asiakas_dict = kohdentumaton.__dict__
-                        kohdentumattomat.append(asiakas_dict)
-                session.commit()
-                progress.complete()
-
-                if kohdentumattomat:
-                    for kohdentumaton in kohdentumattomat:
-
-                        # Rebuild rows to insert into the error .csv
-                        rows = []
-                        for ii, _ in enumerate(
-                            kohdentumaton["ulkoinen_asiakastieto"].kaynnit
-                        ):
-                            row_data = {
-                                "UrakoitsijaId": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].UrakoitsijaId,
-                                "UrakoitsijankohdeId": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].UrakoitsijankohdeId,
-                                "Kiinteistotunnus": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Kiinteistotunnus,
-                                "Kiinteistonkatuosoite": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Kiinteistonkatuosoite,
-                                "Kiinteistonposti": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Kiinteistonposti,
-                                "Haltijannimi": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Haltijannimi,
-                                "Haltijanyhteyshlo": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Haltijanyhteyshlo,
-                                "Haltijankatuosoite": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Haltijankatuosoite,
-                                "Haltijanposti": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Haltijanposti,
-                                "Haltijanmaakoodi": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Haltijanmaakoodi,
-                                "Pvmalk": kohdentumaton["voimassa"].lower.strftime(
-                                    "%d.%m.%Y"
-                                ),
-                                "Pvmasti": kohdentumaton["voimassa"].upper.strftime(
-                                    "%d.%m.%Y"
-                                ),
-                                "tyyppiIdEWC": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].tyyppiIdEWC,
-                                "COUNT(kaynnit)": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].kaynnit[ii],
-                                "SUM(astiamaara)": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].astiamaara,
-                                "koko": kohdentumaton["ulkoinen_asiakastieto"].koko,
-                                "SUM(paino)": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].paino[ii],
-                                "tyhjennysvali": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].tyhjennysvali[
-                                    ii * 2
-                                ],  # two tyhjennysvalis per row
-                                "kertaaviikossa": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].kertaaviikossa[ii * 2],
-                                "Voimassaoloviikotalkaen": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Voimassaoloviikotalkaen[ii * 2],
-                                "Voimassaoloviikotasti": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Voimassaoloviikotasti[ii * 2],
-                                "palveluKimppakohdeId": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].palveluKimppakohdeId,
-                                "KimpanNimi": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].kimpanNimi,
-                                "Kimpanyhteyshlo": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Kimpanyhteyshlo,
-                                "Kimpankatuosoite": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Kimpankatuosoite,
-                                "Kimpanposti": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Kimpanposti,
-                                "Kuntatun": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Kuntatun,
-                                "Keskeytysalkaen": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Keskeytysalkaen,
-                                "Keskeytysasti": kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Keskeytysasti,
-                            }
-                            if (
-                                kohdentumaton["ulkoinen_asiakastieto"].tyhjennysvali[
-                                    ii * 2 + 1
-                                ]
-                                is not None
-                            ):
-                                row_data["tyhjennysvali2"] = kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].tyhjennysvali[ii * 2 + 1]
-                            if (
-                                kohdentumaton["ulkoinen_asiakastieto"].kertaaviikossa[
-                                    ii * 2 + 1
-                                ]
-                                is not None
-                            ):
-                                row_data["kertaaviikossa2"] = kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].kertaaviikossa[ii * 2 + 1]
-                            if (
-                                kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Voimassaoloviikotalkaen[ii * 2 + 1]
-                                is not None
-                            ):
-                                row_data["Voimassaoloviikotalkaen2"] = kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Voimassaoloviikotalkaen[ii * 2 + 1]
-                            if (
-                                kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Voimassaoloviikotasti[ii * 2 + 1]
-                                is not None
-                            ):
-                                row_data["Voimassaoloviikotasti2"] = kohdentumaton[
-                                    "ulkoinen_asiakastieto"
-                                ].Voimassaoloviikotasti[ii * 2 + 1]
-                            rows.append(row_data)
-
-                        csv_path = (
-                            siirtotiedosto
-                            / get_kohdentumattomat_siirtotiedosto_filename()
-                        )
-                        with open(
-                            csv_path, mode="a", encoding="cp1252", newline=""
-                        ) as csv_file:
-                            csv_writer = csv.DictWriter(
-                                csv_file,
-                                fieldnames=get_siirtotiedosto_headers(),
-                                delimiter=";",
-                                quotechar='"',
-                            )
-                            for rd in rows:
-                                csv_writer.writerow(rd)
-
-                    print(f"Kohdentumattomat tiedot lisätty CSV-tiedostoon: {csv_path}")
                 else:
-                    print("Ei kohdentumattomia tietoja.")
+                    logger.info("Ei kohdentumattomia tietoja.")
 
+        except TranslationError:
+            # The asiakkaat imported before the error are already committed, so
+            # the import must fail
+            raise
         except Exception as e:
             logger.exception(e)
         finally:
+            building_index.clear()
+            address_index.clear()
+            # Geometries are also cached while finding kohteet for asiakkaat
+            geometry_cache.clear()
             logger.debug(building_counts)
 
     def write_dvv_kohteet(
@@ -549,9 +597,11 @@ class DbProvider:
         combine dvv buildings with the same customer id.
         """
         try:
-            with Session(engine) as session:
+            # The DVV snapshot is kept for the whole import. Expiring it on commit
+            # would refresh the buildings from the database one by one.
+            with Session(engine, expire_on_commit=False) as session:
                 init_code_objects(session)
-                print("Luodaan kohteet")
+                logger.info("Luodaan kohteet")
                 import_dvv_kohteet(session, poimintapvm, loppupvm, perusmaksutiedosto)
 
         except Exception as e:
@@ -572,20 +622,20 @@ class DbProvider:
         try:
             with Session(engine) as session:
                 init_code_objects(session)
-                print("Importoidaan ilmoitukset")
+                logger.info("Importoidaan ilmoitukset")
                 kohteet = []
                 for ilmoitus in ilmoitus_list:
                     kompostorin_kohde = find_kohde_by_prt(session, ilmoitus)
                     if kompostorin_kohde:
-                        print(f"Kompostorin kohde: {kompostorin_kohde}")
+                        logger.debug("Kompostorin kohde: %s", kompostorin_kohde)
                         osapuoli = create_or_update_komposti_yhteyshenkilo(
                             session, kompostorin_kohde, ilmoitus
                         )
                         osoite_id = find_osoite_by_prt(session, ilmoitus)
                         if not osoite_id:
-                            print(
-                                "Ei löytynyt osoite_id:tä rakennus: "
-                                + f"{ilmoitus.sijainti_prt}"
+                            logger.info(
+                                "Ei löytynyt osoite_id:tä rakennus: %s",
+                                ilmoitus.sijainti_prt,
                             )
                             kohdentumattomat.append(ilmoitus.rawdata)
                             continue
@@ -598,14 +648,16 @@ class DbProvider:
                             Kompostori.osapuoli_id == osapuoli.id
                         ).first()
                         if existing_kompostori:
-                            print("Vastaava kompostori löydetty, ohitetaan luonti...")
+                            logger.debug(
+                                "Vastaava kompostori löydetty, ohitetaan luonti..."
+                            )
                             komposti = existing_kompostori
                         # Based on the comments on 23.2.2024, do not set ending dates
                         # for Kompostori if new ilmoitus with the same vastuuhenkilo and
                         # sijainti is added, even if the dates are different. Only set
                         # end dates when lopetus ilmoitus is added.
                         else:
-                            print("Lisätään uusi kompostori...")
+                            logger.debug("Lisätään uusi kompostori...")
                             komposti = Kompostori(
                                 alkupvm=ilmoitus.alkupvm,
                                 loppupvm=ilmoitus.loppupvm,
@@ -627,9 +679,11 @@ class DbProvider:
                                         KompostorinKohteet.kohde_id == kohde.id
                                 ).first()
                                 if existing_kohde:
-                                    print("Kohde on jo kompostorin kohteissa...")
+                                    logger.debug("Kohde on jo kompostorin kohteissa...")
                                 else:
-                                    print("Lisätään kohde kompostorin kohteisiin...")
+                                    logger.debug(
+                                        "Lisätään kohde kompostorin kohteisiin..."
+                                    )
                                     session.add(
                                         KompostorinKohteet(
                                             kompostori=komposti,
@@ -653,8 +707,9 @@ class DbProvider:
             logger.exception(e)
 
         if kohdentumattomat:
-            print(
-                f"Tallennetaan kohdentumattomat ilmoitukset ({len(kohdentumattomat)}) tiedostoon"
+            logger.info(
+                "Tallennetaan kohdentumattomat ilmoitukset (%s) tiedostoon",
+                len(kohdentumattomat),
             )
             export_kohdentumattomat_ilmoitukset(
                 os.path.dirname(ilmoitustiedosto), kohdentumattomat
@@ -674,15 +729,15 @@ class DbProvider:
         try:
             with Session(engine) as session:
                 init_code_objects(session)
-                print("Importoidaan lopetusilmoitukset")
+                logger.info("Importoidaan lopetusilmoitukset")
                 for ilmoitus in lopetusilmoitus_list:
                     kompostorin_kohde = find_kohde_by_prt(session, ilmoitus)
                     if kompostorin_kohde:
                         osoite_id = find_osoite_by_prt(session, ilmoitus)
                         if not osoite_id:
-                            print(
-                                "Ei löytynyt osoite_id:tä rakennukselle: "
-                                + f"{ilmoitus.prt}"
+                            logger.info(
+                                "Ei löytynyt osoite_id:tä rakennukselle: %s",
+                                ilmoitus.prt,
                             )
                             kohdentumattomat.append(ilmoitus.rawdata)
                             continue
@@ -694,24 +749,31 @@ class DbProvider:
                             Kompostori.loppupvm > ilmoitus.Vastausaika
                         ).all()
                         if ending_kompostorit:
-                            print(
-                                f"Lopetettavia kompostoreita löytynyt {len(ending_kompostorit)} kpl."
+                            logger.debug(
+                                "Lopetettavia kompostoreita löytynyt %s kpl.",
+                                len(ending_kompostorit),
                             )
                             for kompostori in ending_kompostorit:
                                 kompostori.loppupvm = ilmoitus.Vastausaika
                             session.commit()
                         else:
-                            print("Lopetettavia voimassaolevia kompostoreita ei löytynyt...")
+                            logger.debug(
+                                "Lopetettavia voimassaolevia kompostoreita ei "
+                                "löytynyt..."
+                            )
                     else:
-                        print(f"Kohdetta ei löytynyt rakennuksella: {ilmoitus.prt}")
+                        logger.info(
+                            "Kohdetta ei löytynyt rakennuksella: %s", ilmoitus.prt
+                        )
                         kohdentumattomat.append(ilmoitus.rawdata)
                 session.commit()
         except Exception as e:
             logger.exception(e)
 
         if kohdentumattomat:
-            print(
-                f"Tallennetaan kohdentumattomat lopetusilmoitukset ({len(kohdentumattomat)}) tiedostoon"
+            logger.info(
+                "Tallennetaan kohdentumattomat lopetusilmoitukset (%s) tiedostoon",
+                len(kohdentumattomat),
             )
             export_kohdentumattomat_lopetusilmoitukset(
                 os.path.dirname(ilmoitustiedosto), kohdentumattomat
@@ -727,7 +789,7 @@ class DbProvider:
         try:
             with Session(engine) as session:
                 init_code_objects(session)
-                print("Importoidaan päätökset")
+                logger.info("Importoidaan päätökset")
                 for paatos in paatos_list:
                     rakennus_id = find_single_building_id_by_prt(session, paatos.prt)
                     if rakennus_id:
@@ -768,8 +830,9 @@ class DbProvider:
             logger.exception(e)
 
         if kohdentumattomat:
-            print(
-                f"Tallennetaan kohdentumattomat päätökset ({len(kohdentumattomat)}) tiedostoon"
+            logger.info(
+                "Tallennetaan kohdentumattomat päätökset (%s) tiedostoon",
+                len(kohdentumattomat),
             )
             export_kohdentumattomat_paatokset(
                 os.path.dirname(paatostiedosto), kohdentumattomat
@@ -1,11 +1,15 @@
 import warnings
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
 from geoalchemy2 import Geometry  # noqa: F401, must be imported for Geometry reflect
 from sqlalchemy import Column, ForeignKey, Integer, Table
 from sqlalchemy.ext.automap import automap_base, generate_relationship
 from sqlalchemy.orm import backref, relationship
 
-from jkrimporter.providers.db.database import engine
+from jkrimporter import conf
+from jkrimporter.providers.db.database import get_engine
+from jkrimporter.providers.db.snapshot import load_schema
 
 Base = automap_base()
 
@@ -83,6 +87,7 @@ def name_for_collection(base, local_cls, referred_cls, constraint):
 
 # Define any association tables that need to be directly insertable.
 # Sqlalchemy only generates them automatically if they have extra columns.
+# Like the other models, they can only be used after prepare_models.
 
 class KohteenRakennukset(Base):
     __tablename__ = "kohteen_rakennukset"
@@ -98,78 +103,162 @@ class KompostorinKohteet(Base):
     kohde_id = Column(ForeignKey("jkr.kohde.id"), primary_key=True)
 
 
-# Rest of the tables can be defined automatically
-with warnings.catch_warnings():
-    warnings.filterwarnings(
-        "ignore",
-        message="Skipped unsupported reflection of expression-based index idx_osoite_lower_katu_fi",
+# Rest of the tables are defined automatically by prepare_models. The classes are
+# available as module attributes, e.g. models.Kohde, once the models are prepared.
+MODEL_TABLES = {
+    "AKPPoistoSyy": "akppoistosyy",
+    "Jatetyyppi": "jatetyyppi",
+    "Jatteenkuljetusalue": "jatteenkuljetusalue",
+    "Katu": "katu",
+    "Keraysvaline": "keraysvaline",
+    "Keraysvalinetyyppi": "keraysvalinetyyppi",
+    "Keskeytys": "keskeytys",
+    "Kiinteisto": "kiinteisto",
+    "Kohde": "kohde",
+    "Kohdetyyppi": "kohdetyyppi",
+    "KohteenOsapuolet": "kohteen_osapuolet",
+    "Kompostori": "kompostori",
+    "Kuljetus": "kuljetus",
+    "Kunta": "kunta",
+    "Osapuolenlaji": "osapuolenlaji",
+    "Osapuoli": "osapuoli",
+    "Osapuolenrooli": "osapuolenrooli",
+    "Osoite": "osoite",
+    "Paatostulos": "paatostulos",
+    "Pohjavesialue": "pohjavesialue",
+    "Posti": "posti",
+    "Rakennuksenkayttotarkoitus": "rakennuksenkayttotarkoitus",
+    "Rakennuksenolotila": "rakennuksenolotila",
+    "RakennuksenOmistajat": "rakennuksen_omistajat",  # has extra fields
+    "RakennuksenVanhimmat": "rakennuksen_vanhimmat",  # has extra fields
+    "Rakennus": "rakennus",
+    "Sopimus": "sopimus",
+    "SopimusTyyppi": "sopimustyyppi",
+    "Taajama": "taajama",
+    "Tapahtumalaji": "tapahtumalaji",
+    "Tiedontuottaja": "tiedontuottaja",
+    "Tyhjennysvali": "tyhjennysvali",
+    "UlkoinenAsiakastieto": "ulkoinen_asiakastieto",
+    "Velvoite": "velvoite",
+    "Velvoitemalli": "velvoitemalli",
+    "Viranomaispaatokset": "viranomaispaatokset",
+}
+
+if TYPE_CHECKING:
+    from typing import Any
+
+    # Set by prepare_models
+    AKPPoistoSyy: "Any"
+    Jatetyyppi: "Any"
+    Jatteenkuljetusalue: "Any"
+    Katu: "Any"
+    Keraysvaline: "Any"
+    Keraysvalinetyyppi: "Any"
+    Keskeytys: "Any"
+    Kiinteisto: "Any"
+    Kohde: "Any"
+    Kohdetyyppi: "Any"
+    KohteenOsapuolet: "Any"
+    Kompostori: "Any"
+    Kuljetus: "Any"
+    Kunta: "Any"
+    Osapuolenlaji: "Any"
+    Osapuoli: "Any"
+    Osapuolenrooli: "Any"
+    Osoite: "Any"
+    Paatostulos: "Any"
+    Pohjavesialue: "Any"
+    Posti: "Any"
+    Rakennuksenkayttotarkoitus: "Any"
+    Rakennuksenolotila: "Any"
+    RakennuksenOmistajat: "Any"
+    RakennuksenVanhimmat: "Any"
+    Rakennus: "Any"
+    Sopimus: "Any"
+    SopimusTyyppi: "Any"
+    Taajama: "Any"
+    Tapahtumalaji: "Any"
+    Tiedontuottaja: "Any"
+    Tyhjennysvali: "Any"
+    UlkoinenAsiakastieto: "Any"
+    Velvoite: "Any"
+    Velvoitemalli: "Any"
+    Viranomaispaatokset: "Any"
+
+
+@lru_cache(maxsize=None)
+def prepare_models():
+    """
+    Reflects the jkr schema and maps the model classes. Reflection is deferred
+    until the first model class is used, so that commands not using the database
+    don't connect to it at all.
+
+    With JKR_SCHEMA_SNAPSHOT set, the schema is read from a snapshot matching the
+    Flyway schema version of the database instead of reflecting it every time.
+    """
+    engine = get_engine()
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            "ignore",
+            message=(
+                "Skipped unsupported reflection of expression-based index "
+                "idx_osoite_lower_katu_fi"
+            ),
+        )
+        # warnings.simplefilter("ignore", category=sa_exc.SAWarning)
+
+        if conf.schema_snapshot:
+            load_schema(engine, Base.metadata, schema="jkr")
+            Base.prepare(
+                name_for_scalar_relationship=name_for_scalar,
+                name_for_collection_relationship=name_for_collection,
+            )
+        else:
+            Base.prepare(
+                engine,
+                name_for_scalar_relationship=name_for_scalar,
+                name_for_collection_relationship=name_for_collection,
+                # generate_relationship=generate_relationship,
+                reflect=True,
+                reflection_options={"schema": "jkr"},
+            )
+
+    models = {name: Base.classes[table] for name, table in MODEL_TABLES.items()}
+    Osapuoli = models["Osapuoli"]
+    RakennuksenOmistajat = models["RakennuksenOmistajat"]
+    RakennuksenVanhimmat = models["RakennuksenVanhimmat"]
+    Rakennus = models["Rakennus"]
+
+    # Add associations to association tables with extra fields.
+    # Vanhimmat:
+    Rakennus.vanhimmat = relationship(RakennuksenVanhimmat, back_populates="rakennus")
+    RakennuksenVanhimmat.rakennus = relationship(Rakennus, back_populates="vanhimmat")
+    Osapuoli.kotirakennukset = relationship(
+        RakennuksenVanhimmat, back_populates="osapuoli"
+    )
+    RakennuksenVanhimmat.osapuoli = relationship(
+        Osapuoli, back_populates="kotirakennukset"
     )
-    # warnings.simplefilter("ignore", category=sa_exc.SAWarning)
-
-    Base.prepare(
-        engine,
-        name_for_scalar_relationship=name_for_scalar,
-        name_for_collection_relationship=name_for_collection,
-        # generate_relationship=generate_relationship,
-        reflect=True,
-        reflection_options={"schema": "jkr"},
+
+    # Omistajat:
+    Rakennus.omistajat = relationship(RakennuksenOmistajat, back_populates="rakennus")
+    RakennuksenOmistajat.rakennus = relationship(Rakennus, back_populates="omistajat")
+    Osapuoli.omistetut_rakennukset = relationship(
+        RakennuksenOmistajat, back_populates="osapuoli"
+    )
+    RakennuksenOmistajat.osapuoli = relationship(
+        Osapuoli, back_populates="omistetut_rakennukset"
     )
 
+    globals().update(models)
+
+
+def __getattr__(name):
+    if name in MODEL_TABLES:
+        prepare_models()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-AKPPoistoSyy = Base.classes.akppoistosyy
-Jatetyyppi = Base.classes.jatetyyppi
-Jatteenkuljetusalue = Base.classes.jatteenkuljetusalue
-Katu = Base.classes.katu
-Keraysvaline = Base.classes.keraysvaline
-Keraysvalinetyyppi = Base.classes.keraysvalinetyyppi
-Keskeytys = Base.classes.keskeytys
-Kiinteisto = Base.classes.kiinteisto
-Kohde = Base.classes.kohde
-Kohdetyyppi = Base.classes.kohdetyyppi
-KohteenOsapuolet = Base.classes.kohteen_osapuolet
-Kompostori = Base.classes.kompostori
-Kuljetus = Base.classes.kuljetus
-Kunta = Base.classes.kunta
-Osapuolenlaji = Base.classes.osapuolenlaji
-Osapuoli = Base.classes.osapuoli
-Osapuolenrooli = Base.classes.osapuolenrooli
-Osoite = Base.classes.osoite
-Paatostulos = Base.classes.paatostulos
-Pohjavesialue = Base.classes.pohjavesialue
-Posti = Base.classes.posti
-Rakennuksenkayttotarkoitus = Base.classes.rakennuksenkayttotarkoitus
-Rakennuksenolotila = Base.classes.rakennuksenolotila
-RakennuksenOmistajat = Base.classes.rakennuksen_omistajat  # has extra fields
-RakennuksenVanhimmat = Base.classes.rakennuksen_vanhimmat  # has extra fields
-Rakennus = Base.classes.rakennus
-Sopimus = Base.classes.sopimus
-SopimusTyyppi = Base.classes.sopimustyyppi
-Taajama = Base.classes.taajama
-Tapahtumalaji = Base.classes.tapahtumalaji
-Tiedontuottaja = Base.classes.tiedontuottaja
-Tyhjennysvali = Base.classes.tyhjennysvali
-UlkoinenAsiakastieto = Base.classes.ulkoinen_asiakastieto
-Velvoite = Base.classes.velvoite
-Velvoitemalli = Base.classes.velvoitemalli
-Viranomaispaatokset = Base.classes.viranomaispaatokset
-
-
-# Add associations to association tables with extra fields.
-# Vanhimmat:
-Rakennus.vanhimmat = relationship(RakennuksenVanhimmat, back_populates="rakennus")
-RakennuksenVanhimmat.rakennus = relationship(Rakennus, back_populates="vanhimmat")
-Osapuoli.kotirakennukset = relationship(RakennuksenVanhimmat, back_populates="osapuoli")
-RakennuksenVanhimmat.osapuoli = relationship(Osapuoli, back_populates="kotirakennukset")
-
-# Omistajat:
-Rakennus.omistajat = relationship(RakennuksenOmistajat, back_populates="rakennus")
-RakennuksenOmistajat.rakennus = relationship(Rakennus, back_populates="omistajat")
-Osapuoli.omistetut_rakennukset = relationship(
-    RakennuksenOmistajat, back_populates="osapuoli"
-)
-RakennuksenOmistajat.osapuoli = relationship(
-    Osapuoli, back_populates="omistetut_rakennukset"
-)
 
 if __name__ == "__main__":
     ...
@@ -183,7 +272,7 @@ if __name__ == "__main__":
 
     from sqlalchemy.orm import Session
 
-    with Session(engine) as session:
+    with Session(get_engine()) as session:
         s = select(Rakennus).limit(1)
         r = session.execute(s).scalar_one()
         print(r.kohde_collection)
@@ -202,12 +291,15 @@ __all__ = [
     "Jatteenkuljetusalue",
     "Katu",
     "Keraysvaline",
+    "Keraysvalinetyyppi",
     "Keskeytys",
     "Kiinteisto",
     "Kohde",
     "Kohdetyyppi",
     "KohteenOsapuolet",
     "KohteenRakennukset",
+    "Kompostori",
+    "KompostorinKohteet",
     "Kuljetus",
     "Kunta",
     "Osapuolenlaji",
@@ -223,6 +315,7 @@ __all__ = [
     "RakennuksenVanhimmat",
     "Rakennus",
     "Sopimus",
+    "SopimusTyyppi",
     "Taajama",
     "Tapahtumalaji",
     "Tiedontuottaja",
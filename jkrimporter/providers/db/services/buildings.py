@@ -1,4 +1,6 @@
 import logging
+import math
+from array import array
 from collections import defaultdict
 from typing import TYPE_CHECKING, Dict, List, Union
 
@@ -21,6 +23,7 @@ from ..models import (
     RakennuksenVanhimmat,
     Rakennus,
 )
+from .indexes import AddressQuery, address_index, address_query, building_index
 
 logger = logging.getLogger(__name__)
 
@@ -28,23 +31,101 @@ DISTANCE_LIMIT = 300
 AREA_LIMIT = 30000
 
 if TYPE_CHECKING:
+    from typing import Optional, Tuple
+
     from sqlalchemy.orm import Session
 
-    from jkrimporter.model import Asiakas, Yhteystieto, JkrIlmoitukset, LopetusIlmoitus
+    from jkrimporter.model import (
+        Asiakas,
+        JkrIlmoitukset,
+        LopetusIlmoitus,
+        Yhteystieto,
+    )
+    from jkrimporter.utils.intervals import IntervalIndex
+
+
+class BuildingGeometryCache:
+    """
+    Coordinates of buildings by rakennus id. Building geometries are points, so
+    we only need to parse them once per run. The coordinates are stored in a flat
+    array to keep the cache small even with all DVV buildings loaded.
+    """
+
+    def __init__(self):
+        self._index: Dict[int, int] = {}
+        self._coordinates = array("d")
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, rakennus_id: int, x: float, y: float):
+        if rakennus_id in self._index:
+            position = self._index[rakennus_id]
+            self._coordinates[position] = x
+            self._coordinates[position + 1] = y
+        else:
+            self._index[rakennus_id] = len(self._coordinates)
+            self._coordinates.extend((x, y))
+
+    def load(self, session: "Session"):
+        """
+        Loads the coordinates of all located buildings, letting the database
+        decode the geometries.
+        """
+        rows = session.execute(
+            select(
+                Rakennus.id,
+                sqlalchemyFunc.ST_X(Rakennus.geom),
+                sqlalchemyFunc.ST_Y(Rakennus.geom),
+            ).filter(Rakennus.geom.is_not(None))
+        )
+        for rakennus_id, x, y in rows:
+            self.add(rakennus_id, x, y)
+        logger.debug("Loaded coordinates of %s buildings", len(self))
+
+    def clear(self):
+        self._index = {}
+        self._coordinates = array("d")
+
+    def get(self, building) -> "Optional[Tuple[float, float]]":
+        position = self._index.get(building.id)
+        if position is not None:
+            return self._coordinates[position], self._coordinates[position + 1]
+        if not building.geom:
+            return None
+        point = to_shape(building.geom)
+        if not point:
+            return None
+        if building.id is not None:
+            self.add(building.id, point.x, point.y)
+        return point.x, point.y
+
+
+geometry_cache = BuildingGeometryCache()
+
+
+def building_point(building) -> "Optional[Tuple[float, float]]":
+    """
+    Returns the coordinates of the building, or None if the location is unknown.
+    """
+    return geometry_cache.get(building)
 
 
 def minimum_distance_of_buildings(buildings):
     """
     Returns closest distance of the furthest building to any other building.
     """
-    points = [to_shape(building.geom) for building in buildings if building.geom]
+    points = [building_point(building) for building in buildings]
+    points = [point for point in points if point]
     largest_minimum = 0
-    for first_point in points:
+    for first_index, first_point in enumerate(points):
         minimum = None
         # iterate all other points to find closest point to each point
-        for second_point in points:
-            if second_point is not first_point:
-                distance = first_point.distance(second_point)
+        for second_index, second_point in enumerate(points):
+            if second_index != first_index:
+                distance = math.hypot(
+                    first_point[0] - second_point[0], first_point[1] - second_point[1]
+                )
                 if not minimum or distance < minimum:
                     minimum = distance
         # distance to the closest point is the new minimum distance
@@ -54,8 +135,8 @@ def minimum_distance_of_buildings(buildings):
 
 
 def convex_hull_area_of_buildings(buildings):
-    points = [to_shape(building.geom) for building in buildings if building.geom]
-    multipoint = MultiPoint(points)
+    points = [building_point(building) for building in buildings]
+    multipoint = MultiPoint([point for point in points if point])
 
     convex_hull = multipoint.convex_hull.buffer(6)
     area = convex_hull.area
@@ -89,15 +170,15 @@ def prt_on_single_customer_or_double_house(rakennukset, prt_counts):
 def find_buildings_for_kohde(
     session: "Session",
     asiakas: "Asiakas",
-    prt_counts: Dict[str, "IntervalCounter"],
-    kitu_counts: Dict[str, "IntervalCounter"],
-    address_counts: Dict[str, "IntervalCounter"],
+    prt_counts: Dict[str, "IntervalIndex"],
+    kitu_counts: Dict[str, "IntervalIndex"],
+    address_counts: Dict[str, "IntervalIndex"],
 ):
-    print("looking for buildings")
+    logger.debug("looking for buildings")
     counts["asiakkaita"] += 1
     rakennukset = []
     if asiakas.rakennukset:
-        print("has buildings already")
+        logger.debug("has buildings already")
         counts["on prt"] += 1
         on_how_many_customers = {
             prt: prt_counts[prt].count_overlapping(asiakas.voimassa)
@@ -129,7 +210,7 @@ def find_buildings_for_kohde(
         # kuljetustiedoissa ei yleensä prt:tä? => ei ajankohtaista?
 
     if asiakas.kiinteistot:
-        print("has kiinteistöt")
+        logger.debug("has kiinteistöt")
         counts["on kitu"] += 1
         if all(
             kitu_counts[kitu].count_overlapping(asiakas.voimassa) == 1
@@ -186,21 +267,20 @@ def find_buildings_for_kohde(
     #     )
     #     == 1
     # ):
-    print("trying to find by address")
+    logger.debug("trying to find by address")
     rakennukset = _find_by_address(session, asiakas.haltija)
     if rakennukset:
-        print("found some")
-        print([rakennus.id for rakennus in rakennukset])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("found some %s", [rakennus.id for rakennus in rakennukset])
         counts["osoitteella löytyi"] += 1
         omistajat = set()
         for rakennus in rakennukset:
             omistajat.add(
                 frozenset(omistaja.osapuoli_id for omistaja in rakennus.omistajat)
             )
-        print("has omistajat")
-        print(omistajat)
+        logger.debug("has omistajat %s", omistajat)
         omistajat = set(filter(lambda osapuolet: osapuolet, omistajat))
-        print(omistajat)
+        logger.debug(omistajat)
         # At the moment, return all buildings, even if they have different owners.
         # TODO: group buildings by owner sets. We are creating new kohteet here,
         # better use the same rules as with old dvv kohteet. Let's ask first if
@@ -216,7 +296,7 @@ def find_buildings_for_kohde(
         #     if len(rakennukset) == 1 or area < AREA_LIMIT:
         #         counts["osoitteella löytyi - kaikilla sama omistaja - koko ok"] += 1
         #         return rakennukset
-    print("couldnt find")
+    logger.debug("couldnt find")
     return []
 
 
@@ -240,6 +320,9 @@ def find_single_building_id_by_prt(session: "Session", prt: Rakennustunnus):
 
 def _find_by_ytunnus(session: "Session", haltija: "Yhteystieto"):
     if haltija.ytunnus:
+        rakennukset = building_index.by_ytunnus(haltija.ytunnus)
+        if rakennukset is not None:
+            return rakennukset
         statement = (
             select(Rakennus)
             .join(RakennuksenOmistajat)
@@ -252,6 +335,9 @@ def _find_by_ytunnus(session: "Session", haltija: "Yhteystieto"):
 
 
 def _find_by_kiinteisto(session: "Session", kitu_list: List[str]):
+    rakennukset = building_index.by_kiinteisto(kitu_list)
+    if rakennukset is not None:
+        return rakennukset
     statement = select(Rakennus).where(Rakennus.kiinteistotunnus.in_(kitu_list))
     rakennukset = session.execute(statement).scalars().all()
 
@@ -259,35 +345,31 @@ def _find_by_kiinteisto(session: "Session", kitu_list: List[str]):
 
 
 def _find_by_address(session: "Session", haltija: "Yhteystieto"):
-    try:
-        katunimi_lower = haltija.osoite.katunimi.lower().strip()
-    except AttributeError:
+    query = address_query(haltija)
+    if query is None:
         return ""
 
-    # The osoitenumero may contain dash. In that case, the buildings may be
-    # listed as separate in DVV data.
-    # Also. osoitenumero may be None and we must match to None too.
-    if haltija.osoite.osoitenumero and "-" in haltija.osoite.osoitenumero:
-        osoitenumerot = haltija.osoite.osoitenumero.split("-", maxsplit=1)
-    else:
-        osoitenumerot = [haltija.osoite.osoitenumero]
+    rakennukset = address_index.find(query)
+    if rakennukset is None:
+        rakennukset = _query_by_address(session, query)
+    return rakennukset
 
-    # The address parser parses Metsätie 33 A so that 33 is osoitenumero and A is
-    # huoneistotunnus. While the parsing is correct, it may very well also mean (and
-    # in many cases it means) osoitenumero 33a and empty huoneistonumero.
-    potential_osoitenumero_suffix = (
-        haltija.osoite.huoneistotunnus.lower() if haltija.osoite.huoneistotunnus else ""
-    )
-    if potential_osoitenumero_suffix:
+
+def _query_by_address(session: "Session", query: AddressQuery) -> "List[Rakennus]":
+    """
+    Finds the buildings by address in the database. AddressIndex.find must give the
+    same results.
+    """
+    if query.osoitenumero_suffix:
         # Find Metsätie 33a by Metsätie 33 A. For simplicity, let's not assume
         # 31-33a exists.
         osoitenumero_condition = and_(
-            Osoite.osoitenumero.ilike(haltija.osoite.osoitenumero + "%"),
-            Osoite.osoitenumero.ilike("%" + potential_osoitenumero_suffix),
+            Osoite.osoitenumero.ilike(query.osoitenumero + "%"),
+            Osoite.osoitenumero.ilike("%" + query.osoitenumero_suffix),
         )
     else:
         # Do *NOT* find Mukkulankatu 51 *AND* Mukkulankatu 51b by Mukkulankatu 51.
-        osoitenumero_condition = Osoite.osoitenumero.in_(osoitenumerot)
+        osoitenumero_condition = Osoite.osoitenumero.in_(query.osoitenumerot)
 
     # # Find Mukkulankatu 51 by Mukkulankatu 51 B.
     # # Only find Mukkulankatu 51 by Mukkulankatu 51.
@@ -297,36 +379,23 @@ def _find_by_address(session: "Session", haltija: "Yhteystieto"):
     # Do *NOT* find Sokeritopankatu 18 *AND* Sokeritopankatu 18a by
     # Sokeritopankatu 18 A. Looks like Sokeritopankatu 18, 18 A and 18 B are *all*
     # separate.
-    # For some unfathomable reason, huoneistotunnus contains merged kirjain and asunto.
-    # Why didn't we parse letter and apartment number separately?
-    huoneistokirjain, huoneistonumero = (
-        haltija.osoite.huoneistotunnus.split(" ", maxsplit=1)
-        if haltija.osoite.huoneistotunnus and " " in haltija.osoite.huoneistotunnus
-        else (haltija.osoite.huoneistotunnus, None)
-    )
     huoneisto_condition = and_(
         # Vanhin must live in the huoneisto with the same kirjain (and apartment number
         # *if* present).
-        Osoite.osoitenumero.in_(osoitenumerot),
-        RakennuksenVanhimmat.huoneistokirjain == huoneistokirjain,
-        RakennuksenVanhimmat.huoneistonumero == huoneistonumero,
+        Osoite.osoitenumero.in_(query.osoitenumerot),
+        RakennuksenVanhimmat.huoneistokirjain == query.huoneistokirjain,
+        RakennuksenVanhimmat.huoneistonumero == query.huoneistonumero,
     )
 
-    print(osoitenumero_condition)
-    print(osoitenumerot)
-    print(haltija.osoite.osoitenumero)
-    print(haltija.osoite.postinumero)
-    print(katunimi_lower)
-    print(huoneisto_condition)
-    print(haltija.osoite.huoneistotunnus)
+    logger.debug("%s %s %s", osoitenumero_condition, huoneisto_condition, query)
     statement = (
         select(Rakennus)
         .join(Osoite)
         .join(Katu)
         .outerjoin(RakennuksenVanhimmat)  # allow vapaa-ajanrakennukset
         .where(
-            Osoite.posti_numero == haltija.osoite.postinumero,
-            sqlalchemyFunc.lower(Katu.katunimi_fi) == katunimi_lower,
+            Osoite.posti_numero == query.postinumero,
+            sqlalchemyFunc.lower(Katu.katunimi_fi) == query.katunimi_lower,
             or_(
                 # Find vapaa-ajanrakennukset even if osoitenumero and kirjain and
                 # everything is empty.
@@ -341,12 +410,14 @@ def _find_by_address(session: "Session", haltija: "Yhteystieto"):
     )
 
     rakennukset = session.execute(statement).scalars().all()
-    print("query returned buildings")
-    print(rakennukset)
+    logger.debug("query returned buildings %s", rakennukset)
     return rakennukset
 
 
 def _find_by_prt(session: "Session", prt_list: List[Rakennustunnus]) -> List[Rakennus]:
+    rakennukset = building_index.by_prt(prt_list)
+    if rakennukset is not None:
+        return rakennukset
     statement = select(Rakennus).where(Rakennus.prt.in_(prt_list))
     rakennukset = session.execute(statement).scalars().all()
 
@@ -0,0 +1,372 @@
+import logging
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Union
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from jkrimporter.providers.db.utils import is_asoy
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Iterable, Optional, Set, Tuple
+
+    from sqlalchemy.orm import Session
+
+    from jkrimporter.model import Asiakas, AsiakasAvain, Yhteystieto
+
+    from ..models import Rakennus
+
+logger = logging.getLogger(__name__)
+
+# The indexes are filled in memory, so the models are only imported when an index
+# is loaded from the database. Lookups work without a database, e.g. in tests.
+
+# Number of keys in a single IN list when loading the building index
+IN_LIST_SIZE = 5000
+
+
+class BuildingIndex:
+    """
+    Buildings by prt, kiinteistötunnus and owner y-tunnus, fetched once for all
+    asiakkaat of the import with their owners loaded. Keys that were not loaded are
+    looked up from the database.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._by_prt: "Dict[str, List[Rakennus]]" = {}
+        self._by_kiinteisto: "Dict[str, List[Rakennus]]" = {}
+        self._by_ytunnus: "Dict[str, List[Rakennus]]" = {}
+
+    def load(
+        self,
+        session: "Session",
+        asiakkaat: "Iterable[Union[Asiakas, AsiakasAvain]]",
+    ):
+        from ..models import Osapuoli, RakennuksenOmistajat, Rakennus
+
+        prts = set()
+        kiinteistot = set()
+        ytunnukset = set()
+        for asiakas in asiakkaat:
+            prts.update(asiakas.rakennukset)
+            kiinteistot.update(asiakas.kiinteistot)
+            # Buildings are only looked up by y-tunnus for asunto-osakeyhtiöt
+            if asiakas.haltija.ytunnus and is_asoy(asiakas.haltija.nimi):
+                ytunnukset.add(asiakas.haltija.ytunnus)
+
+        _load_buildings(
+            session,
+            self._by_prt,
+            prts,
+            Rakennus.prt.in_,
+            lambda rakennus: [rakennus.prt],
+        )
+        _load_buildings(
+            session,
+            self._by_kiinteisto,
+            kiinteistot,
+            Rakennus.kiinteistotunnus.in_,
+            lambda rakennus: [rakennus.kiinteistotunnus],
+        )
+        _load_buildings(
+            session,
+            self._by_ytunnus,
+            ytunnukset,
+            lambda chunk: Rakennus.omistajat.any(
+                RakennuksenOmistajat.osapuoli.has(Osapuoli.ytunnus.in_(chunk))
+            ),
+            lambda rakennus: [
+                omistaja.osapuoli.ytunnus for omistaja in rakennus.omistajat
+            ],
+        )
+        logger.debug(
+            "Loaded buildings for %s prt, %s kiinteistötunnus and %s y-tunnus",
+            len(self._by_prt),
+            len(self._by_kiinteisto),
+            len(self._by_ytunnus),
+        )
+
+    def by_prt(self, prt_list: List[str]) -> "Optional[List[Rakennus]]":
+        return _lookup(self._by_prt, prt_list)
+
+    def by_kiinteisto(self, kitu_list: List[str]) -> "Optional[List[Rakennus]]":
+        return _lookup(self._by_kiinteisto, kitu_list)
+
+    def by_ytunnus(self, ytunnus: str) -> "Optional[List[Rakennus]]":
+        return _lookup(self._by_ytunnus, [ytunnus])
+
+
+def _load_buildings(
+    session: "Session",
+    index: "Dict[str, List[Rakennus]]",
+    keys: "Set[str]",
+    condition: "Callable[[List[str]], Any]",
+    keys_of: "Callable[[Rakennus], Iterable[str]]",
+):
+    from ..models import RakennuksenOmistajat, Rakennus
+
+    keys = sorted(keys)
+    for start in range(0, len(keys), IN_LIST_SIZE):
+        chunk = keys[start : start + IN_LIST_SIZE]
+        statement = (
+            select(Rakennus)
+            .where(condition(chunk))
+            .options(
+                selectinload(Rakennus.omistajat).selectinload(
+                    RakennuksenOmistajat.osapuoli
+                )
+            )
+        )
+        _add_buildings(index, chunk, session.execute(statement).scalars(), keys_of)
+
+
+def _add_buildings(
+    index: "Dict[str, List[Rakennus]]",
+    keys: List[str],
+    rakennukset: "Iterable[Rakennus]",
+    keys_of: "Callable[[Rakennus], Iterable[str]]",
+):
+    """
+    Adds the buildings under those of their keys that are loaded. All the keys are
+    loaded, also the ones without buildings.
+    """
+    for key in keys:
+        index[key] = []
+    keys = set(keys)
+    for rakennus in rakennukset:
+        for key in set(keys_of(rakennus)):
+            if key in keys:
+                index[key].append(rakennus)
+
+
+def _lookup(
+    index: "Dict[str, List[Rakennus]]", keys: List[str]
+) -> "Optional[List[Rakennus]]":
+    """
+    Returns the distinct buildings of all keys, or None if some key is not loaded.
+    """
+    if not all(key in index for key in keys):
+        return None
+    rakennukset = []
+    ids = set()
+    for key in keys:
+        for rakennus in index[key]:
+            if rakennus.id not in ids:
+                ids.add(rakennus.id)
+                rakennukset.append(rakennus)
+    return rakennukset
+
+
+building_index = BuildingIndex()
+
+
+class AddressQuery(NamedTuple):
+    """
+    The haltija address parts used to find buildings by address.
+    """
+
+    postinumero: "Optional[str]"
+    katunimi_lower: str
+    osoitenumero: "Optional[str]"
+    osoitenumerot: "List[Optional[str]]"
+    osoitenumero_suffix: str
+    huoneistokirjain: "Optional[str]"
+    huoneistonumero: "Optional[str]"
+
+
+def address_query(haltija: "Yhteystieto") -> "Optional[AddressQuery]":
+    try:
+        katunimi_lower = haltija.osoite.katunimi.lower().strip()
+    except AttributeError:
+        return None
+
+    # The osoitenumero may contain dash. In that case, the buildings may be
+    # listed as separate in DVV data.
+    # Also. osoitenumero may be None and we must match to None too.
+    if haltija.osoite.osoitenumero and "-" in haltija.osoite.osoitenumero:
+        osoitenumerot = haltija.osoite.osoitenumero.split("-", maxsplit=1)
+    else:
+        osoitenumerot = [haltija.osoite.osoitenumero]
+
+    # The address parser parses Metsätie 33 A so that 33 is osoitenumero and A is
+    # huoneistotunnus. While the parsing is correct, it may very well also mean (and
+    # in many cases it means) osoitenumero 33a and empty huoneistonumero.
+    potential_osoitenumero_suffix = (
+        haltija.osoite.huoneistotunnus.lower() if haltija.osoite.huoneistotunnus else ""
+    )
+
+    # For some unfathomable reason, huoneistotunnus contains merged kirjain and asunto.
+    # Why didn't we parse letter and apartment number separately?
+    huoneistokirjain, huoneistonumero = (
+        haltija.osoite.huoneistotunnus.split(" ", maxsplit=1)
+        if haltija.osoite.huoneistotunnus and " " in haltija.osoite.huoneistotunnus
+        else (haltija.osoite.huoneistotunnus, None)
+    )
+    return AddressQuery(
+        haltija.osoite.postinumero,
+        katunimi_lower,
+        haltija.osoite.osoitenumero,
+        osoitenumerot,
+        potential_osoitenumero_suffix,
+        huoneistokirjain,
+        huoneistonumero,
+    )
+
+
+class _IndexedOsoite(NamedTuple):
+    rakennus: "Rakennus"
+    osoitenumero: "Optional[str]"
+    # huoneistokirjain and huoneistonumero of the vanhimmat, (None, None) if the
+    # building has none
+    huoneistot: "List[Tuple[Optional[str], Optional[int]]]"
+
+
+class AddressIndex:
+    """
+    Addresses of buildings by postinumero and lowercase street name, loaded once
+    for the postinumerot of the import. The rules of buildings._query_by_address are
+    evaluated in Python. Addresses in other postinumerot are queried from the
+    database.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._postinumerot: "Set[str]" = set()
+        self._osoitteet: "Dict[Tuple[str, str], List[_IndexedOsoite]]" = {}
+
+    def load(
+        self,
+        session: "Session",
+        asiakkaat: "Iterable[Union[Asiakas, AsiakasAvain]]",
+    ):
+        from ..models import Katu, Osoite, RakennuksenVanhimmat, Rakennus
+
+        postinumerot = sorted(
+            {
+                asiakas.haltija.osoite.postinumero
+                for asiakas in asiakkaat
+                if asiakas.haltija.osoite.postinumero
+                and asiakas.haltija.osoite.katunimi
+            }
+        )
+        for start in range(0, len(postinumerot), IN_LIST_SIZE):
+            chunk = postinumerot[start : start + IN_LIST_SIZE]
+            huoneistot = defaultdict(list)
+            rows = session.execute(
+                select(
+                    RakennuksenVanhimmat.rakennus_id,
+                    RakennuksenVanhimmat.huoneistokirjain,
+                    RakennuksenVanhimmat.huoneistonumero,
+                )
+                .join(Osoite, Osoite.rakennus_id == RakennuksenVanhimmat.rakennus_id)
+                .where(Osoite.posti_numero.in_(chunk))
+                .distinct()
+            )
+            for rakennus_id, huoneistokirjain, huoneistonumero in rows:
+                huoneistot[rakennus_id].append((huoneistokirjain, huoneistonumero))
+
+            rows = session.execute(
+                select(
+                    Rakennus, Osoite.posti_numero, Katu.katunimi_fi, Osoite.osoitenumero
+                )
+                .join(Osoite)
+                .join(Katu)
+                .where(Osoite.posti_numero.in_(chunk))
+            )
+            for rakennus, posti_numero, katunimi_fi, osoitenumero in rows:
+                self.add(
+                    rakennus,
+                    posti_numero,
+                    katunimi_fi,
+                    osoitenumero,
+                    huoneistot.get(rakennus.id, []),
+                )
+            self.add_postinumerot(chunk)
+        logger.debug(
+            "Loaded %s street addresses in %s postinumero",
+            len(self._osoitteet),
+            len(self._postinumerot),
+        )
+
+    def add(
+        self,
+        rakennus: "Rakennus",
+        postinumero: str,
+        katunimi: "Optional[str]",
+        osoitenumero: "Optional[str]",
+        huoneistot: "List[Tuple[Optional[str], Optional[int]]]",
+    ):
+        """
+        Adds an address of the building, with the huoneistot of its vanhimmat.
+        """
+        if katunimi is None:
+            return
+        self._osoitteet.setdefault((postinumero, katunimi.lower()), []).append(
+            _IndexedOsoite(rakennus, osoitenumero, huoneistot or [(None, None)])
+        )
+
+    def add_postinumerot(self, postinumerot: "Iterable[str]"):
+        """
+        Marks all addresses in the postinumerot added.
+        """
+        self._postinumerot.update(postinumerot)
+
+    def find(self, query: AddressQuery) -> "Optional[List[Rakennus]]":
+        """
+        Returns the buildings found by the address, or None if the postinumero is
+        not loaded.
+        """
+        # Addresses without postinumero are never loaded
+        if query.postinumero not in self._postinumerot:
+            return None
+
+        osoitenumerot = {
+            osoitenumero for osoitenumero in query.osoitenumerot if osoitenumero
+        }
+        if query.osoitenumero_suffix:
+            # Same as ILIKE 'osoitenumero%' AND ILIKE '%suffix'
+            prefix = query.osoitenumero.lower()
+
+            def osoitenumero_matches(osoitenumero):
+                return (
+                    osoitenumero is not None
+                    and osoitenumero.lower().startswith(prefix)
+                    and osoitenumero.lower().endswith(query.osoitenumero_suffix)
+                )
+
+        else:
+
+            def osoitenumero_matches(osoitenumero):
+                return osoitenumero in osoitenumerot
+
+        try:
+            huoneistonumero = (
+                int(query.huoneistonumero)
+                if query.huoneistonumero is not None
+                else None
+            )
+        except ValueError:
+            huoneisto = None
+        else:
+            huoneisto = (query.huoneistokirjain, huoneistonumero)
+
+        rakennukset = []
+        ids = set()
+        key = (query.postinumero, query.katunimi_lower)
+        for osoite in self._osoitteet.get(key, []):
+            if osoite.rakennus.id in ids:
+                continue
+            if osoitenumero_matches(osoite.osoitenumero) or (
+                osoite.osoitenumero in osoitenumerot and huoneisto in osoite.huoneistot
+            ):
+                ids.add(osoite.rakennus.id)
+                rakennukset.append(osoite.rakennus)
+        return rakennukset
+
+
+address_index = AddressIndex()
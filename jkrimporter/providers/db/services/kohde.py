@@ -1,5 +1,5 @@
 import datetime
-import re
+import logging
 from collections import defaultdict
 from datetime import timedelta
 from functools import lru_cache
@@ -7,12 +7,24 @@ from typing import TYPE_CHECKING
 
 from openpyxl import load_workbook
 from psycopg2.extras import DateRange
-from sqlalchemy import and_, exists, or_, select, update
+from sqlalchemy import (
+    Date,
+    Integer,
+    and_,
+    column,
+    delete,
+    exists,
+    or_,
+    select,
+    update,
+    values,
+)
 from sqlalchemy import func as sqlalchemyFunc
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm.decl_api import DeclarativeMeta
 
 from jkrimporter.model import Asiakas, JkrIlmoitukset, LopetusIlmoitus, Yhteystieto
+from jkrimporter.utils.clustering import cluster_points
 
 from .. import codes
 from ..codes import KohdeTyyppi, OsapuolenrooliTyyppi, RakennuksenKayttotarkoitusTyyppi
@@ -33,8 +45,16 @@ from ..models import (
     UlkoinenAsiakastieto,
     Viranomaispaatokset,
 )
-from ..utils import clean_asoy_name, form_display_name, is_asoy, is_company, is_yhteiso
-from .buildings import DISTANCE_LIMIT, minimum_distance_of_buildings
+from ..utils import (
+    NameIndex,
+    asoy_name_tokens,
+    classify_name,
+    form_display_name,
+    match_name_tokens,
+    name_tokens,
+    overlaps_voimassa,
+)
+from .buildings import DISTANCE_LIMIT, building_point
 
 if TYPE_CHECKING:
     from pathlib import Path
@@ -44,6 +64,7 @@ if TYPE_CHECKING:
         Dict,
         FrozenSet,
         Hashable,
+        Iterable,
         List,
         NamedTuple,
         Optional,
@@ -55,7 +76,7 @@ if TYPE_CHECKING:
     from sqlalchemy.orm import Session
     from sqlalchemy.sql.selectable import Select
 
-    from jkrimporter.model import Asiakas, JkrIlmoitukset, Tunnus
+    from jkrimporter.model import Asiakas, AsiakasAvain, JkrIlmoitukset, Tunnus
 
     class Kohdetiedot(NamedTuple):
         kohde: Kohde
@@ -71,28 +92,47 @@ if TYPE_CHECKING:
         osoitteet: FrozenSet[Osoite]
 
 
-separators = [r"\s\&\s", r"\sja\s"]
-separator_regex = r"|".join(separators)
-
+logger = logging.getLogger(__name__)
 
 def match_name(first: str, second: str) -> bool:
     """
     Returns true if one name is subset of the other, i.e. the same name without extra
     parts. Consider typical separators combining names.
     """
-    first = re.split(separator_regex, first)
-    second = re.split(separator_regex, second)
-    if len(first) > 1 or len(second) > 1:
-        # TODO: if names have common surname, paste it to the name that is missing
-        # surname. Will take some detective work tho.
-        return any(
-            match_name(first_name, second_name)
-            for first_name in first
-            for second_name in second
-        )
-    first_parts = set(first[0].lower().split())
-    second_parts = set(second[0].lower().split())
-    return first_parts.issubset(second_parts) or second_parts.issubset(first_parts)
+    # TODO: if names have common surname, paste it to the name that is missing
+    # surname. Will take some detective work tho.
+    return match_name_tokens(name_tokens(first), name_tokens(second))
+
+
+def _first_matching_kohde_id(
+    names_by_kohde_id: "Dict[int, Set[Optional[str]]]",
+    names: "List[str]",
+    name_index: "Optional[NameIndex]" = None,
+) -> "Optional[int]":
+    """
+    Returns the first kohde with an osapuoli matching any of the names. The names
+    are looked up in name_index if it has the osapuolten nimet of the kohteet.
+    """
+    if name_index is not None:
+        matching = name_index.matching(names, names_by_kohde_id)
+        for kohde_id in names_by_kohde_id:
+            if kohde_id in matching:
+                logger.debug("%s match", names_by_kohde_id[kohde_id])
+                return kohde_id
+        return None
+
+    tokens = [asoy_name_tokens(name) for name in names]
+    for kohde_id, db_osapuoli_names in names_by_kohde_id.items():
+        for db_osapuoli_name in db_osapuoli_names:
+            if db_osapuoli_name is not None:
+                db_osapuoli_tokens = asoy_name_tokens(db_osapuoli_name)
+                if any(
+                    match_name_tokens(name_tokens, db_osapuoli_tokens)
+                    for name_tokens in tokens
+                ):
+                    logger.debug("%s match", db_osapuoli_name)
+                    return kohde_id
+    return None
 
 
 def is_aluekerays(asiakas: "Asiakas") -> bool:
@@ -112,6 +152,41 @@ def get_ulkoinen_asiakastieto(
         return None
 
 
+class UlkoinenAsiakastietoResolver:
+    """
+    Keeps the ulkoinen_asiakastieto rows of the imported urakoitsijat in memory, so
+    that they need not be queried separately for each asiakas.
+    """
+
+    def __init__(self):
+        self._asiakastiedot: "Dict[Tuple[str, str], UlkoinenAsiakastieto]" = {}
+
+    def load(self, session: "Session", urakoitsijat: "Iterable[str]"):
+        query = select(UlkoinenAsiakastieto).where(
+            UlkoinenAsiakastieto.tiedontuottaja_tunnus.in_(list(urakoitsijat))
+        )
+        for asiakastieto in session.execute(query).scalars():
+            self.add(asiakastieto)
+
+    def add(self, asiakastieto: "UlkoinenAsiakastieto"):
+        self._asiakastiedot[
+            (asiakastieto.tiedontuottaja_tunnus, asiakastieto.ulkoinen_id)
+        ] = asiakastieto
+
+    def get(self, ulkoinen_tunnus: "Tunnus") -> "Union[UlkoinenAsiakastieto, None]":
+        return self._asiakastiedot.get(
+            (ulkoinen_tunnus.jarjestelma, ulkoinen_tunnus.tunnus)
+        )
+
+    def discard(self, ulkoinen_tunnus: "Tunnus"):
+        self._asiakastiedot.pop(
+            (ulkoinen_tunnus.jarjestelma, ulkoinen_tunnus.tunnus), None
+        )
+
+    def __len__(self):
+        return len(self._asiakastiedot)
+
+
 def update_ulkoinen_asiakastieto(ulkoinen_asiakastieto, asiakas: "Asiakas"):
     if ulkoinen_asiakastieto.ulkoinen_asiakastieto != asiakas.ulkoinen_asiakastieto:
         ulkoinen_asiakastieto.ulkoinen_asiakastieto = asiakas.ulkoinen_asiakastieto
@@ -145,7 +220,7 @@ def find_kohteet_by_prt(
 
     for kompostoija in asiakas.kompostoijat:
         kompostoija_info = f"Nimi: {kompostoija.nimi}, Rakennus: {kompostoija.rakennus}"
-        print(f"Kompostoija: {kompostoija_info}")
+        logger.debug("Kompostoija: %s", kompostoija_info)
         query = (
             select(Kohde.id, Osapuoli.nimi)
             .join(Kohde.rakennus_collection)
@@ -167,11 +242,11 @@ def find_kohteet_by_prt(
         try:
             kohteet = session.execute(query).all()
         except NoResultFound:
-            print("Ei löytynyt kohdetta, prt: {kompostoija.rakennus}")
+            logger.debug("Ei löytynyt kohdetta, prt: %s", kompostoija.rakennus)
             not_found_prts.append(kompostoija.rakennus)
             continue
 
-        kompostoija_nimi = clean_asoy_name(kompostoija.nimi)
+        kompostoija_tokens = asoy_name_tokens(kompostoija.nimi)
         if len(kohteet) > 1:
             names_by_kohde_id = defaultdict(set)
             for kohde_id, db_osapuoli_name in kohteet:
@@ -179,22 +254,19 @@ def find_kohteet_by_prt(
             for kohde_id, db_osapuoli_names in names_by_kohde_id.items():
                 for db_osapuoli_name in db_osapuoli_names:
                     if db_osapuoli_name is not None:
-                        db_osapuoli_name = clean_asoy_name(db_osapuoli_name)
-                        print(kompostoija_nimi)
-                        print(db_osapuoli_name)
-                        if (
-                            match_name(kompostoija_nimi, db_osapuoli_name)
+                        if match_name_tokens(
+                            kompostoija_tokens, asoy_name_tokens(db_osapuoli_name)
                         ):
-                            print(f"{db_osapuoli_name} match")
+                            logger.debug("%s match", db_osapuoli_name)
                             kohde = session.get(Kohde, kohde_id)
-                            print("Adding kohde to list")
+                            logger.debug("Adding kohde to list")
                             found_kohteet.append(kohde)
         elif len(kohteet) == 1:
             kohde_id = kohteet[0][0]
             kohde = session.get(Kohde, kohde_id)
             found_kohteet.append(kohde)
         else:
-            print("Ei löytynyt kohdetta, prt: {kompostoija.rakennus}")
+            logger.debug("Ei löytynyt kohdetta, prt: %s", kompostoija.rakennus)
             not_found_prts.append(kompostoija.rakennus)
 
     return found_kohteet, not_found_prts
@@ -203,7 +275,7 @@ def find_kohteet_by_prt(
 def find_kohde_by_kiinteisto(
     session: "Session", asiakas: "Asiakas"
 ) -> "Union[Kohde, None]":
-    print(f"asiakas has kiinteistöt {asiakas.kiinteistot}")
+    logger.debug("asiakas has kiinteistöt %s", asiakas.kiinteistot)
     return _find_kohde_by_asiakastiedot(
         session, Rakennus.kiinteistotunnus.in_(asiakas.kiinteistot), asiakas
     )
@@ -212,7 +284,7 @@ def find_kohde_by_kiinteisto(
 def find_kohde_by_address(
     session: "Session", asiakas: "Asiakas"
 ) -> "Union[Kohde, None]":
-    print("matching by address:")
+    logger.debug("matching by address:")
     # The osoitenumero may contain dash. In that case, the buildings may be
     # listed as separate in DVV data.
     if (
@@ -223,7 +295,7 @@ def find_kohde_by_address(
     else:
         osoitenumerot = [asiakas.haltija.osoite.osoitenumero]
 
-    print(osoitenumerot)
+    logger.debug(osoitenumerot)
     # The address parser parses Metsätie 33 A so that 33 is osoitenumero and A is
     # huoneistotunnus. While the parsing is correct, it may very well also mean (and
     # in many cases it means) osoitenumero 33a and empty huoneistonumero.
@@ -239,7 +311,7 @@ def find_kohde_by_address(
         ]
     else:
         osoitenumerot_with_suffix = []
-    print(osoitenumerot_with_suffix)
+    logger.debug(osoitenumerot_with_suffix)
 
     # - Do *NOT* find Sokeritopankatu 18 *AND* Sokeritopankatu 18a by
     # Sokeritopankatu 18 A. Looks like Sokeritopankatu 18, 18 A and 18 B are *all*
@@ -260,7 +332,7 @@ def find_kohde_by_address(
         )
     else:
         osoitenumero_filter = Osoite.osoitenumero.in_(osoitenumerot)
-    print(osoitenumero_filter)
+    logger.debug(osoitenumero_filter)
 
     filter = and_(
         sqlalchemyFunc.lower(Osoite.posti_numero) == asiakas.haltija.osoite.postinumero,
@@ -272,7 +344,7 @@ def find_kohde_by_address(
         ),
         osoitenumero_filter,
     )
-    print(filter)
+    logger.debug(filter)
 
     return _find_kohde_by_asiakastiedot(session, filter, asiakas)
 
@@ -282,7 +354,7 @@ def _find_kohde_by_ilmoitustiedot(
         filter,
         ilmoitus: "LopetusIlmoitus"
 ) -> "Union[Kohde, None]":
-    print(f"LopetusIlmoitus.nimi: {ilmoitus.nimi}")
+    logger.debug("LopetusIlmoitus.nimi: %s", ilmoitus.nimi)
     query = (
         select(Kohde.id, Osapuoli.nimi)
         .join(Kohde.rakennus_collection)
@@ -299,36 +371,25 @@ def _find_kohde_by_ilmoitustiedot(
         )
         .distinct()
     )
-    print(query)
+    logger.debug(query)
 
     try:
         kohteet = session.execute(query).all()
     except NoResultFound:
         return None
-    print(kohteet)
+    logger.debug(kohteet)
 
     names_by_kohde_id = defaultdict(set)
     for kohde_id, db_osapuoli_name in kohteet:
         names_by_kohde_id[kohde_id].add(db_osapuoli_name)
     if len(names_by_kohde_id) > 1:
-        print(
+        logger.debug(
             "Found multiple kohteet with the same address. Checking owners/inhabitants..."
         )
-        vastuuhenkilo_nimi = clean_asoy_name(ilmoitus.nimi)
-
-        for kohde_id, db_osapuoli_names in names_by_kohde_id.items():
-            for db_osapuoli_name in db_osapuoli_names:
-                if db_osapuoli_name is not None:
-                    db_osapuoli_name = clean_asoy_name(db_osapuoli_name)
-                    print(vastuuhenkilo_nimi)
-                    print(db_osapuoli_name)
-                    if (
-                        match_name(vastuuhenkilo_nimi, db_osapuoli_name)
-                    ):
-                        print(f"{db_osapuoli_name} match")
-                        kohde = session.get(Kohde, kohde_id)
-                        print("returning kohde")
-                        return kohde
+        kohde_id = _first_matching_kohde_id(names_by_kohde_id, [ilmoitus.nimi])
+        if kohde_id is not None:
+            logger.debug("returning kohde")
+            return session.get(Kohde, kohde_id)
     elif len(names_by_kohde_id) == 1:
         return session.get(Kohde, next(iter(names_by_kohde_id.keys())))
 
@@ -358,42 +419,31 @@ def _find_kohde_by_asiakastiedot(
             )
             .distinct()
         )
-        print(query)
+        logger.debug(query)
 
         try:
             kohteet = session.execute(query).all()
         except NoResultFound:
             return None
-        print(kohteet)
+        logger.debug(kohteet)
 
         names_by_kohde_id = defaultdict(set)
         for kohde_id, db_osapuoli_name in kohteet:
             names_by_kohde_id[kohde_id].add(db_osapuoli_name)
         if len(names_by_kohde_id) > 1:
-            print(
+            logger.debug(
                 "Found multiple kohteet with the same address. Checking owners/inhabitants..."
             )
-            vastuuhenkilo_nimi = clean_asoy_name(asiakas.vastuuhenkilo.nimi)
-            kompostoija_nimet = [
-                clean_asoy_name(kompostoija.nimi)
-                for kompostoija in asiakas.kompostoijat
-            ]
-
-            for kohde_id, db_osapuoli_names in names_by_kohde_id.items():
-                for db_osapuoli_name in db_osapuoli_names:
-                    if db_osapuoli_name is not None:
-                        db_osapuoli_name = clean_asoy_name(db_osapuoli_name)
-                        print(vastuuhenkilo_nimi)
-                        print(db_osapuoli_name)
-                        if any(
-                            match_name(vastuuhenkilo_nimi, db_osapuoli_name) or
-                            match_name(kompostoija_nimi, db_osapuoli_name)
-                            for kompostoija_nimi in kompostoija_nimet
-                        ):
-                            print(f"{db_osapuoli_name} match")
-                            kohde = session.get(Kohde, kohde_id)
-                            print("returning kohde")
-                            return kohde
+            # The vastuuhenkilö is only compared together with the kompostoijat
+            if asiakas.kompostoijat:
+                kohde_id = _first_matching_kohde_id(
+                    names_by_kohde_id,
+                    [asiakas.vastuuhenkilo.nimi]
+                    + [kompostoija.nimi for kompostoija in asiakas.kompostoijat],
+                )
+                if kohde_id is not None:
+                    logger.debug("returning kohde")
+                    return session.get(Kohde, kohde_id)
         elif len(names_by_kohde_id) == 1:
             return session.get(Kohde, next(iter(names_by_kohde_id.keys())))
 
@@ -424,48 +474,57 @@ def _find_kohde_by_asiakastiedot(
             )
             .distinct()
         )
-        print(query)
+        logger.debug(query)
 
         try:
             kohteet = session.execute(query).all()
         except NoResultFound:
             return None
-        print(kohteet)
+        logger.debug(kohteet)
 
         names_by_kohde_id = defaultdict(set)
         for kohde_id, db_osapuoli_name in kohteet:
             names_by_kohde_id[kohde_id].add(db_osapuoli_name)
-        if len(names_by_kohde_id) > 1:
-            # The address has multiple kohteet for the same date period.
-            # We may have
-            # 1) multiple perusmaksut for the same building (not paritalo),
-            # 2) paritalo,
-            # 3) multiple buildings in the same address (not paritalo),
-            # 4) multiple people moving in or out of the building in the same time period.
-            # Since we have no customer id here, we just have to check if the name is
-            # actually an osapuoli of an existing kohde or not. If not, we will return
-            # None and create a new kohde later. If an osapuoli exists, the new kohde may
-            # have been created from a kuljetus already.
-            print(
-                "Found multiple kohteet with the same address. Checking owners/inhabitants..."
-            )
-            haltija_nimi = clean_asoy_name(asiakas.haltija.nimi)
-            yhteystieto_nimi = clean_asoy_name(asiakas.yhteyshenkilo.nimi)
-            for kohde_id, db_osapuoli_names in names_by_kohde_id.items():
-                for db_osapuoli_name in db_osapuoli_names:
-                    if db_osapuoli_name is not None:
-                        db_osapuoli_name = clean_asoy_name(db_osapuoli_name)
-                        print(haltija_nimi)
-                        print(db_osapuoli_name)
-                        if match_name(haltija_nimi, db_osapuoli_name) or match_name(
-                            yhteystieto_nimi, db_osapuoli_name
-                        ):
-                            print(f"{db_osapuoli_name} match")
-                            kohde = session.get(Kohde, kohde_id)
-                            print("returning kohde")
-                            return kohde
-        elif len(names_by_kohde_id) == 1:
-            return session.get(Kohde, next(iter(names_by_kohde_id.keys())))
+        kohde_id = select_kohde_id_for_asiakas(names_by_kohde_id, asiakas)
+        if kohde_id is not None:
+            return session.get(Kohde, kohde_id)
+
+    return None
+
+
+def select_kohde_id_for_asiakas(
+    names_by_kohde_id: "Dict[int, Set[Optional[str]]]",
+    asiakas: "Asiakas",
+    name_index: "Optional[NameIndex]" = None,
+) -> "Optional[int]":
+    """
+    Returns the id of the kohde the asiakas belongs to, given the osapuolten nimet
+    of all kohteet found by the asiakastiedot.
+    """
+    if len(names_by_kohde_id) > 1:
+        # The address has multiple kohteet for the same date period.
+        # We may have
+        # 1) multiple perusmaksut for the same building (not paritalo),
+        # 2) paritalo,
+        # 3) multiple buildings in the same address (not paritalo),
+        # 4) multiple people moving in or out of the building in the same time period.
+        # Since we have no customer id here, we just have to check if the name is
+        # actually an osapuoli of an existing kohde or not. If not, we will return
+        # None and create a new kohde later. If an osapuoli exists, the new kohde may
+        # have been created from a kuljetus already.
+        logger.debug(
+            "Found multiple kohteet with the same address. Checking owners/inhabitants..."
+        )
+        kohde_id = _first_matching_kohde_id(
+            names_by_kohde_id,
+            [asiakas.haltija.nimi, asiakas.yhteyshenkilo.nimi],
+            name_index,
+        )
+        if kohde_id is not None:
+            logger.debug("returning kohde")
+            return kohde_id
+    elif len(names_by_kohde_id) == 1:
+        return next(iter(names_by_kohde_id.keys()))
 
     return None
 
@@ -515,62 +574,156 @@ def get_kohde_by_address(
     ...
 
 
-def get_dvv_rakennustiedot_without_kohde(
-    session: "Session",
+def _select_rakennus_id_with_current_kohde(
     poimintapvm: "Optional[datetime.date]",
     loppupvm: "Optional[datetime.date]",
-) -> "Dict[int, Rakennustiedot]":
-    # Fastest to load everything to memory first.
+) -> "Select":
     if loppupvm is None:
-        rakennus_id_with_current_kohde = (
+        return (
             select(Rakennus.id)
             .join(KohteenRakennukset)
             .join(Kohde)
             .filter(poimintapvm < Kohde.loppupvm)
         )
-    else:
-        rakennus_id_with_current_kohde = (
-            select(Rakennus.id)
-            .join(KohteenRakennukset)
-            .join(Kohde)
-            .filter(Kohde.voimassaolo.overlaps(DateRange(poimintapvm, loppupvm)))
+    return (
+        select(Rakennus.id)
+        .join(KohteenRakennukset)
+        .join(Kohde)
+        .filter(Kohde.voimassaolo.overlaps(DateRange(poimintapvm, loppupvm)))
+    )
+
+
+class DvvSnapshot:
+    """
+    DVV buildings with their inhabitants, owners and addresses for all stages of
+    creating DVV kohteet.
+
+    The buildings and related tables are loaded only once, each with a separate
+    query. Between stages, only the ids of the buildings that got a kohde are
+    queried again by calling refresh().
+    """
+
+    def __init__(
+        self,
+        session: "Session",
+        poimintapvm: "Optional[datetime.date]",
+        loppupvm: "Optional[datetime.date]",
+    ):
+        self.session = session
+        self.poimintapvm = poimintapvm
+        self.loppupvm = loppupvm
+
+        self.rakennustiedot_by_id: "Dict[int, Rakennustiedot]" = {}
+        self.owners_by_rakennus_id: "DefaultDict[int, Set[Osapuoli]]" = defaultdict(
+            set
         )
-    # Import *all* buildings, also those without inhabitants, owners and/or addresses
-    rows = session.execute(
-        select(Rakennus, RakennuksenVanhimmat, RakennuksenOmistajat, Osoite)
-        .join_from(Rakennus, RakennuksenVanhimmat, isouter=True)
-        .join_from(Rakennus, RakennuksenOmistajat, isouter=True)
-        .join(Rakennus.osoite_collection, isouter=True)
-        .filter(~Rakennus.id.in_(rakennus_id_with_current_kohde))
-        # Do not import rakennus that have been removed from DVV data
-        .filter(
-            or_(
-                Rakennus.kaytostapoisto_pvm.is_(None),
-                Rakennus.kaytostapoisto_pvm > poimintapvm,
+        self.rakennus_ids_by_owner_id: "DefaultDict[int, Set[int]]" = defaultdict(
+            set
+        )
+        self.inhabitants_by_rakennus_id: "DefaultDict[int, Set[Osapuoli]]" = (
+            defaultdict(set)
+        )
+        self.addresses_by_rakennus_id: "DefaultDict[int, Set[Osoite]]" = defaultdict(
+            set
+        )
+        self.rakennus_ids_with_kohde: "Set[int]" = set()
+        self._load()
+        self.refresh()
+
+    def _load(self):
+        logger.info("Ladataan rakennukset...")
+        # Import *all* buildings, also those without inhabitants, owners and/or
+        # addresses
+        rakennukset = (
+            self.session.execute(
+                select(Rakennus)
+                # Do not import rakennus that have been removed from DVV data
+                .filter(
+                    or_(
+                        Rakennus.kaytostapoisto_pvm.is_(None),
+                        Rakennus.kaytostapoisto_pvm > self.poimintapvm,
+                    )
+                )
             )
+            .scalars()
+            .all()
         )
-    ).all()
-    rakennustiedot_by_id = dict()
-    for row in rows:
-        rakennus_id = row[0].id
-        if rakennus_id not in rakennustiedot_by_id:
-            rakennustiedot_by_id[rakennus_id] = (row[0], set(), set(), set())
-        if row[1]:
-            rakennustiedot_by_id[rakennus_id][1].add(row[1])
-        if row[2]:
-            rakennustiedot_by_id[rakennus_id][2].add(row[2])
-        if row[3]:
-            rakennustiedot_by_id[rakennus_id][3].add(row[3])
-    # Freeze the rakennustiedot sets in the end.
-    # This way, rakennustiedot may be used in sets etc.
-    for id, (rakennus, vanhimmat, omistajat, osoitteet) in rakennustiedot_by_id.items():
-        rakennustiedot_by_id[id] = (
-            rakennus,
-            frozenset(vanhimmat),
-            frozenset(omistajat),
-            frozenset(osoitteet),
+        vanhimmat_by_rakennus_id = defaultdict(set)
+        omistajat_by_rakennus_id = defaultdict(set)
+
+        logger.info("Ladataan vanhimmat asukkaat...")
+        for vanhin, osapuoli in self.session.execute(
+            select(RakennuksenVanhimmat, Osapuoli).join(
+                Osapuoli, RakennuksenVanhimmat.osapuoli_id == Osapuoli.id
+            )
+        ):
+            vanhimmat_by_rakennus_id[vanhin.rakennus_id].add(vanhin)
+            if vanhin.loppupvm is None:
+                self.inhabitants_by_rakennus_id[vanhin.rakennus_id].add(osapuoli)
+
+        logger.info("Ladataan omistajat...")
+        for omistaja, osapuoli in self.session.execute(
+            select(RakennuksenOmistajat, Osapuoli).join(
+                Osapuoli, RakennuksenOmistajat.osapuoli_id == Osapuoli.id
+            )
+        ):
+            omistajat_by_rakennus_id[omistaja.rakennus_id].add(omistaja)
+            self.owners_by_rakennus_id[omistaja.rakennus_id].add(osapuoli)
+            self.rakennus_ids_by_owner_id[osapuoli.id].add(omistaja.rakennus_id)
+
+        logger.info("Ladataan osoitteet...")
+        for osoite in self.session.execute(select(Osoite)).scalars():
+            self.addresses_by_rakennus_id[osoite.rakennus_id].add(osoite)
+
+        # Freeze the rakennustiedot sets. This way, rakennustiedot may be used in
+        # sets etc.
+        for rakennus in rakennukset:
+            self.rakennustiedot_by_id[rakennus.id] = (
+                rakennus,
+                frozenset(vanhimmat_by_rakennus_id[rakennus.id]),
+                frozenset(omistajat_by_rakennus_id[rakennus.id]),
+                frozenset(self.addresses_by_rakennus_id[rakennus.id]),
+            )
+
+    def refresh(self):
+        """
+        Reloads the ids of the buildings that have a kohde for the period.
+        """
+        self.rakennus_ids_with_kohde = set(
+            self.session.execute(
+                _select_rakennus_id_with_current_kohde(self.poimintapvm, self.loppupvm)
+            )
+            .scalars()
+            .all()
         )
-    return rakennustiedot_by_id
+
+    def rakennustiedot_without_kohde(self) -> "Dict[int, Rakennustiedot]":
+        return {
+            rakennus_id: rakennustiedot
+            for rakennus_id, rakennustiedot in self.rakennustiedot_by_id.items()
+            if rakennus_id not in self.rakennus_ids_with_kohde
+        }
+
+
+def get_dvv_rakennustiedot_without_kohde(
+    session: "Session",
+    poimintapvm: "Optional[datetime.date]",
+    loppupvm: "Optional[datetime.date]",
+) -> "Dict[int, Rakennustiedot]":
+    return DvvSnapshot(session, poimintapvm, loppupvm).rakennustiedot_without_kohde()
+
+
+def _get_dvv_snapshot(
+    session: "Session",
+    poimintapvm: "Optional[datetime.date]",
+    loppupvm: "Optional[datetime.date]",
+    dvv_snapshot: "Optional[DvvSnapshot]",
+) -> DvvSnapshot:
+    if dvv_snapshot is None:
+        return DvvSnapshot(session, poimintapvm, loppupvm)
+    # Previous stages may have created kohteet
+    dvv_snapshot.refresh()
+    return dvv_snapshot
 
 
 def _is_sauna(rakennus: "Rakennus"):
@@ -672,40 +825,15 @@ def _cluster_rakennustiedot(
     meant for cases in which we know the buildings should belong together (e.g.
     because of perusmaksu, or grouping additional buildings to cluster).
     """
-    clusters = []
-    # start cluster from first remaining building (or existing cluster, if
-    # provided).
-    cluster = existing_cluster.copy() if existing_cluster else None
-    while rakennustiedot_to_cluster:
-        if not cluster:
-            cluster = set([rakennustiedot_to_cluster.pop()])
-
-        other_rakennustiedot_to_cluster = rakennustiedot_to_cluster.copy()
-        while other_rakennustiedot_to_cluster:
-            for other_rakennustiedot in other_rakennustiedot_to_cluster:
-                if (
-                    minimum_distance_of_buildings(
-                        [rakennustiedot[0] for rakennustiedot in cluster]
-                        + [other_rakennustiedot[0]]
-                    )
-                    < distance_limit
-                ):
-                    # found another building. add found building to cluster
-                    # and start the loop anew.
-                    cluster.add(other_rakennustiedot)
-                    break
-            else:
-                # cluster finished! other_rakennustiedot_to_cluster did not
-                # contain any buildings within set distance of cluster.
-                break
-            # found another building. remove found building from set to process
-            # and start the loop anew.
-            other_rakennustiedot_to_cluster.remove(other_rakennustiedot)
-        # cluster finished! removing clustered buildings and starting the loop anew.
-        clusters.append(cluster)
-        rakennustiedot_to_cluster -= cluster
-        cluster = None
-    return clusters
+    existing_rakennustiedot = list(existing_cluster) if existing_cluster else []
+    all_rakennustiedot = existing_rakennustiedot + list(
+        rakennustiedot_to_cluster - set(existing_rakennustiedot)
+    )
+    points = [building_point(rakennus) for rakennus, *_ in all_rakennustiedot]
+    clusters = cluster_points(
+        points, distance_limit, range(len(existing_rakennustiedot))
+    )
+    return [{all_rakennustiedot[index] for index in cluster} for cluster in clusters]
 
 
 def _add_auxiliary_buildings(
@@ -727,9 +855,11 @@ def _add_auxiliary_buildings(
     sets_to_return: "List[Set[Rakennustiedot]]" = []
     for building_set in building_sets:
         set_to_return = building_set.copy()
-        print(
-            f"- Etsitään lisärakennuksia rakennuksille {[tiedot[0].prt for tiedot in building_set]} -"
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "- Etsitään lisärakennuksia rakennuksille %s -",
+                [tiedot[0].prt for tiedot in building_set],
+            )
         for building, elders, owners, addresses in building_set:
             kiinteistotunnus = building.kiinteistotunnus
             owner_ids = {owner.osapuoli_id for owner in owners}
@@ -757,9 +887,10 @@ def _add_auxiliary_buildings(
                 )
                 common_cluster = clustered_lisarakennukset[0] if clustered_lisarakennukset else set()
 
-                if common_cluster:
-                    print(
-                        f"Samalla kiinteistöllä lähekkäin rakennukset: {[tiedot[0].prt for tiedot in common_cluster]}"
+                if common_cluster and logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Samalla kiinteistöllä lähekkäin rakennukset: %s",
+                        [tiedot[0].prt for tiedot in common_cluster],
                     )
 
                 # only add lisärakennukset having at least one common owner and address,
@@ -783,9 +914,10 @@ def _add_auxiliary_buildings(
                 # If the addresses or owners differ, remaining objects on the same
                 # kiinteistö will create separate kohteet in the last import stage,
                 # if they are significant
-                if common_cluster:
-                    print(
-                        f"Näistä saunoja TAI samalla osoitteella ja omistajalla {[tiedot[0].prt for tiedot in rakennustiedot_to_add]}"
+                if common_cluster and logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Näistä saunoja TAI samalla osoitteella ja omistajalla %s",
+                        [tiedot[0].prt for tiedot in rakennustiedot_to_add],
                     )
 
                 # Only add auxiliary buildings to one kohde, remove them from
@@ -795,9 +927,11 @@ def _add_auxiliary_buildings(
                     kiinteistotunnus
                 ] -= rakennustiedot_to_add
                 set_to_return |= rakennustiedot_to_add
-        print(
-            f"Lisärakennusten lisäämisen jälkeen: {[tiedot[0].prt for tiedot in set_to_return]}"
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Lisärakennusten lisäämisen jälkeen: %s",
+                [tiedot[0].prt for tiedot in set_to_return],
+            )
         sets_to_return.append(set_to_return)
     return sets_to_return
 
@@ -879,12 +1013,15 @@ def create_new_kohde_from_buildings(
     """
     if omistajat:
         # prefer companies over private owners when naming combined objects
-        asoy_asiakkaat = {osapuoli for osapuoli in omistajat if is_asoy(osapuoli.nimi)}
+        luokat = {osapuoli: classify_name(osapuoli.nimi) for osapuoli in omistajat}
+        asoy_asiakkaat = {
+            osapuoli for osapuoli, luokka in luokat.items() if luokka.asoy
+        }
         company_asiakkaat = {
-            osapuoli for osapuoli in omistajat if is_company(osapuoli.nimi)
+            osapuoli for osapuoli, luokka in luokat.items() if luokka.company
         }
         yhteiso_asiakkaat = {
-            osapuoli for osapuoli in omistajat if is_yhteiso(osapuoli.nimi)
+            osapuoli for osapuoli, luokka in luokat.items() if luokka.yhteiso
         }
         if asoy_asiakkaat:
             asiakas = min(asoy_asiakkaat, key=lambda x: x.nimi)
@@ -955,114 +1092,444 @@ def create_new_kohde_from_buildings(
     return kohde
 
 
-def old_kohde_for_buildings(
-    session: "Session", rakennus_ids: "List[int]", poimintapvm: "datetime.date"
-):
-    kohde_query = (
-        select(Kohde)
-        .join(KohteenRakennukset)
-        .filter(
-            KohteenRakennukset.rakennus_id.in_(rakennus_ids),
-            Kohde.loppupvm == poimintapvm - timedelta(days=1),
+KOHDE_PREFETCH_CHUNK_SIZE = 10000
+
+
+def _chunks(items: "List", size: int = KOHDE_PREFETCH_CHUNK_SIZE):
+    for index in range(0, len(items), size):
+        yield items[index : index + size]
+
+
+class AsiakasKohdeResolver:
+    """
+    Finds the kohteet of asiakkaat by prt and kiinteistö a chunk of asiakkaat at a
+    time. The candidate kohteet and osapuolten nimet of the whole chunk are fetched
+    with one query per filter, the voimassaolo is checked in memory, and the
+    candidate kohteet are loaded with a single IN query. The names are matched with
+    select_kohde_id_for_asiakas when each asiakas is imported.
+
+    The candidates are not refreshed, so kohteet must not be created or updated
+    during the import. Asiakkaat with candidate kohteet that got new osapuolet are
+    queried separately.
+    """
+
+    def __init__(
+        self,
+        session: "Session",
+        asiakkaat: "Iterable[Union[Asiakas, AsiakasAvain]]",
+        chunk_size: int = KOHDE_PREFETCH_CHUNK_SIZE,
+    ):
+        self.session = session
+        self._asiakkaat = list(asiakkaat)
+        self._rivit: "Dict[Tunnus, int]" = {
+            asiakas.asiakasnumero: rivi for rivi, asiakas in enumerate(self._asiakkaat)
+        }
+        self._chunk_size = chunk_size
+        self._chunk: "Optional[int]" = None
+        self._kohteet_by_prt: "Dict[int, Dict[int, Set[Optional[str]]]]" = {}
+        self._kohteet_by_kiinteisto: "Dict[int, Dict[int, Set[Optional[str]]]]" = {}
+        self._kohteet: "List[Kohde]" = []
+        self._names = NameIndex()
+        self._updated_kohde_ids: "Set[int]" = set()
+
+    def _load(self, chunk: int):
+        start = chunk * self._chunk_size
+        asiakkaat = self._asiakkaat[start : start + self._chunk_size]
+        self._kohteet_by_prt = self._candidates(
+            asiakkaat, start, Rakennus.prt, lambda asiakas: asiakas.rakennukset
+        )
+        self._kohteet_by_kiinteisto = self._candidates(
+            asiakkaat,
+            start,
+            Rakennus.kiinteistotunnus,
+            lambda asiakas: asiakas.kiinteistot,
+        )
+        names_by_kohde_id = defaultdict(set)
+        for kohteet in (self._kohteet_by_prt, self._kohteet_by_kiinteisto):
+            for names in kohteet.values():
+                for kohde_id, db_osapuoli_names in names.items():
+                    names_by_kohde_id[kohde_id].update(db_osapuoli_names)
+        # The names of the kohteet are matched with all asiakkaat of the chunk
+        self._names = NameIndex()
+        for kohde_id, db_osapuoli_names in names_by_kohde_id.items():
+            for db_osapuoli_name in db_osapuoli_names:
+                if db_osapuoli_name is not None:
+                    self._names.add(kohde_id, db_osapuoli_name)
+        kohde_ids = set(names_by_kohde_id)
+        # Keep the references, so that the identity map holds the kohteet
+        self._kohteet = (
+            self.session.execute(select(Kohde).where(Kohde.id.in_(kohde_ids)))
+            .scalars()
+            .all()
+            if kohde_ids
+            else []
+        )
+        self._chunk = chunk
+        logger.debug(
+            "Haettu %s kohdetta %s asiakkaalle", len(self._kohteet), len(asiakkaat)
+        )
+
+    def _candidates(
+        self,
+        asiakkaat: "List[Union[Asiakas, AsiakasAvain]]",
+        start: int,
+        rakennus_column,
+        keys_of: "Callable[[Union[Asiakas, AsiakasAvain]], List[str]]",
+    ) -> "Dict[int, Dict[int, Set[Optional[str]]]]":
+        """
+        Returns the osapuolten nimet of all kohteet found for each asiakas, by rivi.
+        Uses the same joins as _find_kohde_by_asiakastiedot.
+        """
+        keys = sorted({key for asiakas in asiakkaat for key in keys_of(asiakas)})
+        if not keys:
+            return {}
+        query = (
+            select(
+                rakennus_column, Kohde.id, Osapuoli.nimi, Kohde.alkupvm, Kohde.loppupvm
+            )
+            .select_from(Kohde)
+            .join(Kohde.rakennus_collection)
+            .join(KohteenOsapuolet, isouter=True)
+            .join(Osapuoli, isouter=True)
+            .where(rakennus_column.in_(keys))
+            .distinct()
+        )
+        rows_by_key = defaultdict(list)
+        for key, *row in self.session.execute(query):
+            rows_by_key[key].append(row)
+
+        kohteet = {}
+        for rivi, asiakas in enumerate(asiakkaat, start):
+            names_by_kohde_id = defaultdict(set)
+            for key in keys_of(asiakas):
+                for kohde_id, db_osapuoli_name, alkupvm, loppupvm in rows_by_key[key]:
+                    if overlaps_voimassa(alkupvm, loppupvm, asiakas.voimassa):
+                        names_by_kohde_id[kohde_id].add(db_osapuoli_name)
+            if names_by_kohde_id:
+                kohteet[rivi] = names_by_kohde_id
+        return kohteet
+
+    def _rivi(self, asiakas: "Asiakas") -> "Optional[int]":
+        """
+        Returns the rivi of the asiakas, loading the candidates of its chunk.
+        """
+        rivi = self._rivit.get(asiakas.asiakasnumero)
+        if rivi is not None and rivi // self._chunk_size != self._chunk:
+            self._load(rivi // self._chunk_size)
+        return rivi
+
+    def find_kohde_by_prt(self, asiakas: "Asiakas") -> "Optional[Kohde]":
+        rivi = self._rivi(asiakas)
+        if rivi is None:
+            return find_kohde_by_prt(self.session, asiakas)
+        return self._find_kohde(
+            self._kohteet_by_prt.get(rivi, {}), asiakas, find_kohde_by_prt
         )
-    )
-    old_kohde_id = session.execute(kohde_query).scalar()
-    return old_kohde_id
 
+    def find_kohde_by_kiinteisto(self, asiakas: "Asiakas") -> "Optional[Kohde]":
+        rivi = self._rivi(asiakas)
+        if rivi is None:
+            return find_kohde_by_kiinteisto(self.session, asiakas)
+        return self._find_kohde(
+            self._kohteet_by_kiinteisto.get(rivi, {}),
+            asiakas,
+            find_kohde_by_kiinteisto,
+        )
 
-def set_old_kohde_loppupvm(session: "Session", kohde_id: int, loppupvm: "datetime.date"):
-    session.execute(
-        update(Kohde)
-        .where(Kohde.id == kohde_id)
-        .values(loppupvm=loppupvm)
+    def _find_kohde(
+        self,
+        names_by_kohde_id: "Dict[int, Set[Optional[str]]]",
+        asiakas: "Asiakas",
+        find_kohde: "Callable[[Session, Asiakas], Optional[Kohde]]",
+    ) -> "Optional[Kohde]":
+        if len(names_by_kohde_id) > 1 and not self._updated_kohde_ids.isdisjoint(
+            names_by_kohde_id
+        ):
+            # The names are used to choose between the kohteet, and some of them
+            # have changed after fetching.
+            return find_kohde(self.session, asiakas)
+        kohde_id = select_kohde_id_for_asiakas(
+            names_by_kohde_id, asiakas, self._names
+        )
+        if kohde_id is None:
+            return None
+        return self.session.get(Kohde, kohde_id)
+
+    def set_osapuolet_updated(self, kohde: "Kohde"):
+        self._updated_kohde_ids.add(kohde.id)
+
+
+def _select_moves(moves: "List[Tuple[int, int, datetime.date]]"):
+    """
+    Returns VALUES clause of (old_kohde_id, new_kohde_id, alkupvm, loppupvm) rows,
+    where alkupvm is the start date of the new kohde and loppupvm is the end date of
+    the old kohde.
+    """
+    return (
+        values(
+            column("old_kohde_id", Integer),
+            column("new_kohde_id", Integer),
+            column("alkupvm", Date),
+            column("loppupvm", Date),
+            name="moves",
+        )
+        .data(
+            [
+                (old_kohde_id, new_kohde_id, alkupvm, alkupvm - timedelta(days=1))
+                for old_kohde_id, new_kohde_id, alkupvm in moves
+            ]
+        )
     )
-    session.commit()
 
 
-def set_paatos_loppupvm_for_old_kohde(
-    session: "Session", kohde_id: int, loppupvm: "datetime.date"
-):
-    rakennus_ids = (
-        session.query(KohteenRakennukset.rakennus_id)
-        .filter(KohteenRakennukset.kohde_id == kohde_id)
-        .subquery()
+def set_paatos_loppupvm_for_old_kohteet(session: "Session", moves: "Select"):
+    session.execute(
+        update(Viranomaispaatokset)
+        .where(Viranomaispaatokset.rakennus_id == KohteenRakennukset.rakennus_id)
+        .where(KohteenRakennukset.kohde_id == moves.c.old_kohde_id)
+        .where(Viranomaispaatokset.alkupvm <= moves.c.loppupvm)
+        .values(loppupvm=moves.c.loppupvm)
+        .execution_options(synchronize_session=False)
     )
-    session.query(Viranomaispaatokset).filter(
-        and_(
-            Viranomaispaatokset.rakennus_id.in_(rakennus_ids),
-            Viranomaispaatokset.alkupvm <= loppupvm
-        )
-    ).update({Viranomaispaatokset.loppupvm: loppupvm}, synchronize_session=False)
-    session.commit()
 
 
-def update_kompostori(
-    session: "Session", old_kohde_id: int, loppupvm: "datetime.date", new_kohde_id: int
-):
+def update_kompostorit(session: "Session", moves: "Select"):
     # Set loppupvm
-    kompostori_ids = (
-        session.query(KompostorinKohteet.kompostori_id)
-        .filter(KompostorinKohteet.kohde_id == old_kohde_id)
-        .subquery()
+    session.execute(
+        update(Kompostori)
+        .where(Kompostori.id == KompostorinKohteet.kompostori_id)
+        .where(KompostorinKohteet.kohde_id == moves.c.old_kohde_id)
+        .where(Kompostori.alkupvm <= moves.c.loppupvm)
+        .values(loppupvm=moves.c.loppupvm)
+        .execution_options(synchronize_session=False)
     )
-    session.query(Kompostori).filter(
-        and_(
-            Kompostori.id.in_(kompostori_ids),
-            Kompostori.alkupvm <= loppupvm
-        )
-    ).update({Kompostori.loppupvm: loppupvm}, synchronize_session=False)
 
     # Move osapuoli to new kohde.
-    kompostori_id_by_date = (
-        session.query(Kompostori.id)
-        .filter(
-            and_(
-                Kompostori.id.in_(kompostori_ids),
-                Kompostori.alkupvm > loppupvm
-            )
-        )
-        .subquery()
+    later_kompostori_osapuoli = (
+        select(Kompostori.osapuoli_id)
+        .join(KompostorinKohteet, Kompostori.id == KompostorinKohteet.kompostori_id)
+        .where(KompostorinKohteet.kohde_id == moves.c.old_kohde_id)
+        .where(Kompostori.alkupvm > moves.c.loppupvm)
+        .where(Kompostori.osapuoli_id == KohteenOsapuolet.osapuoli_id)
     )
-
-    kompostori_osapuoli_ids = (
-        session.query(Kompostori.osapuoli_id)
-        .filter(Kompostori.id.in_(kompostori_id_by_date))
-        .subquery()
+    session.execute(
+        update(KohteenOsapuolet)
+        .where(KohteenOsapuolet.kohde_id == moves.c.old_kohde_id)
+        .where(KohteenOsapuolet.osapuolenrooli_id == 311)
+        .where(later_kompostori_osapuoli.exists())
+        .values(kohde_id=moves.c.new_kohde_id)
+        .execution_options(synchronize_session=False)
     )
-    session.query(KohteenOsapuolet).filter(
-        and_(
-            KohteenOsapuolet.osapuoli_id.in_(kompostori_osapuoli_ids),
-            KohteenOsapuolet.kohde_id == old_kohde_id,
-            KohteenOsapuolet.osapuolenrooli_id == 311
-        )
-    ).update({KohteenOsapuolet.kohde_id: new_kohde_id}, synchronize_session=False)
 
     # Update KompostorinKohteet
-    session.query(KompostorinKohteet).filter(
-        and_(
-            KompostorinKohteet.kompostori_id.in_(kompostori_id_by_date),
-            KompostorinKohteet.kohde_id == old_kohde_id,
-        )
-    ).update({KompostorinKohteet.kohde_id: new_kohde_id}, synchronize_session=False)
-    session.commit()
+    session.execute(
+        update(KompostorinKohteet)
+        .where(KompostorinKohteet.kompostori_id == Kompostori.id)
+        .where(KompostorinKohteet.kohde_id == moves.c.old_kohde_id)
+        .where(Kompostori.alkupvm > moves.c.loppupvm)
+        .values(kohde_id=moves.c.new_kohde_id)
+        .execution_options(synchronize_session=False)
+    )
 
 
-def move_sopimukset_and_kuljetukset_to_new_kohde(
-    session: "Session", alkupvm: "datetime.date", old_kohde_id: int, new_kohde_id: int
+def move_sopimukset_and_kuljetukset_to_new_kohteet(
+    session: "Session", moves: "Select"
 ):
     session.execute(
         update(Sopimus)
-        .where(Sopimus.kohde_id == old_kohde_id)
-        .where(Sopimus.loppupvm >= alkupvm)
-        .values(kohde_id=new_kohde_id)
+        .where(Sopimus.kohde_id == moves.c.old_kohde_id)
+        .where(Sopimus.loppupvm >= moves.c.alkupvm)
+        .values(kohde_id=moves.c.new_kohde_id)
+        .execution_options(synchronize_session=False)
     )
     session.execute(
         update(Kuljetus)
-        .where(Kuljetus.kohde_id == old_kohde_id)
-        .where(Kuljetus.loppupvm >= alkupvm)
-        .values(kohde_id=new_kohde_id)
+        .where(Kuljetus.kohde_id == moves.c.old_kohde_id)
+        .where(Kuljetus.loppupvm >= moves.c.alkupvm)
+        .values(kohde_id=moves.c.new_kohde_id)
+        .execution_options(synchronize_session=False)
     )
-    session.commit()
+
+
+class KohdeMatcher:
+    """
+    Existing kohteet of DVV buildings, for finding the kohde of each building set
+    in memory.
+
+    The kohteet, their buildings and osapuolet are prefetched for all buildings at
+    once. Kohteet that replace an ending kohde are recorded, and their sopimukset,
+    kuljetukset, päätökset and kompostorit are moved with a few set-based updates
+    in apply_moves().
+    """
+
+    def __init__(
+        self, session: "Session", dvv_rakennustiedot: "Dict[int, Rakennustiedot]"
+    ):
+        self.session = session
+        self.dvv_rakennustiedot = dvv_rakennustiedot
+        self._kohteet: "Dict[int, Kohde]" = {}
+        self._kohde_ids_by_rakennus_id: "DefaultDict[int, Set[int]]" = defaultdict(
+            set
+        )
+        self._rakennus_ids_by_kohde_id: "DefaultDict[int, Set[int]]" = defaultdict(
+            set
+        )
+        # (osapuoli_id, osapuolenrooli_id) of each kohde
+        self._osapuolet_by_kohde_id: "DefaultDict[int, Set[Tuple[int, int]]]" = (
+            defaultdict(set)
+        )
+        self._prefetched_rakennus_ids: "Set[int]" = set()
+        self._moves: "List[Tuple[int, int, datetime.date]]" = []
+
+    def prefetch(self, rakennus_ids: "Iterable[int]"):
+        rakennus_ids = list(set(rakennus_ids) - self._prefetched_rakennus_ids)
+        self._prefetched_rakennus_ids.update(rakennus_ids)
+        kohde_ids = set()
+        for chunk in _chunks(rakennus_ids):
+            rows = self.session.execute(
+                select(KohteenRakennukset.kohde_id, KohteenRakennukset.rakennus_id)
+                .where(KohteenRakennukset.rakennus_id.in_(chunk))
+            )
+            for kohde_id, rakennus_id in rows:
+                self._add_rakennus(kohde_id, rakennus_id)
+                kohde_ids.add(kohde_id)
+
+        for chunk in _chunks(list(kohde_ids - set(self._kohteet))):
+            for kohde in self.session.execute(
+                select(Kohde).where(Kohde.id.in_(chunk))
+            ).scalars():
+                self._kohteet[kohde.id] = kohde
+            rows = self.session.execute(
+                select(
+                    KohteenOsapuolet.kohde_id,
+                    KohteenOsapuolet.osapuoli_id,
+                    KohteenOsapuolet.osapuolenrooli_id,
+                ).where(KohteenOsapuolet.kohde_id.in_(chunk))
+            )
+            for kohde_id, osapuoli_id, osapuolenrooli_id in rows:
+                self._osapuolet_by_kohde_id[kohde_id].add(
+                    (osapuoli_id, osapuolenrooli_id)
+                )
+        logger.debug(
+            "Haettu %s kohdetta %s rakennukselle", len(kohde_ids), len(rakennus_ids)
+        )
+
+    def _add_rakennus(self, kohde_id: int, rakennus_id: int):
+        self._kohde_ids_by_rakennus_id[rakennus_id].add(kohde_id)
+        self._rakennus_ids_by_kohde_id[kohde_id].add(rakennus_id)
+
+    def add_kohde(
+        self,
+        kohde: "Kohde",
+        rakennus_ids: "Iterable[int]",
+        asukkaat: "Iterable[Osapuoli]",
+        omistajat: "Iterable[Osapuoli]",
+    ):
+        self._kohteet[kohde.id] = kohde
+        for rakennus_id in rakennus_ids:
+            self._add_rakennus(kohde.id, rakennus_id)
+        asukas_rooli_id = codes.osapuolenroolit[OsapuolenrooliTyyppi.VANHIN_ASUKAS].id
+        omistaja_rooli_id = codes.osapuolenroolit[OsapuolenrooliTyyppi.OMISTAJA].id
+        for osapuoli in asukkaat:
+            self._osapuolet_by_kohde_id[kohde.id].add((osapuoli.id, asukas_rooli_id))
+        for osapuoli in omistajat:
+            self._osapuolet_by_kohde_id[kohde.id].add(
+                (osapuoli.id, omistaja_rooli_id)
+            )
+
+    def add_rakennus(self, kohde: "Kohde", rakennus_id: int):
+        self.session.add(KohteenRakennukset(rakennus_id=rakennus_id, kohde_id=kohde.id))
+        self._add_rakennus(kohde.id, rakennus_id)
+
+    def remove_rakennus(self, kohde: "Kohde", rakennus_id: int):
+        self.session.execute(
+            delete(KohteenRakennukset)
+            .where(KohteenRakennukset.kohde_id == kohde.id)
+            .where(KohteenRakennukset.rakennus_id == rakennus_id)
+            .execution_options(synchronize_session=False)
+        )
+        self._kohde_ids_by_rakennus_id[rakennus_id].discard(kohde.id)
+        self._rakennus_ids_by_kohde_id[kohde.id].discard(rakennus_id)
+
+    def _kohde_ids_for_buildings(self, rakennus_ids: "Set[int]") -> "List[int]":
+        return sorted(
+            set().union(
+                *[self._kohde_ids_by_rakennus_id[id] for id in rakennus_ids]
+            )
+        )
+
+    def kohdetiedot(
+        self, rakennus_ids: "Set[int]", osapuoli_ids: "Set[int]"
+    ) -> "Iterable[Tuple[Kohde, Set[int], Set[int], Set[int], Set[int]]]":
+        """
+        Yields kohteet having any of the buildings and any of the osapuolet, with
+        their significant buildings, auxiliary buildings, asukkaat and omistajat.
+        Only the given buildings and osapuolet are listed.
+        """
+        asukas_rooli_id = codes.osapuolenroolit[OsapuolenrooliTyyppi.VANHIN_ASUKAS].id
+        omistaja_rooli_id = codes.osapuolenroolit[OsapuolenrooliTyyppi.OMISTAJA].id
+        for kohde_id in self._kohde_ids_for_buildings(rakennus_ids):
+            osapuolet = {
+                (osapuoli_id, rooli_id)
+                for osapuoli_id, rooli_id in self._osapuolet_by_kohde_id[kohde_id]
+                if osapuoli_id in osapuoli_ids
+            }
+            if not osapuolet:
+                continue
+            kohteen_rakennus_ids = (
+                self._rakennus_ids_by_kohde_id[kohde_id] & rakennus_ids
+            )
+            significant_ids = {
+                id
+                for id in kohteen_rakennus_ids
+                if _is_significant_building(self.dvv_rakennustiedot[id])
+            }
+            yield (
+                self._kohteet[kohde_id],
+                significant_ids,
+                kohteen_rakennus_ids - significant_ids,
+                {id for id, rooli_id in osapuolet if rooli_id == asukas_rooli_id},
+                {id for id, rooli_id in osapuolet if rooli_id == omistaja_rooli_id},
+            )
+
+    def old_kohde(
+        self, rakennus_ids: "Set[int]", poimintapvm: "datetime.date"
+    ) -> "Optional[Kohde]":
+        """
+        Returns the kohde of the buildings that ended before poimintapvm.
+        """
+        for kohde_id in self._kohde_ids_for_buildings(rakennus_ids):
+            kohde = self._kohteet[kohde_id]
+            if kohde.loppupvm == poimintapvm - timedelta(days=1):
+                return kohde
+        return None
+
+    def move(self, old_kohde: "Kohde", new_kohde: "Kohde"):
+        """
+        Ends the old kohde before the new kohde starts. Sopimukset, kuljetukset,
+        päätökset and kompostorit are moved to the new kohde in apply_moves().
+        """
+        old_kohde.loppupvm = new_kohde.alkupvm - timedelta(days=1)
+        self._moves.append((old_kohde.id, new_kohde.id, new_kohde.alkupvm))
+
+    def apply_moves(self):
+        # The same old kohde may be replaced by several new kohteet. Their moves
+        # are applied in the original order, one move per old kohde at a time.
+        rounds: "List[List[Tuple[int, int, datetime.date]]]" = []
+        move_counts: "DefaultDict[int, int]" = defaultdict(int)
+        for move in self._moves:
+            round_index = move_counts[move[0]]
+            move_counts[move[0]] += 1
+            if round_index == len(rounds):
+                rounds.append([])
+            rounds[round_index].append(move)
+        for moves in rounds:
+            logger.info("Siirretään %s päättyvän kohteen tiedot", len(moves))
+            moves = _select_moves(moves)
+            move_sopimukset_and_kuljetukset_to_new_kohteet(self.session, moves)
+            set_paatos_loppupvm_for_old_kohteet(self.session, moves)
+            update_kompostorit(self.session, moves)
+        self._moves = []
 
 
 def update_or_create_kohde_from_buildings(
@@ -1073,6 +1540,7 @@ def update_or_create_kohde_from_buildings(
     omistajat: "Set[Osapuoli]",
     poimintapvm: "Optional[datetime.date]",
     loppupvm: "Optional[datetime.date]",
+    kohde_matcher: "Optional[KohdeMatcher]" = None,
 ):
     """
     Check the database for existing kohde with the same inhabitants, owners and
@@ -1088,8 +1556,27 @@ def update_or_create_kohde_from_buildings(
     In case of paritalo, we don't know which owner owned which part of the building.
     Therefore, we will have to create new kohteet for both halves when somebody sells
     their half.
+
+    When creating many kohteet, pass a KohdeMatcher prefetched with all the
+    buildings and call its apply_moves() in the end.
     """
     rakennus_ids = {rakennustiedot[0].id for rakennustiedot in rakennukset}
+    if kohde_matcher is None:
+        kohde_matcher = KohdeMatcher(session, dvv_rakennustiedot)
+        kohde_matcher.prefetch(rakennus_ids)
+        kohde = update_or_create_kohde_from_buildings(
+            session,
+            dvv_rakennustiedot,
+            rakennukset,
+            asukkaat,
+            omistajat,
+            poimintapvm,
+            loppupvm,
+            kohde_matcher,
+        )
+        kohde_matcher.apply_moves()
+        return kohde
+
     # Incoming building list may have extra auxiliary buildings
     significant_buildings = set(
         filter(lambda x: _is_significant_building(x), rakennukset)
@@ -1100,67 +1587,36 @@ def update_or_create_kohde_from_buildings(
     asukas_ids = {osapuoli.id for osapuoli in asukkaat}
     omistaja_ids = {osapuoli.id for osapuoli in omistajat}
     osapuoli_ids = asukas_ids | omistaja_ids
-    print(
-        f"Etsitään kohdetta, jossa rakennukset {rakennus_ids}, asukkaat {asukas_ids} ja omistajat {omistaja_ids}"
+    logger.debug(
+        "Etsitään kohdetta, jossa rakennukset %s, asukkaat %s ja omistajat %s",
+        rakennus_ids,
+        asukas_ids,
+        omistaja_ids,
     )
-    # List all kohde buildings here, check significance later. We may need to add and remove
-    # auxiliary buildings if kohde is found.
-    kohde_query = (
-        select(Kohde, KohteenRakennukset, KohteenOsapuolet)
-        .join(KohteenRakennukset)
-        .join(KohteenOsapuolet)
-        .filter(KohteenRakennukset.rakennus_id.in_(rakennus_ids))
-        .filter(KohteenOsapuolet.osapuoli_id.in_(osapuoli_ids))
-    )
-    potential_kohdetiedot: "List[(Kohde, KohteenRakennukset, KohteenOsapuolet)]" = (
-        session.execute(kohde_query).all()
-    )
-
-    # List significant buildings, auxiliary buildings, inhabitants and owners for each kohde
-    kohdetiedot_by_kohde: "dict[int, Kohdetiedot]" = {}
-    for kohde, rakennus, osapuoli in potential_kohdetiedot:
-        if kohde.id not in kohdetiedot_by_kohde:
-            kohdetiedot_by_kohde[kohde.id] = (kohde, set(), set(), set(), set())
-        # Separate significant and auxiliary buildings
-        if _is_significant_building(dvv_rakennustiedot[rakennus.rakennus_id]):
-            kohdetiedot_by_kohde[kohde.id][1].add(rakennus)
-        else:
-            kohdetiedot_by_kohde[kohde.id][2].add(rakennus)
-        # separate asukkaat from omistajat
-        if (
-            osapuoli.osapuolenrooli_id
-            == codes.osapuolenroolit[OsapuolenrooliTyyppi.VANHIN_ASUKAS].id
-        ):
-            kohdetiedot_by_kohde[kohde.id][3].add(osapuoli)
-        if (
-            osapuoli.osapuolenrooli_id
-            == codes.osapuolenroolit[OsapuolenrooliTyyppi.OMISTAJA].id
-        ):
-            kohdetiedot_by_kohde[kohde.id][4].add(osapuoli)
-    for kohdetiedot in kohdetiedot_by_kohde.values():
-        kohde = kohdetiedot[0]
-        kohteen_rakennus_ids = set(rakennus.rakennus_id for rakennus in kohdetiedot[1])
+    # List all kohde buildings here, check significance later. We may need to add and
+    # remove auxiliary buildings if kohde is found.
+    for (
+        kohde,
+        kohteen_rakennus_ids,
+        kohteen_lisarakennus_ids,
+        kohteen_asukas_ids,
+        kohteen_omistaja_ids,
+    ) in kohde_matcher.kohdetiedot(rakennus_ids, osapuoli_ids):
         # If kohde has no significant buildings, it is a lonely sauna or a group of
         # forlorn, lonely saunas. In this case, we just compare the owners of the
         # kohde which had the same rakennus_id(s).
-        kohteen_lisarakennus_ids = set(
-            rakennus.rakennus_id for rakennus in kohdetiedot[2]
-        )
-        kohteen_lisarakennukset = set(rakennus for rakennus in kohdetiedot[2])
-        kohteen_asukas_ids = set(osapuoli.osapuoli_id for osapuoli in kohdetiedot[3])
-        kohteen_omistaja_ids = set(osapuoli.osapuoli_id for osapuoli in kohdetiedot[4])
-        print("Tutkitaan kohteen merkitseviä rakennuksia:")
+        logger.debug("Tutkitaan kohteen merkitseviä rakennuksia:")
         # use kohde if rakennukset and osapuolet are same
         if (
             kohteen_rakennus_ids == significant_building_ids
             and kohteen_asukas_ids == asukas_ids
             and kohteen_omistaja_ids == omistaja_ids
         ):
-            print("Rakennukset, asukkaat ja omistajat samat!")
+            logger.debug("Rakennukset, asukkaat ja omistajat samat!")
             break
         # discard kohde if rakennukset are missing
         if significant_building_ids < kohteen_rakennus_ids:
-            print("Merkitseviä rakennuksia puuttuu")
+            logger.debug("Merkitseviä rakennuksia puuttuu")
             continue
         # use kohde if rakennukset are added
         if (
@@ -1168,17 +1624,18 @@ def update_or_create_kohde_from_buildings(
             and kohteen_asukas_ids == asukas_ids
             and kohteen_omistaja_ids == omistaja_ids
         ):
-            print("Merkitsevät rakennukset, asukkaat ja omistajat samat!")
+            logger.debug("Merkitsevät rakennukset, asukkaat ja omistajat samat!")
             break
         # discard kohde if owners or inhabitants are different
         if kohteen_asukas_ids != asukas_ids or kohteen_omistaja_ids != omistaja_ids:
-            print("Asukkaat tai omistajat eri")
+            logger.debug("Asukkaat tai omistajat eri")
             continue
         # All combinations are checked above.
     else:
-        print("Sopivaa kohdetta ei löydy, luodaan uusi kohde.")
+        logger.debug("Sopivaa kohdetta ei löydy, luodaan uusi kohde.")
+        old_kohde = None
         if poimintapvm:
-            old_kohde = old_kohde_for_buildings(session, rakennus_ids, poimintapvm)
+            old_kohde = kohde_matcher.old_kohde(rakennus_ids, poimintapvm)
         new_kohde = create_new_kohde_from_buildings(
             session,
             rakennus_ids,
@@ -1188,46 +1645,28 @@ def update_or_create_kohde_from_buildings(
             loppupvm,
             old_kohde,
         )
+        kohde_matcher.add_kohde(new_kohde, rakennus_ids, asukkaat, omistajat)
         if new_kohde and poimintapvm:
             if old_kohde:
-                print(
-                    f"Löytyi päättyvä kohde {old_kohde.id}, asetetaan loppupäivämäärä."
-                )
-                set_old_kohde_loppupvm(
-                    session, old_kohde.id, new_kohde.alkupvm - timedelta(days=1)
-                )
-                move_sopimukset_and_kuljetukset_to_new_kohde(
-                    session, new_kohde.alkupvm, old_kohde.id, new_kohde.id
-                )
-                set_paatos_loppupvm_for_old_kohde(
-                    session, old_kohde.id, new_kohde.alkupvm - timedelta(days=1)
-                )
-                update_kompostori(
-                    session,
-                    old_kohde.id,
-                    new_kohde.alkupvm - timedelta(days=1),
-                    new_kohde.id
+                logger.debug(
+                    "Löytyi päättyvä kohde %s, asetetaan loppupäivämäärä.", old_kohde.id
                 )
+                kohde_matcher.move(old_kohde, new_kohde)
         return new_kohde
 
     # Return existing kohde when found
-    print("Olemassaoleva kohde löytynyt.")
-    for kohteen_rakennus in kohteen_lisarakennukset:
-        print("Tarkistetaan kohteen lisärakennus")
-        print(kohteen_rakennus.rakennus_id)
-        if kohteen_rakennus.rakennus_id not in rakennus_ids:
-            print("Ei löydy enää, poistetaan kohteelta")
-            session.delete(kohteen_rakennus)
+    logger.debug("Olemassaoleva kohde löytynyt.")
+    for rakennus_id in kohteen_lisarakennus_ids:
+        logger.debug("Tarkistetaan kohteen lisärakennus %s", rakennus_id)
+        if rakennus_id not in rakennus_ids:
+            logger.debug("Ei löydy enää, poistetaan kohteelta")
+            kohde_matcher.remove_rakennus(kohde, rakennus_id)
     # Add new auxiliary buildings
     for rakennus_id in rakennus_ids - significant_building_ids:
-        print("Tarkistetaan lisärakennus")
-        print(rakennus_id)
+        logger.debug("Tarkistetaan lisärakennus %s", rakennus_id)
         if rakennus_id not in kohteen_lisarakennus_ids:
-            print("Ei löydy vielä, lisätään kohteelle")
-            kohteen_rakennus = KohteenRakennukset(
-                rakennus_id=rakennus_id, kohde_id=kohde.id
-            )
-            session.add(kohteen_rakennus)
+            logger.debug("Ei löydy vielä, lisätään kohteelle")
+            kohde_matcher.add_rakennus(kohde, rakennus_id)
 
     # Update kohde to be valid for the whole import period
     if not poimintapvm or (kohde.alkupvm and poimintapvm < kohde.alkupvm):
@@ -1245,14 +1684,16 @@ def get_or_create_kohteet_from_vanhimmat(
     ids: "Select",
     poimintapvm: "Optional[datetime.date]",
     loppupvm: "Optional[datetime.date]",
+    dvv_snapshot: "Optional[DvvSnapshot]" = None,
 ):
     """
     Create one kohde for each RakennuksenVanhimmat osapuoli id provided by
     the select query.
     """
-    dvv_rakennustiedot = get_dvv_rakennustiedot_without_kohde(
-        session, poimintapvm, loppupvm
-    )
+    dvv_snapshot = _get_dvv_snapshot(session, poimintapvm, loppupvm, dvv_snapshot)
+    dvv_rakennustiedot = dvv_snapshot.rakennustiedot_without_kohde()
+    # Owners of all buildings are loaded in the snapshot
+    owners_by_rakennus_id = dvv_snapshot.owners_by_rakennus_id
     # iterate vanhimmat to create kohde with the right name, client and building
     vanhimmat_osapuolet_query = (
         select(RakennuksenVanhimmat, Osapuoli)
@@ -1260,8 +1701,15 @@ def get_or_create_kohteet_from_vanhimmat(
         .filter(RakennuksenVanhimmat.osapuoli_id.in_(ids))
     )
     vanhimmat_osapuolet = session.execute(vanhimmat_osapuolet_query).all()
-    print(
-        f"Löydetty {len(vanhimmat_osapuolet)} vanhinta asukasta ilman voimassaolevaa kohdetta"
+    logger.info(
+        "Löydetty %s vanhinta asukasta ilman voimassaolevaa kohdetta",
+        len(vanhimmat_osapuolet),
+    )
+    kohde_matcher = KohdeMatcher(session, dvv_rakennustiedot)
+    kohde_matcher.prefetch(
+        vanhin.rakennus_id
+        for vanhin, _ in vanhimmat_osapuolet
+        if vanhin.rakennus_id in dvv_rakennustiedot
     )
     kohteet = []
     for (vanhin, osapuoli) in vanhimmat_osapuolet:
@@ -1269,12 +1717,7 @@ def get_or_create_kohteet_from_vanhimmat(
         if vanhin.rakennus_id in dvv_rakennustiedot:
             # The oldest inhabitant is the customer. Also save owners as backup
             # contacts.
-            omistajat_query = (
-                select(RakennuksenOmistajat, Osapuoli)
-                .join(RakennuksenOmistajat.osapuoli)
-                .where(RakennuksenOmistajat.rakennus_id == vanhin.rakennus_id)
-            )
-            omistajat = {row[1] for row in session.execute(omistajat_query).all()}
+            omistajat = set(owners_by_rakennus_id.get(vanhin.rakennus_id, ()))
             # The correct kohde is found by checking the inhabitant in each half. In case
             # of paritalo, we don't know which owner owned which part of the building.
             # Therefore, we will have to create new kohteet for both halves when somebody
@@ -1287,8 +1730,10 @@ def get_or_create_kohteet_from_vanhimmat(
                 omistajat,
                 poimintapvm,
                 loppupvm,
+                kohde_matcher,
             )
             kohteet.append(kohde)
+    kohde_matcher.apply_moves()
     return kohteet
 
 
@@ -1308,6 +1753,12 @@ def get_or_create_kohteet_from_rakennustiedot(
     # merge empty buildings with same address and owner on kiinteistö(t) to the main
     # building(s), if they are close enough.
     building_sets = _add_auxiliary_buildings(dvv_rakennustiedot, building_sets)
+    kohde_matcher = KohdeMatcher(session, dvv_rakennustiedot)
+    kohde_matcher.prefetch(
+        rakennustiedot[0].id
+        for building_set in building_sets
+        for rakennustiedot in building_set
+    )
     kohteet = []
     for building_set in building_sets:
         owners = set().union(
@@ -1331,8 +1782,10 @@ def get_or_create_kohteet_from_rakennustiedot(
             owners,
             poimintapvm,
             loppupvm,
+            kohde_matcher,
         )
         kohteet.append(kohde)
+    kohde_matcher.apply_moves()
     return kohteet
 
 
@@ -1351,9 +1804,9 @@ def _match_addresses(first: "Set[Osoite]", second: "Set[Osoite]"):
     for osoite in first:
         for address in second:
             if _match_address(osoite, address):
-                print("Yhteinen osoite löytyi.")
+                logger.debug("Yhteinen osoite löytyi.")
                 return True
-    print("Ei yhteistä osoitetta.")
+    logger.debug("Ei yhteistä osoitetta.")
     return False
 
 
@@ -1362,6 +1815,7 @@ def get_or_create_kohteet_from_kiinteistot(
     kiinteistotunnukset: "Select",
     poimintapvm: "Optional[datetime.date]",
     loppupvm: "Optional[datetime.date]",
+    dvv_snapshot: "Optional[DvvSnapshot]" = None,
 ):
     """
     Create at least one kohde from each kiinteistotunnus provided by the select query,
@@ -1384,12 +1838,11 @@ def get_or_create_kohteet_from_kiinteistot(
     3) Finally, if the buildings have different addresses, separate buildings to
     those having the same address.
     """
-    print("Ladataan kiinteistötunnukset...")
+    logger.info("Ladataan kiinteistötunnukset...")
     kiinteistotunnukset = [
         result[0] for result in session.execute(kiinteistotunnukset).all()
     ]
-    print(f"{len(kiinteistotunnukset)} tuotavaa kiinteistötunnusta löydetty.")
-    print("Ladataan rakennukset...")
+    logger.info("%s tuotavaa kiinteistötunnusta löydetty.", len(kiinteistotunnukset))
     # Fastest to load everything to memory first.
     # Cannot filter buildings to load here by type. *Any* buildings that have an
     # inhabitant should be imported wholesale.
@@ -1397,11 +1850,11 @@ def get_or_create_kohteet_from_kiinteistot(
     # We must only filter out buildings with existing kohde here, since the same
     # kiinteistö might have buildings both with and without kohde, in case some
     # buildings have been imported in previous steps.
-    dvv_rakennustiedot = get_dvv_rakennustiedot_without_kohde(
-        session, poimintapvm, loppupvm
-    )
-    print(
-        f"Löydetty {len(dvv_rakennustiedot)} DVV-rakennusta ilman voimassaolevaa kohdetta"
+    dvv_snapshot = _get_dvv_snapshot(session, poimintapvm, loppupvm, dvv_snapshot)
+    dvv_rakennustiedot = dvv_snapshot.rakennustiedot_without_kohde()
+    logger.info(
+        "Löydetty %s DVV-rakennusta ilman voimassaolevaa kohdetta",
+        len(dvv_rakennustiedot),
     )
 
     rakennustiedot_by_kiinteistotunnus: Dict[int, Set[Rakennustiedot]] = defaultdict(
@@ -1412,40 +1865,15 @@ def get_or_create_kohteet_from_kiinteistot(
             (rakennus, vanhimmat, omistajat, osoitteet)
         )
 
-    print("Ladataan omistajat...")
-    rakennus_owners = session.execute(
-        select(RakennuksenOmistajat.rakennus_id, Osapuoli).join(
-            Osapuoli, RakennuksenOmistajat.osapuoli_id == Osapuoli.id
-        )
-    ).all()
-    owners_by_rakennus_id = defaultdict(set)
-    rakennus_ids_by_owner_id = defaultdict(set)
-    for (rakennus_id, owner) in rakennus_owners:
-        owners_by_rakennus_id[rakennus_id].add(owner)
-        rakennus_ids_by_owner_id[owner.id].add(rakennus_id)
-
-    print("Ladataan vanhimmat asukkaat...")
-    rakennus_inhabitants = session.execute(
-        select(RakennuksenVanhimmat.rakennus_id, Osapuoli).join(
-            Osapuoli, RakennuksenVanhimmat.osapuoli_id == Osapuoli.id
-        ).where(RakennuksenVanhimmat.loppupvm.is_(None))
-    ).all()
-    inhabitants_by_rakennus_id = defaultdict(set)
-    for (rakennus_id, inhabitant) in rakennus_inhabitants:
-        inhabitants_by_rakennus_id[rakennus_id].add(inhabitant)
-
-    print("Ladataan osoitteet...")
-    rakennus_addresses = session.execute(
-        select(Rakennus.id, Osoite).join(Osoite, Rakennus.id == Osoite.rakennus_id)
-    ).all()
-    addresses_by_rakennus_id: "Dict[int, Set[Osoite]]" = defaultdict(set)
-    for (rakennus_id, address) in rakennus_addresses:
-        addresses_by_rakennus_id[rakennus_id].add(address)
+    owners_by_rakennus_id = dvv_snapshot.owners_by_rakennus_id
+    rakennus_ids_by_owner_id = dvv_snapshot.rakennus_ids_by_owner_id
+    inhabitants_by_rakennus_id = dvv_snapshot.inhabitants_by_rakennus_id
+    addresses_by_rakennus_id = dvv_snapshot.addresses_by_rakennus_id
 
     building_sets: List[Set[Rakennustiedot]] = []
-    print("Käydään läpi kiinteistötunnukset...")
+    logger.info("Käydään läpi kiinteistötunnukset...")
     for kiinteistotunnus in kiinteistotunnukset:
-        print(f"--- Kiinteistö {kiinteistotunnus} ---")
+        logger.debug("--- Kiinteistö %s ---", kiinteistotunnus)
         # NOTE: kiinteistotunnus may also be None. In this case, all buildings without
         # kiinteistotunnus will be imported separated by distance, owner (if present)
         # and address only.
@@ -1480,8 +1908,7 @@ def get_or_create_kohteet_from_kiinteistot(
             # saunas to other kohteet in any other case.
             if not ids_by_cluster or not kiinteistotunnus:
                 ids_by_cluster |= sauna_ids_by_cluster
-            print("Löydetty rakennusryhmä:")
-            print(ids_by_cluster)
+            logger.debug("Löydetty rakennusryhmä: %s", ids_by_cluster)
 
             # 2) Split buildings by owner
             while ids_by_cluster:
@@ -1505,13 +1932,12 @@ def get_or_create_kohteet_from_kiinteistot(
                 else:
                     # We have no owners left! Remaining are significant buildings with
                     # missing owners. Let's just add them all together.
-                    ids_without_owner = ids_by_cluster - set(
-                        owners_by_rakennus_id.keys()
-                    )
+                    ids_without_owner = {
+                        id for id in ids_by_cluster if not owners_by_rakennus_id.get(id)
+                    }
                     building_ids_owned = ids_without_owner
 
-                print("Saman omistajan rakennukset:")
-                print(building_ids_owned)
+                logger.debug("Saman omistajan rakennukset: %s", building_ids_owned)
 
                 # 3) split buildings further by address
                 while building_ids_owned:
@@ -1531,8 +1957,12 @@ def get_or_create_kohteet_from_kiinteistot(
                     (street, number), building_ids_at_address = addresses_by_buildings[
                         0
                     ]
-                    print(f"Kadun {street} osoitteessa {number}:")
-                    print(f"Yhdistetään rakennukset {building_ids_at_address}")
+                    logger.debug(
+                        "Kadun %s osoitteessa %s: yhdistetään rakennukset %s",
+                        street,
+                        number,
+                        building_ids_at_address,
+                    )
                     rakennustiedot_at_address = {
                         dvv_rakennustiedot[id] for id in building_ids_at_address
                     }
@@ -1541,9 +1971,9 @@ def get_or_create_kohteet_from_kiinteistot(
                     building_ids_owned -= building_ids_at_address
                     ids_by_cluster -= building_ids_at_address
 
-    print(" ")
-    print(
-        "--- Kiinteistötunnukset käyty läpi. Lisätään piharakennukset/saunat ja luodaan kohteet. ---"
+    logger.info(
+        "--- Kiinteistötunnukset käyty läpi. Lisätään piharakennukset/saunat ja "
+        "luodaan kohteet. ---"
     )
     kohteet = get_or_create_kohteet_from_rakennustiedot(
         session,
@@ -1561,6 +1991,7 @@ def get_or_create_single_asunto_kohteet(
     session: "Session",
     poimintapvm: "Optional[datetime.date]",
     loppupvm: "Optional[datetime.date]",
+    dvv_snapshot: "Optional[DvvSnapshot]" = None,
 ) -> "List(Kohde)":
     """
     Get or create kohteet from all yksittäistalot that do not have kohde on the
@@ -1624,10 +2055,9 @@ def get_or_create_single_asunto_kohteet(
         .having(sqlalchemyFunc.count(Rakennus.id) == 1)
     )
 
-    print(" ")
-    print("----- LUODAAN YKSITTÄISTALOKOHTEET -----")
+    logger.info("----- LUODAAN YKSITTÄISTALOKOHTEET -----")
     return get_or_create_kohteet_from_kiinteistot(
-        session, single_asunto_kiinteistotunnus, poimintapvm, loppupvm
+        session, single_asunto_kiinteistotunnus, poimintapvm, loppupvm, dvv_snapshot
     )
 
 
@@ -1635,6 +2065,7 @@ def get_or_create_paritalo_kohteet(
     session: "Session",
     poimintapvm: "Optional[datetime.date]",
     loppupvm: "Optional[datetime.date]",
+    dvv_snapshot: "Optional[DvvSnapshot]" = None,
 ) -> "List(Kohde)":
     """
     Create kohteet from all paritalo buildings that do not have kohde for the
@@ -1690,10 +2121,9 @@ def get_or_create_paritalo_kohteet(
     vanhimmat_ids = select(RakennuksenVanhimmat.osapuoli_id).filter(
         RakennuksenVanhimmat.rakennus_id.in_(paritalo_rakennus_id_without_kohde)
     )
-    print(" ")
-    print("----- CREATING PARITALOKOHTEET ----")
+    logger.info("----- CREATING PARITALOKOHTEET ----")
     return get_or_create_kohteet_from_vanhimmat(
-        session, vanhimmat_ids, poimintapvm, loppupvm
+        session, vanhimmat_ids, poimintapvm, loppupvm, dvv_snapshot
     )
 
 
@@ -1701,6 +2131,7 @@ def get_or_create_multiple_and_uninhabited_kohteet(
     session: "Session",
     poimintapvm: "Optional[datetime.date]",
     loppupvm: "Optional[datetime.date]",
+    dvv_snapshot: "Optional[DvvSnapshot]" = None,
 ) -> "List(Kohde)":
     """
     Create kohteet from all kiinteistötunnus that have buildings without kohde for the
@@ -1724,10 +2155,9 @@ def get_or_create_multiple_and_uninhabited_kohteet(
             )
         ).group_by(Rakennus.kiinteistotunnus)
     )
-    print(" ")
-    print("----- LUODAAN JÄLJELLÄ OLEVAT KOHTEET -----")
+    logger.info("----- LUODAAN JÄLJELLÄ OLEVAT KOHTEET -----")
     return get_or_create_kohteet_from_kiinteistot(
-        session, kiinteistotunnus_without_kohde, poimintapvm, loppupvm
+        session, kiinteistotunnus_without_kohde, poimintapvm, loppupvm, dvv_snapshot
     )
 
 
@@ -1750,6 +2180,7 @@ def create_perusmaksurekisteri_kohteet(
     perusmaksutiedosto: "Path",
     poimintapvm: "Optional[datetime.date]",
     loppupvm: "Optional[datetime.date]",
+    dvv_snapshot: "Optional[DvvSnapshot]" = None,
 ):
     """
     Create kohteet combining all dvv buildings that have the same asiakasnumero in
@@ -1759,8 +2190,7 @@ def create_perusmaksurekisteri_kohteet(
     Since perusmaksurekisteri may be missing sauna and talousrakennus, add them from
     each kiinteistö, matching owner and address.
     """
-    print(" ")
-    print("----- LUODAAN PERUSMAKSUKOHTEET -----")
+    logger.info("----- LUODAAN PERUSMAKSUKOHTEET -----")
     perusmaksut = load_workbook(filename=perusmaksutiedosto)
     sheet = perusmaksut["Tietopyyntö asiakasrekisteristä"]
     # some asiakasnumero occur multiple times for the same prt
@@ -1772,17 +2202,16 @@ def create_perusmaksurekisteri_kohteet(
         asiakasnumero = str(row[2])
         prt = str(row[3])
         buildings_to_combine[asiakasnumero]["prt"].add(prt)
-    print(f"Löydetty {len(buildings_to_combine)} perusmaksuasiakasta")
+    logger.info("Löydetty %s perusmaksuasiakasta", len(buildings_to_combine))
 
-    print("Ladataan rakennukset...")
     # Fastest to load everything to memory first.
     # Do not import any rakennus with existing kohteet. Kerrostalokohteet
     # are eternal, so they cannot ever be imported again once imported here.
-    dvv_rakennustiedot = get_dvv_rakennustiedot_without_kohde(
-        session, poimintapvm, loppupvm
-    )
-    print(
-        f"Löydetty {len(dvv_rakennustiedot)} DVV-rakennusta ilman voimassaolevaa kohdetta"
+    dvv_snapshot = _get_dvv_snapshot(session, poimintapvm, loppupvm, dvv_snapshot)
+    dvv_rakennustiedot = dvv_snapshot.rakennustiedot_without_kohde()
+    logger.info(
+        "Löydetty %s DVV-rakennusta ilman voimassaolevaa kohdetta",
+        len(dvv_rakennustiedot),
     )
 
     dvv_rakennustiedot_by_prt: "Dict[int, Rakennustiedot]" = {}
@@ -1794,12 +2223,12 @@ def create_perusmaksurekisteri_kohteet(
             osoitteet,
         )
 
-    print("Käydään läpi perusmaksuasiakkaat...")
+    logger.info("Käydään läpi perusmaksuasiakkaat...")
 
     building_sets: List[Set[Rakennustiedot]] = []
     for kohde_datum in buildings_to_combine.values():
         kohde_prt = kohde_datum["prt"]
-        print(f"Perusmaksuasiakkaalla PRT {kohde_prt}")
+        logger.debug("Perusmaksuasiakkaalla PRT %s", kohde_prt)
         building_set: "Set[Rakennustiedot]" = set()
         for prt in kohde_prt:
             try:
@@ -1807,35 +2236,28 @@ def create_perusmaksurekisteri_kohteet(
                     prt
                 ]
             except KeyError:
-                print(f"PRT:tä {prt} ei löydy DVV:stä, ei tuoda kohdetta")
+                logger.info("PRT:tä %s ei löydy DVV:stä, ei tuoda kohdetta", prt)
                 continue
             # NOTE: optionally, add other buildings to building set if already
             # at least one perusmaksu specific building is found, i.e. set is not empty
             if _should_have_perusmaksu_kohde(rakennus):
-                print(f"{rakennus.prt} kuuluu perusmaksukohteelle")
+                logger.debug("%s kuuluu perusmaksukohteelle", rakennus.prt)
                 # add all owners and addresses for each rakennus
                 building_set.add((rakennus, omistajat, asukkaat, osoitteet))
         if len(building_set) == 0:
-            print("Perusmaksuasiakkaalla ei halutuntyyppisiä rakennuksia")
+            logger.debug("Perusmaksuasiakkaalla ei halutuntyyppisiä rakennuksia")
             continue
-        print(f"Yhdistetään rakennukset {[tiedot[0].prt for tiedot in building_set]}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Yhdistetään rakennukset %s", [tiedot[0].prt for tiedot in building_set]
+            )
         building_sets.append(building_set)
 
-    print("Ladataan omistajat...")
-    rakennus_owners = session.execute(
-        select(RakennuksenOmistajat.rakennus_id, Osapuoli).join(
-            Osapuoli, RakennuksenOmistajat.osapuoli_id == Osapuoli.id
-        )
-    ).all()
-    owners_by_rakennus_id = defaultdict(set)
-    for (rakennus_id, owner) in rakennus_owners:
-        owners_by_rakennus_id[rakennus_id].add(owner)
-
     kohteet = get_or_create_kohteet_from_rakennustiedot(
         session,
         dvv_rakennustiedot,
         building_sets,
-        owners_by_rakennus_id,
+        dvv_snapshot.owners_by_rakennus_id,
         # No need to add asukkaat. Asoy kohteet should not be separated or named after
         # inhabitants, and inhabitants should not be contacted.
         defaultdict(set),
@@ -1,3 +1,5 @@
+import logging
+
 from jkrimporter.model import Asiakas, Jatelaji, JkrIlmoitukset, SopimusTyyppi
 
 from .. import codes
@@ -5,6 +7,8 @@ from ..codes import OsapuolenlajiTyyppi, OsapuolenrooliTyyppi
 from ..models import Kohde, KohteenOsapuolet, Osapuoli
 from ..utils import is_asoy
 
+logger = logging.getLogger(__name__)
+
 
 def create_or_update_haltija_osapuoli(
     session, kohde, asiakas: "Asiakas", update_contacts: bool
@@ -42,7 +46,10 @@ def create_or_update_haltija_osapuoli(
                 elif sopimus.jatelaji == Jatelaji.muovi:
                     asiakasrooli = codes.osapuolenroolit[OsapuolenrooliTyyppi.MUOVI_KIMPPAISANTA]
                 else:
-                    print("Skipping sopimus with unknown jätelaji " + sopimus.jatelaji + " in kimppasopimus")
+                    logger.warning(
+                        "Skipping sopimus with unknown jätelaji %s in kimppasopimus",
+                        sopimus.jatelaji,
+                    )
                     continue
             else:
                 if sopimus.jatelaji == Jatelaji.sekajate:
@@ -58,7 +65,10 @@ def create_or_update_haltija_osapuoli(
                 elif sopimus.jatelaji == Jatelaji.muovi:
                     asiakasrooli = codes.osapuolenroolit[OsapuolenrooliTyyppi.MUOVI_KIMPPAOSAKAS]
                 else:
-                    print("Skipping sopimus with unknown jätelaji " + sopimus.jatelaji + " in kimppasopimus")
+                    logger.warning(
+                        "Skipping sopimus with unknown jätelaji %s in kimppasopimus",
+                        sopimus.jatelaji,
+                    )
                     continue
         else:
             if sopimus.jatelaji == Jatelaji.sekajate:
@@ -76,7 +86,10 @@ def create_or_update_haltija_osapuoli(
             elif sopimus.jatelaji == Jatelaji.muovi:
                 asiakasrooli = codes.osapuolenroolit[OsapuolenrooliTyyppi.MUOVI_TILAAJA]
             else:
-                print("Skipping sopimus with unknown jätelaji " + sopimus.jatelaji + " in sopimus")
+                logger.warning(
+                    "Skipping sopimus with unknown jätelaji %s in sopimus",
+                    sopimus.jatelaji,
+                )
                 continue
 
         # Filter osapuoli by the same tiedontuottaja. This way, we don't
@@ -116,9 +129,6 @@ def create_or_update_haltija_osapuoli(
 
         session.add(kohteen_osapuoli)
 
-    # Commit changes to the database
-    session.commit()
-
 
 def create_or_update_komposti_yhteyshenkilo(
     session, kohde: Kohde, ilmoitus: "JkrIlmoitukset",
@@ -140,7 +150,7 @@ def create_or_update_komposti_yhteyshenkilo(
         return existing_osapuoli_entries
 
     # Create new osapuoli entry
-    print("Creating new osapuoli...")
+    logger.debug("Creating new osapuoli...")
     kompostin_yhteyshenkilo = Osapuoli(
         nimi=ilmoitus.vastuuhenkilo.nimi,
         katuosoite=str(ilmoitus.vastuuhenkilo.osoite),
@@ -90,8 +90,7 @@ def create_or_update_sopimus(
             )
     else:
         kimppaisanta = None
-    print('got jkr sopimus')
-    print(jkr_sopimus)
+    logger.debug("got jkr sopimus %s", jkr_sopimus)
 
     # TODO: potentially we have to separate sopimukset for the same
     # jatetyyppi even if they overlap. So we might need to check a
@@ -109,11 +108,10 @@ def create_or_update_sopimus(
         None,
     )
     if db_sopimus:
-        print('found db sopimus')
-        print(db_sopimus)
+        logger.debug("found db sopimus %s", db_sopimus)
         merge_alkupvm(db_sopimus, jkr_sopimus)
         merge_loppupvm(db_sopimus, jkr_sopimus)
-        print('updated sopimus')
+        logger.debug("updated sopimus")
     else:
         db_sopimus = Sopimus(
             kohde=kohde,
@@ -125,7 +123,7 @@ def create_or_update_sopimus(
             kimppaisanta_kohde=kimppaisanta,
         )
         session.add(db_sopimus)
-        print("created new sopimus")
+        logger.debug("created new sopimus")
 
     return db_sopimus
 
@@ -158,9 +156,7 @@ def update_keraysvalineet(
     keraysvalineet: "List[JkrKeraysvaline]",
     raportointi_loppupvm: datetime.date,
 ):
-    print("updating keraysvaline")
-    print(keraysvalineet)
-    print(raportointi_loppupvm)
+    logger.debug("updating keraysvaline %s %s", keraysvalineet, raportointi_loppupvm)
     for keraysvaline in keraysvalineet:
         db_keraysvaline = next(
             (
@@ -172,10 +168,10 @@ def update_keraysvalineet(
             None,
         )
         if db_keraysvaline:
-            print("väline in db")
+            logger.debug("väline in db")
             db_keraysvaline.pvm = raportointi_loppupvm
         else:
-            print("creating new väline")
+            logger.debug("creating new väline")
             db_keraysvaline = Keraysvaline(
                 pvm=raportointi_loppupvm,
                 tilavuus=keraysvaline.tilavuus,
@@ -210,8 +206,7 @@ def update_tyhjennysvalit(
                 session.delete(db_tyhjennysvali)
 
     for jkr_tyhjennysvali in sopimus.tyhjennysvalit:
-        print('got tyhjennysväli')
-        print(jkr_tyhjennysvali)
+        logger.debug("got tyhjennysväli %s", jkr_tyhjennysvali)
         exists = any(
             db_tyhjennysvali.alkuvko == jkr_tyhjennysvali.alkuvko
             and db_tyhjennysvali.loppuvko == jkr_tyhjennysvali.loppuvko
@@ -0,0 +1,184 @@
+import datetime
+import logging
+from typing import TYPE_CHECKING
+
+from sqlalchemy import Column, Integer, MetaData, Table, and_, exists, insert, select
+
+from ..models import Kuljetus, UlkoinenAsiakastieto
+from .kohde import UlkoinenAsiakastietoResolver
+
+if TYPE_CHECKING:
+    from typing import Dict, Iterable, List, Optional, Union
+
+    from sqlalchemy.orm import Session
+
+    from jkrimporter.model import Asiakas, AsiakasAvain
+
+    from ..models import Jatetyyppi, Kohde, Tiedontuottaja
+
+logger = logging.getLogger(__name__)
+
+KULJETUS_BATCH_SIZE = 5000
+
+KULJETUS_COLUMNS = [
+    "kohde_id",
+    "jatetyyppi_id",
+    "alkupvm",
+    "loppupvm",
+    "tyhjennyskerrat",
+    "massa",
+    "tilavuus",
+    "tiedontuottaja_tunnus",
+]
+
+
+def _temporary_table(name: str, *columns: Column) -> Table:
+    return Table(name, MetaData(), *columns, prefixes=["TEMPORARY"])
+
+
+class AsiakasStaging:
+    """
+    Massatuonti. The customer ids of the siirtotiedosto are staged into a temporary
+    table, so that the existing customers are resolved with a single query instead
+    of a round trip per asiakas. Kuljetukset are collected and written in batches
+    with a single INSERT ... SELECT. Kohteet are found with AsiakasKohdeResolver
+    like in the default import.
+    """
+
+    def __init__(self, session: "Session"):
+        self.session = session
+        # Filled with the existing customers of the siirtotiedosto only
+        self.resolver = UlkoinenAsiakastietoResolver()
+        self._kuljetukset: "List[Dict]" = []
+
+    def stage(self, asiakkaat: "Iterable[Union[Asiakas, AsiakasAvain]]"):
+        asiakas_table = _temporary_table(
+            "jkr_tuonti_asiakas",
+            Column("rivi", Integer, primary_key=True),
+            Column(
+                "tiedontuottaja_tunnus",
+                UlkoinenAsiakastieto.__table__.c.tiedontuottaja_tunnus.type,
+            ),
+            Column("ulkoinen_id", UlkoinenAsiakastieto.__table__.c.ulkoinen_id.type),
+        )
+        asiakas_rows = []
+        for rivi, asiakas in enumerate(asiakkaat):
+            asiakas_rows.append(
+                {
+                    "rivi": rivi,
+                    "tiedontuottaja_tunnus": asiakas.asiakasnumero.jarjestelma,
+                    "ulkoinen_id": asiakas.asiakasnumero.tunnus,
+                }
+            )
+
+        connection = self.session.connection()
+        asiakas_table.create(connection)
+        if asiakas_rows:
+            self.session.execute(insert(asiakas_table), asiakas_rows)
+        query = (
+            select(UlkoinenAsiakastieto)
+            .select_from(asiakas_table)
+            .join(
+                UlkoinenAsiakastieto,
+                and_(
+                    UlkoinenAsiakastieto.tiedontuottaja_tunnus
+                    == asiakas_table.c.tiedontuottaja_tunnus,
+                    UlkoinenAsiakastieto.ulkoinen_id == asiakas_table.c.ulkoinen_id,
+                ),
+            )
+        )
+        for ulkoinen_asiakastieto in self.session.execute(query).scalars():
+            self.resolver.add(ulkoinen_asiakastieto)
+        asiakas_table.drop(connection)
+        logger.info(
+            "Asiakasnumerolla löytyi %s / %s asiakasta",
+            len(self.resolver),
+            len(asiakas_rows),
+        )
+
+    def add_kuljetus(
+        self,
+        kohde: "Kohde",
+        jatetyyppi: "Jatetyyppi",
+        alkupvm: "Optional[datetime.date]",
+        loppupvm: "Optional[datetime.date]",
+        tyhjennyskerrat: int,
+        massa: "Optional[int]",
+        tilavuus: "Optional[int]",
+        urakoitsija: "Tiedontuottaja",
+    ):
+        self._kuljetukset.append(
+            {
+                "kohde": kohde,
+                "jatetyyppi_id": jatetyyppi.id,
+                "alkupvm": alkupvm,
+                "loppupvm": loppupvm,
+                "tyhjennyskerrat": tyhjennyskerrat,
+                "massa": massa,
+                "tilavuus": tilavuus,
+                "tiedontuottaja_tunnus": urakoitsija.tunnus,
+            }
+        )
+
+    @property
+    def kuljetukset_count(self) -> int:
+        return len(self._kuljetukset)
+
+    def discard_kuljetukset(self, count: int):
+        """
+        Discards the kuljetukset collected after the first count ones.
+        """
+        del self._kuljetukset[count:]
+
+    def insert_kuljetukset(self):
+        """
+        Writes the collected kuljetukset. As in insert_kuljetukset, a kuljetus is
+        skipped if the kohde already has a kuljetus with the same jätetyyppi and
+        dates, either in the database or earlier in the same batch.
+        """
+        if not self._kuljetukset:
+            return
+        # New kohteet must have their ids
+        self.session.flush()
+
+        kuljetus = Kuljetus.__table__
+        kuljetus_table = _temporary_table(
+            "jkr_tuonti_kuljetus",
+            Column("rivi", Integer, primary_key=True),
+            *[Column(name, kuljetus.c[name].type) for name in KULJETUS_COLUMNS],
+        )
+        rows = []
+        for rivi, values in enumerate(self._kuljetukset):
+            row = {"rivi": rivi, "kohde_id": values["kohde"].id}
+            row.update((name, values[name]) for name in KULJETUS_COLUMNS[1:])
+            rows.append(row)
+
+        connection = self.session.connection()
+        kuljetus_table.create(connection)
+        self.session.execute(insert(kuljetus_table), rows)
+        same_kuljetus = [
+            kuljetus_table.c.kohde_id,
+            kuljetus_table.c.jatetyyppi_id,
+            kuljetus_table.c.alkupvm,
+            kuljetus_table.c.loppupvm,
+        ]
+        new_kuljetukset = (
+            select(*[kuljetus_table.c[name] for name in KULJETUS_COLUMNS])
+            .where(
+                ~exists().where(
+                    kuljetus.c.kohde_id == kuljetus_table.c.kohde_id,
+                    kuljetus.c.jatetyyppi_id == kuljetus_table.c.jatetyyppi_id,
+                    kuljetus.c.alkupvm.is_not_distinct_from(kuljetus_table.c.alkupvm),
+                    kuljetus.c.loppupvm.is_not_distinct_from(
+                        kuljetus_table.c.loppupvm
+                    ),
+                )
+            )
+            .distinct(*same_kuljetus)
+            .order_by(*same_kuljetus, kuljetus_table.c.rivi)
+        )
+        self.session.execute(
+            insert(kuljetus).from_select(KULJETUS_COLUMNS, new_kuljetukset)
+        )
+        kuljetus_table.drop(connection)
+        self._kuljetukset = []
@@ -0,0 +1,92 @@
+import logging
+import os
+import pickle
+from typing import TYPE_CHECKING
+
+from sqlalchemy import MetaData, text
+from sqlalchemy.exc import DBAPIError
+
+from jkrimporter import conf
+
+if TYPE_CHECKING:
+    from typing import Optional
+
+    from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+def get_schema_version(engine: "Engine") -> "Optional[str]":
+    """
+    Returns the version of the latest Flyway migration applied to the database.
+    """
+    query = text(
+        "SELECT version FROM jkr.flyway_schema_history "
+        "WHERE success AND version IS NOT NULL "
+        "ORDER BY installed_rank DESC LIMIT 1"
+    )
+    try:
+        with engine.connect() as connection:
+            return connection.execute(query).scalar()
+    except DBAPIError as e:
+        logger.warning("Skeeman versiota ei saatu selville: %s", e)
+        return None
+
+
+def get_snapshot_path(version: str) -> str:
+    return os.path.join(conf.config_dir, f"schema_{version}.pickle")
+
+
+def _read_snapshot(path: str) -> "Optional[MetaData]":
+    try:
+        with open(path, "rb") as snapshot_file:
+            return pickle.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Skeeman tilannekuvaa %s ei voitu lukea: %s", path, e)
+        return None
+
+
+def _write_snapshot(path: str, snapshot: MetaData):
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as snapshot_file:
+            pickle.dump(snapshot, snapshot_file)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Skeeman tilannekuvaa %s ei voitu tallentaa: %s", path, e)
+
+
+def load_schema(engine: "Engine", metadata: MetaData, schema: str):
+    """
+    Adds the tables of the schema to metadata, like automap reflection does.
+
+    The tables are read from a pickled snapshot matching the Flyway schema version
+    of the database. If there is no snapshot yet, the schema is reflected and
+    the snapshot is saved for later runs. Tables already defined in metadata are
+    kept as they are.
+    """
+    version = get_schema_version(engine)
+    path = get_snapshot_path(version) if version else None
+    snapshot = _read_snapshot(path) if path else None
+
+    if snapshot is None:
+        declared = set(metadata.tables)
+        metadata.reflect(
+            engine, schema=schema, extend_existing=True, autoload_replace=False
+        )
+        if path:
+            snapshot = MetaData()
+            for key, table in metadata.tables.items():
+                if key not in declared:
+                    table.to_metadata(snapshot)
+            _write_snapshot(path, snapshot)
+            logger.info("Skeeman tilannekuva tallennettu: %s", path)
+        return
+
+    logger.debug("Skeeman tilannekuva luettu: %s", path)
+    for key, table in snapshot.tables.items():
+        if key not in metadata.tables:
+            table.to_metadata(metadata)
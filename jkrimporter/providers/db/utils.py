@@ -1,15 +1,24 @@
 import json
 import logging
 import re
+from collections import defaultdict
 from datetime import date, datetime
-from typing import TYPE_CHECKING
+from functools import lru_cache
+from typing import TYPE_CHECKING, FrozenSet, Hashable, NamedTuple, Tuple
 
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
 if TYPE_CHECKING:
+    from typing import DefaultDict, Iterable, Set
+
+    from typing import Optional
+
     from jkrimporter.model import Yhteystieto
+    from jkrimporter.utils.intervals import Interval
+
+NAME_CACHE_SIZE = 100000
 
 oy_strings = ("oy", "ab")
 
@@ -54,6 +63,38 @@ yhteiso_regexps = [
 ]
 
 
+def _alternation(strings: "Iterable[str]") -> str:
+    return "|".join(re.escape(string) for string in strings)
+
+
+# The patterns above combined, for testing each kind with a single search
+oy_regex = re.compile(rf"( |^)(?:{_alternation(oy_strings)})( |\.|$)", re.IGNORECASE)
+asoy_regex = re.compile(
+    rf"(^| )(?:{_alternation(asoy_strings)})( |\.|$)", re.IGNORECASE
+)
+yhteiso_regex = re.compile(rf"(?:{_alternation(yhteiso_strings)}) ?$", re.IGNORECASE)
+
+
+class NameClassification(NamedTuple):
+    asoy: bool
+    company: bool
+    yhteiso: bool
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def classify_name(name: str) -> NameClassification:
+    """
+    Returns whether the name is an asunto-osakeyhtiö, a company or another
+    yhteisö. The same owner names repeat across buildings, so the results are
+    cached.
+    """
+    return NameClassification(
+        asoy=asoy_regex.search(name) is not None,
+        company=oy_regex.search(name) is not None,
+        yhteiso=yhteiso_regex.search(name) is not None,
+    )
+
+
 def clean_asoy_name(name: str):
     for pattern in asoy_regexps:
         name = pattern.sub("", name)
@@ -61,24 +102,115 @@ def clean_asoy_name(name: str):
     return name
 
 
+# Typical separators combining names
+name_separator_regex = re.compile(r"\s\&\s|\sja\s")
+
+NameTokens = Tuple[FrozenSet[str], ...]
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def name_tokens(name: str) -> NameTokens:
+    """
+    Returns the lowercase words of each name combined in the name.
+    """
+    return tuple(
+        frozenset(part.lower().split()) for part in name_separator_regex.split(name)
+    )
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def asoy_name_tokens(name: str) -> NameTokens:
+    """
+    Returns the name tokens of the name without asunto-osakeyhtiö.
+    """
+    return name_tokens(clean_asoy_name(name))
+
+
+def match_name_tokens(first: NameTokens, second: NameTokens) -> bool:
+    """
+    Returns true if the words of one name are a subset of the other in any of the
+    combined names.
+    """
+    return any(
+        first_parts <= second_parts or second_parts <= first_parts
+        for first_parts in first
+        for second_parts in second
+    )
+
+
+class NameIndex:
+    """
+    Keys by the words of their names, without asunto-osakeyhtiö. Finds the keys with
+    names matching the given names without comparing all pairs of names.
+    """
+
+    def __init__(self):
+        self._keys_by_word: "DefaultDict[str, Set[Hashable]]" = defaultdict(set)
+        self._tokens_by_key: "DefaultDict[Hashable, Set[NameTokens]]" = defaultdict(
+            set
+        )
+        # Keys with an empty name part, which matches any name
+        self._match_any: "Set[Hashable]" = set()
+
+    def add(self, key: Hashable, name: str):
+        tokens = asoy_name_tokens(name)
+        self._tokens_by_key[key].add(tokens)
+        for parts in tokens:
+            if not parts:
+                self._match_any.add(key)
+            for word in parts:
+                self._keys_by_word[word].add(key)
+
+    def matching(
+        self, names: "Iterable[str]", keys: "Optional[Iterable[Hashable]]" = None
+    ) -> "Set[Hashable]":
+        """
+        Returns the keys with a name matching any of the names. Only the given keys
+        are compared, if any.
+        """
+        if keys is not None:
+            keys = set(keys)
+
+        def within(found: "Set[Hashable]") -> "Set[Hashable]":
+            return found if keys is None else found & keys
+
+        matching = set()
+        for name in names:
+            tokens = asoy_name_tokens(name)
+            if not all(tokens):
+                # An empty name part matches any name
+                matching.update(within(self._tokens_by_key.keys()))
+                break
+            candidates = set(within(self._match_any))
+            for parts in tokens:
+                for word in parts:
+                    candidates.update(within(self._keys_by_word.get(word, set())))
+            matching.update(
+                key
+                for key in candidates - matching
+                if any(
+                    match_name_tokens(tokens, key_tokens)
+                    for key_tokens in self._tokens_by_key[key]
+                )
+            )
+        return matching
+
+
 def is_asoy(name: str) -> bool:
-    return any(pattern.search(name) for pattern in asoy_regexps)
+    return classify_name(name).asoy
 
 
 def is_company(name: str) -> bool:
-    return any(pattern.search(name) for pattern in oy_regexps)
+    return classify_name(name).company
 
 
 def is_yhteiso(name: str) -> bool:
-    return any(pattern.search(name) for pattern in yhteiso_regexps)
+    return classify_name(name).yhteiso
 
 
 def form_display_name(haltija: "Yhteystieto") -> str:
     if not haltija.henkilotunnus and (
-        haltija.ytunnus
-        or is_company(haltija.nimi)
-        or is_asoy(haltija.nimi)
-        or is_yhteiso(haltija.nimi)
+        haltija.ytunnus or any(classify_name(haltija.nimi))
     ):
         display_name = haltija.nimi.title()
     else:
@@ -87,6 +219,22 @@ def form_display_name(haltija: "Yhteystieto") -> str:
     return display_name
 
 
+def overlaps_voimassa(
+    alkupvm: "Optional[date]", loppupvm: "Optional[date]", voimassa: "Interval"
+) -> bool:
+    """
+    Same as Kohde.voimassaolo.overlaps(DateRange(voimassa.lower, voimassa.upper)).
+    The kohde range includes both ends, the asiakas range excludes the upper end.
+    """
+    lower = voimassa.lower or date.min
+    upper = voimassa.upper or date.max
+    if lower >= upper:
+        return False
+    return (alkupvm is None or alkupvm < upper) and (
+        loppupvm is None or lower <= loppupvm
+    )
+
+
 class JSONEncoderWithDateSupport(json.JSONEncoder):
     def default(self, value):
         if isinstance(value, BaseModel):
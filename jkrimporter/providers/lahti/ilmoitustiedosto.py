@@ -50,8 +50,10 @@ class Ilmoitustiedosto:
                 missing_headers_list.append(header)
 
         if missing_headers_list:
-            print(
-                f"Tiedosto: {self._path}, puuttuvat sarakeotsikot: {missing_headers_list}"
+            logger.error(
+                "Tiedosto: %s, puuttuvat sarakeotsikot: %s",
+                self._path,
+                missing_headers_list,
             )
             raise RuntimeError("Ilmoitustiedostosta puuttuu oletettuja sarakeotsikoita.")
 
@@ -106,8 +108,10 @@ class LopetusIlmoitustiedosto:
                 missing_headers_list.append(header)
 
         if missing_headers_list:
-            print(
-                f"Tiedosto: {self._path}, puuttuvat sarakeotsikot: {missing_headers_list}"
+            logger.error(
+                "Tiedosto: %s, puuttuvat sarakeotsikot: %s",
+                self._path,
+                missing_headers_list,
             )
             raise RuntimeError("Lopetus lopetusilmoitustiedostosta puuttuu oletettuja sarakeotsikoita.")
 
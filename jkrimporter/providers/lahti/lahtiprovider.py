@@ -1,17 +1,17 @@
 import datetime
 import logging
+from collections import OrderedDict
 from datetime import date
-from typing import TYPE_CHECKING, Optional, Union
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Union
 
-from addrparser import AddressParser
-
-from jkrimporter.model import AKPPoistoSyy
+from jkrimporter.model import AKPPoistoSyy, AsiakasAvain
 from jkrimporter.model import Asiakas as JkrAsiakas
 from jkrimporter.model import IlmoituksenHenkilo
 from jkrimporter.model import Jatelaji as JkrJatelaji
 from jkrimporter.model import Keskeytys as JkrKeskeytys
 from jkrimporter.model import (
     JkrData,
+    JkrDataStream,
     JkrIlmoitukset,
     Keraysvaline,
     KeraysvalineTyyppi,
@@ -32,7 +32,8 @@ from jkrimporter.model import Yhteystieto
 # from jkrimporter.providers.db.models import Ilmoitus as JkrIlmoitus
 from jkrimporter.providers.lahti.models import Asiakas, Jatelaji
 from jkrimporter.utils.intervals import Interval
-from jkrimporter.utils.osoite import osoite_from_parsed_address
+from jkrimporter.utils.osoite import parse_osoite
+from jkrimporter.utils.stream import prefetch
 
 from .ilmoitustiedosto import Ilmoitustiedosto, LopetusIlmoitustiedosto
 from .paatostiedosto import Paatostiedosto
@@ -43,7 +44,8 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
-address_parser = AddressParser("fi")
+# Asiakkaat translated ahead of the database import when streaming
+STREAM_QUEUE_SIZE = 1000
 
 
 def overlap(a: TyhjennysSopimus, b: TyhjennysSopimus) -> bool:
@@ -66,11 +68,10 @@ def create_haltija(row: "Asiakas"):
     kohteen_osoite = Osoite(postinumero=postinumero, postitoimipaikka=postitoimipaikka)
     if row.Kiinteistonkatuosoite:
         try:
-            parsed_address = address_parser.parse(row.Kiinteistonkatuosoite)
+            o = parse_osoite(row.Kiinteistonkatuosoite)
         except ValueError:
             kohteen_osoite.erikoisosoite = row.Kiinteistonkatuosoite
         else:
-            o = osoite_from_parsed_address(parsed_address)
             kohteen_osoite.katunimi = o.katunimi
             kohteen_osoite.osoitenumero = o.osoitenumero
             kohteen_osoite.huoneistotunnus = o.huoneistotunnus
@@ -80,8 +81,7 @@ def create_haltija(row: "Asiakas"):
         nimi=row.Haltijannimi.title(),
         osoite=kohteen_osoite,
     )
-    print("got haltija")
-    print(haltija)
+    logger.debug("got haltija %s", haltija)
     return haltija
 
 
@@ -115,21 +115,19 @@ def create_yhteyshenkilo(row: "Asiakas"):
     # saved.
     if row.Kimpankatuosoite:
         try:
-            parsed_address = address_parser.parse(row.Kimpankatuosoite)
+            o = parse_osoite(row.Kimpankatuosoite)
         except ValueError:
             yhteyshenkilon_osoite.erikoisosoite = row.Kimpankatuosoite
         else:
-            o = osoite_from_parsed_address(parsed_address)
             yhteyshenkilon_osoite.katunimi = o.katunimi
             yhteyshenkilon_osoite.osoitenumero = o.osoitenumero
             yhteyshenkilon_osoite.huoneistotunnus = o.huoneistotunnus
     elif row.Haltijankatuosoite:
         try:
-            parsed_address = address_parser.parse(row.Haltijankatuosoite)
+            o = parse_osoite(row.Haltijankatuosoite)
         except ValueError:
             yhteyshenkilon_osoite.erikoisosoite = row.Haltijankatuosoite
         else:
-            o = osoite_from_parsed_address(parsed_address)
             yhteyshenkilon_osoite.katunimi = o.katunimi
             yhteyshenkilon_osoite.osoitenumero = o.osoitenumero
             yhteyshenkilon_osoite.huoneistotunnus = o.huoneistotunnus
@@ -146,8 +144,7 @@ def create_yhteyshenkilo(row: "Asiakas"):
         nimi=nimi,
         osoite=yhteyshenkilon_osoite,
     )
-    print("got yhteyshenkilö")
-    print(yhteyshenkilo)
+    logger.debug("got yhteyshenkilö %s", yhteyshenkilo)
     return yhteyshenkilo
 
 
@@ -219,119 +216,184 @@ class LahtiTranslator:
         )
         return asiakas
 
-    def _append_asiakkaat(
-        self, data: JkrData, alkupvm: Union[None, date], loppupvm: Union[None, date]
-    ):
+    def _create_avain(self, tunnus: Tunnus, row: Asiakas) -> AsiakasAvain:
+        # Same fields as in _create_asiakas, without the yhteyshenkilö
+        return AsiakasAvain(
+            asiakasnumero=tunnus,
+            voimassa=Interval(row.Pvmalk, row.Pvmasti),
+            haltija=create_haltija(row),
+            rakennukset=[row.Kiinteistotunnus] if row.Kiinteistotunnus else [],
+        )
+
+    def _rows(
+        self, alkupvm: Union[None, date], loppupvm: Union[None, date]
+    ) -> "Iterator[Asiakas]":
         for row in self._source.asiakastiedot:
-            print("-------")
-            print("got asiakastiedot")
-            print(row)
+            logger.debug("got asiakastiedot %s", row)
             if alkupvm:
-                print(alkupvm)
-                print(row.Pvmasti)
                 if row.Pvmasti < alkupvm:
-                    print("skipping, too early")
+                    logger.debug("skipping, too early: %s < %s", row.Pvmasti, alkupvm)
                     continue
             if loppupvm:
-                print(loppupvm)
-                print(row.Pvmalk)
                 if row.Pvmalk > loppupvm:
-                    print("skipping, too late")
+                    logger.debug("skipping, too late: %s > %s", row.Pvmalk, loppupvm)
                     continue
-            tunnus = self.tunnus_from_urakoitsija_and_asiakasnumero(
+            yield row
+
+    def _row_tunnukset(self, row: "Asiakas") -> "List[Tunnus]":
+        """
+        Returns the asiakkaat the row is added to.
+        """
+        tunnukset = [
+            self.tunnus_from_urakoitsija_and_asiakasnumero(
                 row.UrakoitsijaId, row.UrakoitsijankohdeId
             )
-            # In Lahti data, each row only contains information on one kuljetus and
-            # sopimus. If the asiakas already exists, do not add them again, just
-            # append to their kuljetukset and sopimukset. Luckily, UrakoitsijankohdeId
-            # means any different buildings will always be imported as separate
-            # asiakas, even if their name etc. is the same. This way, each Asiakas
-            # will always only have a single kohde and its sopimukset.
-            if tunnus not in data.asiakkaat.keys():
-                data.asiakkaat[tunnus] = self._create_asiakas(tunnus, row)
-                print(f"Added new asiakas {tunnus}")
-            else:
-                print(f"Asiakas {tunnus} found already")
-
-            # Lahti saves aluekeräys in the same field as jätelajit
-            if row.tyyppiIdEWC == Jatelaji.aluekerays:
-                sopimustyyppi = SopimusTyyppi.aluekerayssopimus
-                jatelaji = JkrJatelaji.muu
-            else:
-                sopimustyyppi = SopimusTyyppi.tyhjennyssopimus
-                jatelaji = jatelaji_map[row.tyyppiIdEWC]
-
-            # Lahti saves kimppasopimukset along with regular sopimukset
-            if row.palveluKimppakohdeId:
-                isannan_asiakasnumero = self.tunnus_from_urakoitsija_and_asiakasnumero(
+        ]
+        if row.palveluKimppakohdeId:
+            tunnukset.append(
+                self.tunnus_from_urakoitsija_and_asiakasnumero(
                     row.UrakoitsijaId, row.palveluKimppakohdeId
                 )
-                if isannan_asiakasnumero not in data.asiakkaat.keys():
-                    data.asiakkaat[isannan_asiakasnumero] = self._create_asiakas(
-                        isannan_asiakasnumero, row
-                    )
-                    print(f"Added new kimppaisäntä {isannan_asiakasnumero}")
-                else:
-                    print(f"Kimppaisäntä {isannan_asiakasnumero} found already")
-                sopimus = KimppaSopimus(
-                    sopimustyyppi=SopimusTyyppi.kimppasopimus,
-                    jatelaji=jatelaji,
-                    alkupvm=row.Pvmalk,
-                    loppupvm=row.Pvmasti,
-                    isannan_asiakasnumero=isannan_asiakasnumero,
-                    asiakas_on_isanta=(row.UrakoitsijankohdeId == row.Kimpanyhteyshlo),
+            )
+        return tunnukset
+
+    def _append_asiakkaat(
+        self, data: JkrData, alkupvm: Union[None, date], loppupvm: Union[None, date]
+    ):
+        for row in self._rows(alkupvm, loppupvm):
+            self._add_row(data.asiakkaat, row)
+
+        return data
+
+    def as_jkr_data_stream(
+        self, alkupvm: Union[None, date], loppupvm: Union[None, date]
+    ) -> JkrDataStream:
+        """
+        Returns the same asiakkaat as as_jkr_data, in the same order. Only the
+        asiakkaat that still have rows left in the data are kept in memory. The
+        validated rows of the siirtotiedosto are all kept in memory, as the
+        siirtotiedosto is read only once.
+        """
+        rows = list(self._rows(alkupvm, loppupvm))
+        # The first pass finds the avaimet and the last row of each asiakas
+        avaimet = []
+        last_rows: Dict[Tunnus, int] = {}
+        for index, row in enumerate(rows):
+            for tunnus in self._row_tunnukset(row):
+                if tunnus not in last_rows:
+                    avaimet.append(self._create_avain(tunnus, row))
+                last_rows[tunnus] = index
+
+        def asiakkaat() -> "Iterator[JkrAsiakas]":
+            # Asiakkaat in the order they were created
+            open_asiakkaat: "OrderedDict[Tunnus, JkrAsiakas]" = OrderedDict()
+            for index, row in enumerate(rows):
+                self._add_row(open_asiakkaat, row)
+                while open_asiakkaat:
+                    tunnus = next(iter(open_asiakkaat))
+                    if last_rows[tunnus] > index:
+                        break
+                    yield open_asiakkaat.pop(tunnus)
+
+        return JkrDataStream(
+            alkupvm=alkupvm,
+            loppupvm=loppupvm,
+            avaimet=avaimet,
+            asiakkaat=prefetch(asiakkaat(), STREAM_QUEUE_SIZE),
+        )
+
+    def _add_row(self, asiakkaat: "Dict[Tunnus, JkrAsiakas]", row: "Asiakas"):
+        tunnus = self.tunnus_from_urakoitsija_and_asiakasnumero(
+            row.UrakoitsijaId, row.UrakoitsijankohdeId
+        )
+        # In Lahti data, each row only contains information on one kuljetus and
+        # sopimus. If the asiakas already exists, do not add them again, just
+        # append to their kuljetukset and sopimukset. Luckily, UrakoitsijankohdeId
+        # means any different buildings will always be imported as separate
+        # asiakas, even if their name etc. is the same. This way, each Asiakas
+        # will always only have a single kohde and its sopimukset.
+        if tunnus not in asiakkaat.keys():
+            asiakkaat[tunnus] = self._create_asiakas(tunnus, row)
+            logger.debug("Added new asiakas %s", tunnus)
+        else:
+            logger.debug("Asiakas %s found already", tunnus)
+
+        # Lahti saves aluekeräys in the same field as jätelajit
+        if row.tyyppiIdEWC == Jatelaji.aluekerays:
+            sopimustyyppi = SopimusTyyppi.aluekerayssopimus
+            jatelaji = JkrJatelaji.muu
+        else:
+            sopimustyyppi = SopimusTyyppi.tyhjennyssopimus
+            jatelaji = jatelaji_map[row.tyyppiIdEWC]
+
+        # Lahti saves kimppasopimukset along with regular sopimukset
+        if row.palveluKimppakohdeId:
+            isannan_asiakasnumero = self.tunnus_from_urakoitsija_and_asiakasnumero(
+                row.UrakoitsijaId, row.palveluKimppakohdeId
+            )
+            if isannan_asiakasnumero not in asiakkaat.keys():
+                asiakkaat[isannan_asiakasnumero] = self._create_asiakas(
+                    isannan_asiakasnumero, row
                 )
+                logger.debug("Added new kimppaisäntä %s", isannan_asiakasnumero)
             else:
-                sopimus = TyhjennysSopimus(
-                    sopimustyyppi=sopimustyyppi,
-                    jatelaji=jatelaji,
-                    alkupvm=row.Pvmalk,
-                    loppupvm=row.Pvmasti,
-                )
+                logger.debug("Kimppaisäntä %s found already", isannan_asiakasnumero)
+            sopimus = KimppaSopimus(
+                sopimustyyppi=SopimusTyyppi.kimppasopimus,
+                jatelaji=jatelaji,
+                alkupvm=row.Pvmalk,
+                loppupvm=row.Pvmasti,
+                isannan_asiakasnumero=isannan_asiakasnumero,
+                asiakas_on_isanta=(row.UrakoitsijankohdeId == row.Kimpanyhteyshlo),
+            )
+        else:
+            sopimus = TyhjennysSopimus(
+                sopimustyyppi=sopimustyyppi,
+                jatelaji=jatelaji,
+                alkupvm=row.Pvmalk,
+                loppupvm=row.Pvmasti,
+            )
 
-            for ii, _ in enumerate(row.tyhjennysvali):
-                if row.tyhjennysvali[ii] is not None:
-                    sopimus.tyhjennysvalit.append(
-                        JkrTyhjennysvali(
-                            alkuvko=row.Voimassaoloviikotalkaen[ii],
-                            loppuvko=row.Voimassaoloviikotasti[ii],
-                            tyhjennysvali=row.tyhjennysvali[ii],
-                            kertaaviikossa=row.kertaaviikossa[ii],
-                        )
+        for ii, _ in enumerate(row.tyhjennysvali):
+            if row.tyhjennysvali[ii] is not None:
+                sopimus.tyhjennysvalit.append(
+                    JkrTyhjennysvali(
+                        alkuvko=row.Voimassaoloviikotalkaen[ii],
+                        loppuvko=row.Voimassaoloviikotasti[ii],
+                        tyhjennysvali=row.tyhjennysvali[ii],
+                        kertaaviikossa=row.kertaaviikossa[ii],
                     )
+                )
 
-            if row.Keskeytysalkaen:
-                sopimus.keskeytykset.append(
-                    JkrKeskeytys(
-                        alkupvm=row.Keskeytysalkaen,
-                        loppupvm=row.Keskeytysasti,
-                        # There is no selite in the input data.
-                        selite=None,
-                    )
+        if row.Keskeytysalkaen:
+            sopimus.keskeytykset.append(
+                JkrKeskeytys(
+                    alkupvm=row.Keskeytysalkaen,
+                    loppupvm=row.Keskeytysasti,
+                    # There is no selite in the input data.
+                    selite=None,
                 )
+            )
 
-            data.asiakkaat[tunnus].sopimukset.append(sopimus)
+        asiakkaat[tunnus].sopimukset.append(sopimus)
 
-            keraysvaline = Keraysvaline(
-                maara=row.astiamaara,
+        keraysvaline = Keraysvaline(
+            maara=row.astiamaara,
+            tilavuus=row.koko * 1000 if row.koko else None,
+            tyyppi=KeraysvalineTyyppi.SAILIO,
+        )
+        sopimus.keraysvalineet.append(keraysvaline)
+
+        asiakkaat[tunnus].tyhjennystapahtumat.append(
+            Tyhjennystapahtuma(
+                alkupvm=row.Pvmalk,
+                loppupvm=row.Pvmasti,
+                jatelaji=jatelaji,
+                tyhjennyskerrat=row.get_kaynnit(),
                 tilavuus=row.koko * 1000 if row.koko else None,
-                tyyppi=KeraysvalineTyyppi.SAILIO,
+                massa=row.get_paino(),
             )
-            sopimus.keraysvalineet.append(keraysvaline)
-
-            data.asiakkaat[tunnus].tyhjennystapahtumat.append(
-                Tyhjennystapahtuma(
-                    alkupvm=row.Pvmalk,
-                    loppupvm=row.Pvmasti,
-                    jatelaji=jatelaji,
-                    tyhjennyskerrat=row.get_kaynnit(),
-                    tilavuus=row.koko * 1000 if row.koko else None,
-                    massa=row.get_paino(),
-                )
-            )
-            print("------")
-
-        return data
+        )
 
 
 class PaatosTranslator:
@@ -493,7 +555,7 @@ class IlmoitusTranslator:
 
         # Convert grouped data to list
         data = [JkrIlmoitukset(**values) for values in grouped_data.values()]
-        print(data)
+        logger.debug(data)
         return data
 
 
@@ -1,13 +1,16 @@
 import datetime
+import logging
 import re
 from datetime import date
 from enum import Enum
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 from pydantic import BaseModel, Field, ValidationError, root_validator, validator
 
 from jkrimporter.model import Paatostulos, Tapahtumalaji
 
+logger = logging.getLogger(__name__)
+
 
 class Jatelaji(str, Enum):
     aluekerays = "Aluekeräys"
@@ -77,7 +80,7 @@ class AsiakasRow(BaseModel):
 
     @validator("Haltijannimi", pre=True)
     def construct_missing_name(value: Union[str, None], values: Dict):
-        print(values)
+        logger.debug(values)
         if not value:
             try:
                 value = str(values["UrakoitsijankohdeId"])
@@ -232,6 +235,43 @@ class AsiakasRow(BaseModel):
         return values
 
 
+# Fields that must be equal on all rows of the same Asiakas
+ASIAKAS_IDENTITY_FIELDS = (
+    "UrakoitsijaId",
+    "UrakoitsijankohdeId",
+    "Kiinteistotunnus",
+    "Kiinteistonkatuosoite",
+    "Kiinteistonposti",
+    "Haltijannimi",
+    "Haltijanyhteyshlo",
+    "Haltijankatuosoite",
+    "Haltijanposti",
+    "Haltijanmaakoodi",
+    "Haltijanulkomaanpaikkakunta",
+    "Pvmalk",
+    "Pvmasti",
+    "tyyppiIdEWC",
+    "astiamaara",
+    "koko",
+    "Kuntatun",
+    "palveluKimppakohdeId",
+    "kimpanNimi",
+    "Kimpanyhteyshlo",
+    "Kimpankatuosoite",
+    "Kimpanposti",
+    "Keskeytysalkaen",
+    "Keskeytysasti",
+)
+
+
+def asiakas_identity(obj: "Union[AsiakasRow, Asiakas]") -> Tuple:
+    """
+    Returns the identity fields of AsiakasRow or Asiakas. Rows may only be added to
+    Asiakas with the same identity.
+    """
+    return tuple(getattr(obj, field) for field in ASIAKAS_IDENTITY_FIELDS)
+
+
 class Asiakas(BaseModel):
     UrakoitsijaId: str
     UrakoitsijankohdeId: str
@@ -335,32 +375,7 @@ class Asiakas(BaseModel):
     def check_and_add_row(self, row: AsiakasRow):
         # If the data is on multiple rows either tyhjennysvali or kertaaviikossa
         # values are different.
-        if (
-            self.UrakoitsijaId == row.UrakoitsijaId
-            and self.UrakoitsijankohdeId == row.UrakoitsijankohdeId
-            and self.Kiinteistotunnus == row.Kiinteistotunnus
-            and self.Kiinteistonkatuosoite == row.Kiinteistonkatuosoite
-            and self.Kiinteistonposti == row.Kiinteistonposti
-            and self.Haltijannimi == row.Haltijannimi
-            and self.Haltijanyhteyshlo == row.Haltijanyhteyshlo
-            and self.Haltijankatuosoite == row.Haltijankatuosoite
-            and self.Haltijanposti == row.Haltijanposti
-            and self.Haltijanmaakoodi == row.Haltijanmaakoodi
-            and self.Haltijanulkomaanpaikkakunta == row.Haltijanulkomaanpaikkakunta
-            and self.Pvmalk == row.Pvmalk
-            and self.Pvmasti == row.Pvmasti
-            and self.tyyppiIdEWC == row.tyyppiIdEWC
-            and self.astiamaara == row.astiamaara
-            and self.koko == row.koko
-            and self.Kuntatun == row.Kuntatun
-            and self.palveluKimppakohdeId == row.palveluKimppakohdeId
-            and self.kimpanNimi == row.kimpanNimi
-            and self.Kimpanyhteyshlo == row.Kimpanyhteyshlo
-            and self.Kimpankatuosoite == row.Kimpankatuosoite
-            and self.Kimpanposti == row.Kimpanposti
-            and self.Keskeytysalkaen == row.Keskeytysalkaen
-            and self.Keskeytysasti == row.Keskeytysasti
-        ) and (
+        if asiakas_identity(self) == asiakas_identity(row) and (
             row.tyhjennysvali not in self.tyhjennysvali
             or row.tyhjennysvali2 not in self.tyhjennysvali
             or row.kertaaviikossa not in self.kertaaviikossa
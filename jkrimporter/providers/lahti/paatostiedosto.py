@@ -44,8 +44,10 @@ class Paatostiedosto:
                 missing_headers_list.append(header)
 
         if missing_headers_list:
-            print(
-                f"Tiedosto: {self._path}, puuttuvat sarakeotsikot: {missing_headers_list}"
+            logger.error(
+                "Tiedosto: %s, puuttuvat sarakeotsikot: %s",
+                self._path,
+                missing_headers_list,
             )
             raise RuntimeError("Päätöstiedostosta puuttuu oletettuja sarakeotsikoita.")
 
@@ -62,7 +64,10 @@ class Paatostiedosto:
                 failed_validations.append(data)
 
         if failed_validations:
-            print(f"Päätostiedosto sisältää {len(failed_validations)} virheellistä riviä.")
+            logger.warning(
+                "Päätostiedosto sisältää %s virheellistä riviä.",
+                len(failed_validations),
+            )
             export_kohdentumattomat_paatokset(os.path.dirname(self._path), failed_validations)
 
         return paatos_list
@@ -1,16 +1,42 @@
-import logging
 import csv
+import io
+import logging
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from jkrimporter.conf import get_kohdentumattomat_siirtotiedosto_filename
 from jkrimporter.datasheets import SiirtotiedostoSheet
 from jkrimporter.datasheets import get_siirtotiedosto_headers
-from jkrimporter.providers.lahti.models import Asiakas, AsiakasRow
-from pydantic import ValidationError
+from jkrimporter.providers.lahti.models import Asiakas, AsiakasRow, asiakas_identity
+from jkrimporter.providers.lahti.validation import validate_asiakas_rows
 
 logger = logging.getLogger(__name__)
 
+BOM = b"\xef\xbb\xbf"
+
+# Rows validated at a time, column-wise
+VALIDATION_CHUNK_SIZE = 5000
+
+
+def _validate_rows(
+    rows: List[Dict[str, str]]
+) -> List[Tuple[Optional[AsiakasRow], Optional[str]]]:
+    return validate_asiakas_rows(rows)
+
+
+def _chunks(
+    rows: Iterable[Dict[str, str]], size: int
+) -> Iterator[List[Dict[str, str]]]:
+    rows = iter(rows)
+    chunk = list(islice(rows, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(rows, size))
+
 
 class AsiakastiedotSheet(SiirtotiedostoSheet[Asiakas]):
     @staticmethod
@@ -19,8 +45,9 @@ class AsiakastiedotSheet(SiirtotiedostoSheet[Asiakas]):
 
 
 class LahtiSiirtotiedosto:
-    def __init__(self, path):
+    def __init__(self, path, workers: int = 1):
         self._path = path
+        self._workers = workers
 
     @classmethod
     def readable_by_me(cls, path):
@@ -30,85 +57,146 @@ class LahtiSiirtotiedosto:
                 return True
         return False
 
-    @property
-    def asiakastiedot(self):
-        all_data = []
-        asiakas_list = []
-        asiakas_rows = []
-        failed_validations = []
+    def input_files(self) -> List[Path]:
+        """
+        Returns the files read by the import. The kohdentumattomat file of the
+        previous import is read as well, as it may have been corrected.
+        """
+        return list(Path(self._path).glob("*.csv"))
+
+    @staticmethod
+    @contextmanager
+    def _open_csv(csv_file_path: Path) -> "Iterator[csv.DictReader]":
+        """
+        Opens the CSV file for reading rows one at a time.
+        """
+        with open(csv_file_path, mode="rb") as csv_file:
+            # Handle BOM
+            if csv_file.read(len(BOM)) != BOM:
+                csv_file.seek(0)
+            with io.TextIOWrapper(csv_file, encoding="cp1252", newline="") as content:
+                yield csv.DictReader(
+                    content, delimiter=";", quotechar='"', skipinitialspace=True
+                )
+
+    def _check_headers(self, csv_file_paths: List[Path], expected_headers: List[str]):
         missing_headers_list = []
-        expected_headers = get_siirtotiedosto_headers()
+        for csv_file_path in csv_file_paths:
+            # Only the header line is read here
+            with self._open_csv(csv_file_path) as csv_reader:
+                headers = csv_reader.fieldnames or []
+            missing_headers = [
+                header for header in expected_headers if header not in headers
+            ]
+            if missing_headers:
+                missing_headers_list.append(
+                    {"file_path": csv_file_path, "headers": missing_headers}
+                )
 
-        # Iterate through all CSV files in the directory to check headers
-        for csv_file_path in Path(self._path).glob("*.csv"):
-            with open(csv_file_path, mode="rb") as csv_file:
-                # Read the content and handle BOM
-                content = csv_file.read()
-                if content.startswith(b'\xef\xbb\xbf'):
-                    content = content[3:]
-                content = content.decode("cp1252")
-                csv_reader = csv.DictReader(content.splitlines(), delimiter=";", quotechar='"', skipinitialspace=True)
-                headers = csv_reader.fieldnames
-                missing_headers = [header for header in expected_headers if header not in headers]
-
-                if missing_headers:
-                    missing_headers_list.append({
-                        'file_path': csv_file_path,
-                        'headers': missing_headers
-                    })
-
-        # Print information after the loop through all files
         for file in missing_headers_list:
-            print(f"Tiedosto: {file['file_path']}, puuttuvat sarakeotsikot: {file['headers']}")
+            logger.error(
+                "Tiedosto: %s, puuttuvat sarakeotsikot: %s",
+                file["file_path"],
+                file["headers"],
+            )
 
         if missing_headers_list:
             raise RuntimeError("Osassa tiedostoissa oletetut sarakeotsikot puuttuvat.")
 
-        # Iterate through all CSV files in the directory
-        for csv_file_path in Path(self._path).glob("*.csv"):
-            with open(csv_file_path, mode="rb") as csv_file:
-                # Read the content and handle BOM
-                content = csv_file.read()
-                if content.startswith(b'\xef\xbb\xbf'):
-                    content = content[3:]
-                content = content.decode("cp1252")
-                csv_reader = csv.DictReader(content.splitlines(), delimiter=";", quotechar='"', skipinitialspace=True)
-                data_list = [row for row in csv_reader]
-                all_data.extend(data_list)
-
-        for data in all_data:
-            # Validate AsiakasRow, if validation fails, append to failed_validations
-            try:
-                asiakas_obj = AsiakasRow.parse_obj(data)
-                asiakas_rows.append(asiakas_obj)
-            except ValidationError as e:
-                logger.warning(f"Asiakas-objektin luonti epäonnistui datalla: {data}. Virhe: {e}")
-                failed_validations.append(data)
+    def _write_failed_validations(
+        self, failed_validations: List[Dict[str, str]], expected_headers: List[str]
+    ):
+        output_file_path = (
+            Path(self._path) / get_kohdentumattomat_siirtotiedosto_filename()
+        )
+        with open(
+            output_file_path, mode="w", encoding="cp1252", newline=""
+        ) as output_csv_file:
+            csv_writer = csv.DictWriter(
+                output_csv_file,
+                expected_headers,
+                delimiter=";",
+                quotechar='"',
+                extrasaction="ignore",
+            )
+            csv_writer.writeheader()
+            csv_writer.writerows(failed_validations)
 
-        # Save failed validations to a new CSV file.
-        output_directory = csv_file_path.parent
-        output_file_path = output_directory / get_kohdentumattomat_siirtotiedosto_filename()
+    def asiakas_rows(self) -> Iterator[AsiakasRow]:
+        """
+        Yields the validated rows of all CSV files in the directory, reading the
+        files one row at a time. Headers of all files are checked before any rows
+        are read.
 
-        with open(output_file_path, mode="w", encoding="cp1252", newline="") as output_csv_file:
-            csv_writer = csv.DictWriter(output_csv_file, expected_headers, delimiter=";", quotechar='"')
-            csv_writer.writeheader()
-            if failed_validations:
-                # Filter out columns not in expected_headers
-                filtered_failed_validations = [
-                    {key: value for key, value in data.items() if key in expected_headers}
-                    for data in failed_validations
-                ]
+        Rows failing validation are saved to a new CSV file once all rows have
+        been read.
+        """
+        expected_headers = get_siirtotiedosto_headers()
+        csv_file_paths = self.input_files()
+        self._check_headers(csv_file_paths, expected_headers)
 
-                csv_writer.writerows(filtered_failed_validations)
+        failed_validations = []
+        for data, (asiakas_row, error) in self._validate(self._read(csv_file_paths)):
+            # Validate AsiakasRow, if validation fails, append to failed_validations
+            if error:
+                logger.warning(
+                    "Asiakas-objektin luonti epäonnistui datalla: %s. Virhe: %s",
+                    data,
+                    error,
+                )
+                failed_validations.append(data)
+                continue
+            yield asiakas_row
+
+        self._write_failed_validations(failed_validations, expected_headers)
+
+    def _read(self, csv_file_paths: List[Path]) -> Iterator[Dict[str, str]]:
+        for csv_file_path in csv_file_paths:
+            with self._open_csv(csv_file_path) as csv_reader:
+                yield from csv_reader
+
+    def _validate(
+        self, rows: Iterator[Dict[str, str]]
+    ) -> Iterator[Tuple[Dict[str, str], Tuple[Optional[AsiakasRow], Optional[str]]]]:
+        """
+        Yields each row with its validation result, in the original order.
+
+        With multiple workers, the rows of all files are validated in chunks in a
+        process pool. Only a few chunks per worker are read ahead.
+        """
+        if self._workers <= 1:
+            for chunk in _chunks(rows, VALIDATION_CHUNK_SIZE):
+                yield from zip(chunk, _validate_rows(chunk))
+            return
+
+        with ProcessPoolExecutor(self._workers) as executor:
+            pending = deque()
+            for chunk in _chunks(rows, VALIDATION_CHUNK_SIZE):
+                pending.append((chunk, executor.submit(_validate_rows, chunk)))
+                if len(pending) > 2 * self._workers:
+                    chunk, results = pending.popleft()
+                    yield from zip(chunk, results.result())
+            while pending:
+                chunk, results = pending.popleft()
+                yield from zip(chunk, results.result())
 
+    @property
+    def asiakastiedot(self):
+        asiakas_list = []
+        # Rows may only be added to asiakkaat with the same identity fields. There
+        # may be several of them, if the rows have the same tyhjennysvälit.
+        asiakkaat_by_identity: Dict[Tuple, List[Asiakas]] = defaultdict(list)
         # Create asiakas objects from rows
-        for asiakas_row in asiakas_rows:
+        for asiakas_row in self.asiakas_rows():
+            asiakkaat = asiakkaat_by_identity[asiakas_identity(asiakas_row)]
             asiakas_found = False
-            for asiakas in asiakas_list:
+            for asiakas in asiakkaat:
                 if asiakas.check_and_add_row(asiakas_row):
                     asiakas_found = True
                     break
             if not asiakas_found:
-                asiakas_list.append(Asiakas(asiakas_row))
+                asiakas = Asiakas(asiakas_row)
+                asiakkaat.append(asiakas)
+                asiakas_list.append(asiakas)
 
         return asiakas_list
@@ -0,0 +1,219 @@
+"""
+Fast validation of Lahti siirtotiedosto rows.
+
+AsiakasRow validators are run separately for each field of each row. Here, the rows
+of a chunk are converted a column at a time with the same rules, memoizing the
+values that repeat from row to row, such as dates, jätelajit and postitoimipaikat.
+Rows that the fast path cannot convert are validated with AsiakasRow.parse_obj, so
+that invalid rows get the same errors as before.
+"""
+import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from jkrimporter.providers.lahti.models import AsiakasRow, Jatelaji
+
+
+class _Invalid(Exception):
+    """
+    Value the fast path cannot convert. The row is validated by pydantic instead.
+    """
+
+
+def _identity(value: str):
+    return value
+
+
+# The validator functions of AsiakasRow, without the classmethod wrapper
+_fix_katuosoite = AsiakasRow.fix_katuosoite.__func__
+_fix_posti = AsiakasRow.fix_posti.__func__
+_parse_jatelaji = AsiakasRow.parse_jatelaji.__func__
+
+
+@lru_cache(maxsize=4096)
+def _katuosoite(value: str) -> Optional[str]:
+    return _fix_katuosoite(value)
+
+
+@lru_cache(maxsize=4096)
+def _posti(value: str) -> str:
+    return _fix_posti(value)
+
+
+@lru_cache(maxsize=4096)
+def _strptime(value: str) -> datetime.date:
+    return datetime.datetime.strptime(value, "%d.%m.%Y").date()
+
+
+def _date(value: str) -> datetime.date:
+    if "." not in value:
+        # Other formats are parsed by pydantic
+        raise _Invalid
+    return _strptime(value)
+
+
+def _date_or_empty(value: str) -> Optional[datetime.date]:
+    if value == "#N/A" or value == "":
+        return None
+    return _date(value)
+
+
+@lru_cache(maxsize=256)
+def _jatelaji(value: str) -> Jatelaji:
+    return Jatelaji(_parse_jatelaji(value))
+
+
+def _float(value: str) -> float:
+    return float(value.replace(",", "."))
+
+
+def _float_or_empty(value: str) -> Optional[float]:
+    if value == "":
+        return None
+    return _float(value)
+
+
+def _int_or_none(value: str) -> Optional[int]:
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _required_int(value: str) -> int:
+    value = _int_or_none(value)
+    if value is None:
+        raise _Invalid
+    return value
+
+
+def _week(value: str) -> int:
+    if value == "#N/A" or value == "":
+        raise _Invalid
+    return int(value)
+
+
+def _optional_week(value: str) -> Optional[int]:
+    if value == "#N/A" or value == "":
+        return None
+    return int(value)
+
+
+def _kuntatunnus(value: str) -> Optional[int]:
+    if value:
+        return int(value)
+    return None
+
+
+# Conversions matching the validators of each AsiakasRow field, for string values
+CONVERTERS: Dict[str, Callable[[str], Any]] = {
+    "UrakoitsijaId": _identity,
+    "UrakoitsijankohdeId": _identity,
+    "Kiinteistotunnus": _identity,
+    "Kiinteistonkatuosoite": _katuosoite,
+    "Kiinteistonposti": _posti,
+    # Haltijannimi depends on UrakoitsijankohdeId, see _convert_column
+    "Haltijannimi": _identity,
+    "Haltijanyhteyshlo": _identity,
+    "Haltijankatuosoite": _katuosoite,
+    "Haltijanposti": _posti,
+    "Haltijanmaakoodi": _identity,
+    "Haltijanulkomaanpaikkakunta": _identity,
+    "Pvmalk": _date,
+    "Pvmasti": _date,
+    "tyyppiIdEWC": _jatelaji,
+    "kaynnit": _required_int,
+    "astiamaara": _float,
+    "koko": _float_or_empty,
+    "paino": _float_or_empty,
+    "tyhjennysvali": _int_or_none,
+    "tyhjennysvali2": _int_or_none,
+    "kertaaviikossa": _int_or_none,
+    "kertaaviikossa2": _int_or_none,
+    "Voimassaoloviikotalkaen": _week,
+    "Voimassaoloviikotasti": _week,
+    "Voimassaoloviikotalkaen2": _optional_week,
+    "Voimassaoloviikotasti2": _optional_week,
+    "Kuntatun": _kuntatunnus,
+    "palveluKimppakohdeId": _identity,
+    "kimpanNimi": _identity,
+    "Kimpanyhteyshlo": _identity,
+    "Kimpankatuosoite": _katuosoite,
+    "Kimpanposti": _posti,
+    "Keskeytysalkaen": _date_or_empty,
+    "Keskeytysasti": _date_or_empty,
+}
+
+_MISSING = object()
+
+
+def _check_row(data: Dict[str, Any]) -> bool:
+    """
+    Runs the root validators of AsiakasRow for the row.
+    """
+    try:
+        for validator in AsiakasRow.__pre_root_validators__:
+            validator(AsiakasRow, data)
+    except (ValueError, TypeError, AssertionError):
+        return False
+    return True
+
+
+def _convert_column(
+    name: str,
+    rows: List[Dict[str, Any]],
+    values: List[Dict[str, Any]],
+    flagged: Set[int],
+):
+    field = AsiakasRow.__fields__[name]
+    convert = CONVERTERS[name]
+    for index, data in enumerate(rows):
+        if index in flagged:
+            continue
+        value = data.get(field.alias, _MISSING)
+        if value is _MISSING:
+            if field.required:
+                flagged.add(index)
+            continue
+        if type(value) is not str:
+            flagged.add(index)
+            continue
+        try:
+            value = convert(value)
+        except (_Invalid, ValueError):
+            flagged.add(index)
+            continue
+        if name == "Haltijannimi" and not value:
+            value = values[index]["UrakoitsijankohdeId"]
+        values[index][name] = value
+
+
+def validate_asiakas_rows(
+    rows: List[Dict[str, Any]]
+) -> List[Tuple[Optional[AsiakasRow], Optional[str]]]:
+    """
+    Returns the validated row, or the validation error message, for each row.
+    The result is the same as with AsiakasRow.parse_obj.
+    """
+    flagged = {index for index, data in enumerate(rows) if not _check_row(data)}
+    values: List[Dict[str, Any]] = [{} for _ in rows]
+    for name in AsiakasRow.__fields__:
+        _convert_column(name, rows, values, flagged)
+
+    results = []
+    for index, data in enumerate(rows):
+        if index in flagged:
+            try:
+                results.append((AsiakasRow.parse_obj(data), None))
+            except ValidationError as e:
+                results.append((None, str(e)))
+            continue
+        results.append(
+            (
+                AsiakasRow.construct(_fields_set=set(values[index]), **values[index]),
+                None,
+            )
+        )
+    return results
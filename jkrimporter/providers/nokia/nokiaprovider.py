@@ -3,8 +3,6 @@ import warnings
 from datetime import date
 from typing import Union
 
-from addrparser import AddressParser
-
 from jkrimporter.model import Asiakas as JkrAsiakas
 from jkrimporter.model import Jatelaji as JkrJatelaji
 from jkrimporter.model import JkrData, Keraysvaline
@@ -20,22 +18,19 @@ from jkrimporter.model import (
 from jkrimporter.providers.nokia.models import Asiakas, Jatelaji, KaivoTyyppi
 from jkrimporter.providers.nokia.siirtotiedosto import NokiaSiirtotiedosto
 from jkrimporter.utils.intervals import Interval
-from jkrimporter.utils.osoite import osoite_from_parsed_address
+from jkrimporter.utils.osoite import parse_osoite
 
 logger = logging.getLogger(__name__)
 
-address_parser = AddressParser("fi")
-
 
 def create_haltija(row: "Asiakas"):
     kohteen_osoite = Osoite(kunta=row.kohde_kunta)
     if row.kohde_katuosoite:
         try:
-            parsed_address = address_parser.parse(row.kohde_katuosoite)
+            o = parse_osoite(row.kohde_katuosoite)
         except ValueError:
             kohteen_osoite.erikoisosoite = row.kohde_katuosoite
         else:
-            o = osoite_from_parsed_address(parsed_address)
             kohteen_osoite.katunimi = o.katunimi
             kohteen_osoite.osoitenumero = o.osoitenumero
             kohteen_osoite.huoneistotunnus = o.huoneistotunnus
@@ -54,11 +49,10 @@ def create_yhteyshenkilo(row: "Asiakas"):
     )
     if row.yhteyshenkilo_katuosoite:
         try:
-            parsed_address = address_parser.parse(row.kohde_katuosoite)
+            o = parse_osoite(row.kohde_katuosoite)
         except ValueError:
             yhteyshenkilon_osoite.erikoisosoite = row.yhteyshenkilo_katuosoite
         else:
-            o = osoite_from_parsed_address(parsed_address)
             yhteyshenkilon_osoite.katunimi = o.katunimi
             yhteyshenkilon_osoite.osoitenumero = o.osoitenumero
             yhteyshenkilon_osoite.huoneistotunnus = o.huoneistotunnus
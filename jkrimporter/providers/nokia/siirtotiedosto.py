@@ -1,5 +1,6 @@
 import warnings
 from pathlib import Path
+from typing import List
 
 from openpyxl.reader.excel import load_workbook
 
@@ -25,8 +26,12 @@ class NokiaSiirtotiedosto:
         TYHJENNYKSET = "2. Kuljetukset"
 
     def __init__(self, path):
+        self._path = Path(path)
         self._sheet_collection = ExcelSheetCollection(path)
 
+    def input_files(self) -> List[Path]:
+        return [self._path]
+
     @classmethod
     def readable_by_me(cls, path):
         p = Path(path)
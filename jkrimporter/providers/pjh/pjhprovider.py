@@ -3,8 +3,6 @@ import logging
 from datetime import date
 from typing import TYPE_CHECKING, Union
 
-from addrparser import AddressParser
-
 from jkrimporter.model import Asiakas as JkrAsiakas
 from jkrimporter.model import Jatelaji as JkrJatelaji
 from jkrimporter.model import JkrData
@@ -22,7 +20,7 @@ from jkrimporter.model import Tyhjennystapahtuma as JkrTyhjennystapahtuma
 from jkrimporter.model import Tyhjennysvali as JkrTyhjennysvali
 from jkrimporter.model import Yhteystieto
 from jkrimporter.utils.intervals import Interval
-from jkrimporter.utils.osoite import osoite_from_parsed_address
+from jkrimporter.utils.osoite import parse_osoite
 
 from .siirtotiedosto import PjhSiirtotiedosto
 
@@ -31,8 +29,6 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
-address_parser = AddressParser("fi")
-
 
 def overlap(a: TyhjennysSopimus, b: TyhjennysSopimus) -> bool:
     a1 = a.alkupvm or datetime.date.min
@@ -50,11 +46,10 @@ def create_haltija(row: "Asiakas"):
     )
     if row.kohde_katuosoite:
         try:
-            parsed_address = address_parser.parse(row.kohde_katuosoite)
+            o = parse_osoite(row.kohde_katuosoite)
         except ValueError:
             kohteen_osoite.erikoisosoite = row.kohde_katuosoite
         else:
-            o = osoite_from_parsed_address(parsed_address)
             kohteen_osoite.katunimi = o.katunimi
             kohteen_osoite.osoitenumero = o.osoitenumero
             kohteen_osoite.huoneistotunnus = o.huoneistotunnus
@@ -74,11 +69,10 @@ def create_yhteyshenkilo(row: "Asiakas"):
     )
     if row.yhteyshenkilo_katuosoite:
         try:
-            parsed_address = address_parser.parse(row.kohde_katuosoite)
+            o = parse_osoite(row.kohde_katuosoite)
         except ValueError:
             yhteyshenkilon_osoite.erikoisosoite = row.yhteyshenkilo_katuosoite
         else:
-            o = osoite_from_parsed_address(parsed_address)
             yhteyshenkilon_osoite.katunimi = o.katunimi
             yhteyshenkilon_osoite.osoitenumero = o.osoitenumero
             yhteyshenkilon_osoite.huoneistotunnus = o.huoneistotunnus
@@ -2,6 +2,7 @@ import datetime
 import logging
 import os
 from enum import Enum
+from pathlib import Path
 from typing import List, Optional, TypeVar
 
 from pydantic import BaseModel, Field, ValidationError, root_validator, validator
@@ -226,6 +227,7 @@ class PjhSiirtotiedosto:
         TOIMITUKSET = "toimitukset"
 
     def __init__(self, path):
+        self._path = Path(path)
         sheet_collection_cls = PjhSiirtotiedosto._class_getter(path)
         self._sheet_collection = sheet_collection_cls(path)
 
@@ -247,6 +249,23 @@ class PjhSiirtotiedosto:
 
         return sheet_cls
 
+    def input_files(self) -> List[Path]:
+        """
+        Returns the files of the sheets read by the import.
+        """
+        if isinstance(self._sheet_collection, CsvSheetCollection):
+            suffix = ".csv"
+        elif isinstance(self._sheet_collection, ExcelFileSheetCollection):
+            suffix = ".xlsx"
+        else:
+            return [self._path]
+        files = (
+            self._path / f"{name}{suffix}"
+            for key, name in vars(PjhSiirtotiedosto.SheetNames).items()
+            if not key.startswith("_")
+        )
+        return [file for file in files if file.is_file()]
+
     @property
     def meta(self):
         return MetaSheet(self._sheet_collection, PjhSiirtotiedosto.SheetNames.META)
@@ -0,0 +1,159 @@
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+Point = Tuple[float, float]
+
+
+class UnionFind:
+    def __init__(self, items: Iterable[int]):
+        self._parents = {item: item for item in items}
+
+    def find(self, item: int) -> int:
+        root = item
+        while self._parents[root] != root:
+            root = self._parents[root]
+        # compress the path for later lookups
+        while self._parents[item] != root:
+            self._parents[item], item = root, self._parents[item]
+        return root
+
+    def union(self, first: int, second: int):
+        first_root = self.find(first)
+        second_root = self.find(second)
+        if first_root != second_root:
+            self._parents[max(first_root, second_root)] = min(first_root, second_root)
+
+    def groups(self) -> Dict[int, Set[int]]:
+        groups: Dict[int, Set[int]] = defaultdict(set)
+        for item in self._parents:
+            groups[self.find(item)].add(item)
+        return groups
+
+
+class PointGrid:
+    """
+    Grid index of points. With cell size equal to the search distance, only the
+    neighbouring cells have to be searched.
+    """
+
+    def __init__(self, points: Dict[int, Point], cell_size: float):
+        self._points = points
+        self._cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for index, point in points.items():
+            self._cells[self._cell(point)].append(index)
+
+    def _cell(self, point: Point) -> Tuple[int, int]:
+        return (
+            math.floor(point[0] / self._cell_size),
+            math.floor(point[1] / self._cell_size),
+        )
+
+    def within(self, point: Point, distance: float) -> Iterator[int]:
+        """
+        Yields the indices of all points closer than distance to point. Distance
+        may not be larger than the cell size.
+        """
+        x, y = point
+        cell_x, cell_y = self._cell(point)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for index in self._cells.get((cell_x + dx, cell_y + dy), ()):
+                    other_x, other_y = self._points[index]
+                    if math.hypot(other_x - x, other_y - y) < distance:
+                        yield index
+
+
+def cluster_points(
+    points: Sequence[Optional[Point]],
+    distance_limit: float,
+    existing_cluster: Iterable[int] = (),
+) -> List[Set[int]]:
+    """
+    Returns the indices of points clustered so that all points closer than
+    distance_limit to any other point of a cluster are joined to the same
+    cluster (single-linkage clustering).
+
+    Points in existing_cluster form the first cluster and are never split. If the
+    existing cluster is not connected by itself, it can only grow by a point close
+    enough to all of its separated points. Points without location (None) are joined
+    to the first cluster that may grow.
+    """
+    existing = set(existing_cluster)
+    remaining = [index for index in range(len(points)) if index not in existing]
+    if not remaining:
+        return []
+
+    located = {index: points[index] for index in remaining if points[index] is not None}
+    unlocated = {index for index in remaining if points[index] is None}
+    grid = PointGrid(located, distance_limit)
+
+    # Components of the points to cluster
+    union_find = UnionFind(located)
+    for index, point in located.items():
+        for other in grid.within(point, distance_limit):
+            if other > index:
+                union_find.union(index, other)
+    components = union_find.groups()
+
+    clusters = []
+    if existing:
+        cluster = set(existing)
+        seed_points = {
+            index: points[index] for index in existing if points[index] is not None
+        }
+        # Existing points with no other existing point close enough
+        separated = []
+        if len(seed_points) > 1:
+            seed_grid = PointGrid(seed_points, distance_limit)
+            separated = [
+                index
+                for index, point in seed_points.items()
+                if not any(
+                    other != index
+                    for other in seed_grid.within(point, distance_limit)
+                )
+            ]
+        can_grow = True
+        roots = set()
+        if separated:
+            # The first point close enough to all separated points joins them
+            bridges = sorted(
+                index
+                for index in grid.within(seed_points[separated[0]], distance_limit)
+                if all(
+                    math.hypot(
+                        located[index][0] - seed_points[other][0],
+                        located[index][1] - seed_points[other][1],
+                    )
+                    < distance_limit
+                    for other in separated
+                )
+            )
+            can_grow = bool(bridges)
+            if bridges:
+                roots.add(union_find.find(bridges[0]))
+        elif not seed_points and located:
+            # Without location, the existing cluster accepts any point
+            roots.add(union_find.find(min(located)))
+
+        if can_grow:
+            roots |= {
+                union_find.find(index)
+                for point in seed_points.values()
+                for index in grid.within(point, distance_limit)
+            }
+            for root in roots:
+                cluster |= components.pop(root)
+            cluster |= unlocated
+            unlocated = set()
+        clusters.append(cluster)
+
+    # Remaining components in the order of their first point
+    for root in sorted(components):
+        clusters.append(components[root] | unlocated)
+        unlocated = set()
+    if unlocated:
+        clusters.append(unlocated)
+    return clusters
@@ -1,9 +1,8 @@
+import logging
 import os
 from pathlib import Path
 from typing import Dict, List
 
-import openpyxl
-
 from jkrimporter.conf import (
     get_kohdentumattomat_ilmoitus_filename,
     get_kohdentumattomat_lopetusilmoitus_filename,
@@ -12,6 +11,9 @@ from jkrimporter.datasheets import (
     get_ilmoitustiedosto_headers,
     get_lopetustiedosto_headers
 )
+from jkrimporter.utils.xlsx import export_rows
+
+logger = logging.getLogger(__name__)
 
 
 def export_kohdentumattomat_ilmoitukset(
@@ -24,14 +26,6 @@ def export_kohdentumattomat_ilmoitukset(
         folder, get_kohdentumattomat_ilmoitus_filename()
     )
 
-    if os.path.exists(output_file_path_failed):
-        workbook_failed = openpyxl.load_workbook(output_file_path_failed)
-        sheet_failed = workbook_failed[workbook_failed.sheetnames[0]]
-    else:
-        workbook_failed = openpyxl.Workbook()
-        sheet_failed = workbook_failed[workbook_failed.sheetnames[0]]
-        sheet_failed.append(expected_headers)
-
     filtered_kohdentumattomat = []
 
     for data in kohdentumattomat:
@@ -52,14 +46,18 @@ def export_kohdentumattomat_ilmoitukset(
                 }
                 filtered_kohdentumattomat.append(filtered_data)
             else:
-                print("Unexpected nested structure:", data)
+                logger.warning("Unexpected nested structure: %s", data)
         else:
-            print("Unsupported data type:", type(data))
-
-    for row in filtered_kohdentumattomat:
-        sheet_failed.append([row.get(header, "") for header in expected_headers])
-
-    workbook_failed.save(output_file_path_failed)
+            logger.warning("Unsupported data type: %s", type(data))
+
+    export_rows(
+        output_file_path_failed,
+        expected_headers,
+        (
+            [row.get(header, "") for header in expected_headers]
+            for row in filtered_kohdentumattomat
+        ),
+    )
 
 
 def export_kohdentumattomat_lopetusilmoitukset(
@@ -72,19 +70,15 @@ def export_kohdentumattomat_lopetusilmoitukset(
         folder, get_kohdentumattomat_lopetusilmoitus_filename()
     )
 
-    if os.path.exists(output_file_path_failed):
-        workbook_failed = openpyxl.load_workbook(output_file_path_failed)
-        sheet_failed = workbook_failed[workbook_failed.sheetnames[0]]
-    else:
-        workbook_failed = openpyxl.Workbook()
-        sheet_failed = workbook_failed[workbook_failed.sheetnames[0]]
-        sheet_failed.append(expected_headers)
-
     filtered_kohdentumattomat = [
         {key: value for key, value in data.items() if key in expected_headers}
         for data in kohdentumattomat
     ]
-    for row in filtered_kohdentumattomat:
-        sheet_failed.append([row.get(header, "") for header in expected_headers])
-
-    workbook_failed.save(output_file_path_failed)
+    export_rows(
+        output_file_path_failed,
+        expected_headers,
+        (
+            [row.get(header, "") for header in expected_headers]
+            for row in filtered_kohdentumattomat
+        ),
+    )
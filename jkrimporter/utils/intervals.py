@@ -1,5 +1,6 @@
+from bisect import bisect_left, bisect_right
 from datetime import date
-from typing import Any, List, NamedTuple, Union
+from typing import Any, Iterable, List, NamedTuple, Union
 
 
 class Interval(NamedTuple):
@@ -55,6 +56,67 @@ class IntervalCounter(List[Interval]):
         return len([1 for i in self if i.overlaps(interval)])
 
 
+def _reversed(interval: Interval) -> bool:
+    return (
+        interval.lower is not None
+        and interval.upper is not None
+        and interval.lower > interval.upper
+    )
+
+
+class IntervalIndex:
+    """
+    Immutable collection of intervals, counting them like IntervalCounter in
+    O(log n) time.
+
+    An interval does not overlap another if it starts after the other ends, or ends
+    before the other starts. These are counted from the sorted ends of the
+    intervals. Intervals with lower > upper may be both, so they are counted
+    separately.
+    """
+
+    def __init__(self, intervals: Iterable[Interval] = ()):
+        self._intervals = tuple(intervals)
+        self._reversed = [i for i in self._intervals if _reversed(i)]
+        ordered = [i for i in self._intervals if not _reversed(i)]
+        self._ordered_count = len(ordered)
+        self._lowers = sorted(i.lower for i in ordered if i.lower is not None)
+        self._uppers = sorted(i.upper for i in ordered if i.upper is not None)
+        self._unbounded_count = len(
+            [1 for i in self._intervals if i.lower is None or i.upper is None]
+        )
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    def _count_ordered(self, lower, upper) -> int:
+        """
+        Counts the ordered intervals overlapping lower and upper.
+        """
+        count = self._ordered_count
+        if upper is not None:
+            count -= len(self._lowers) - bisect_right(self._lowers, upper)
+        if lower is not None:
+            count -= bisect_left(self._uppers, lower)
+        return count
+
+    def count_containing(self, value) -> int:
+        if isinstance(value, Interval):
+            return len([1 for i in self._intervals if i.contains(value)])
+        if value is None:
+            return self._unbounded_count
+        return self._count_ordered(value, value) + len(
+            [1 for i in self._reversed if i.contains(value)]
+        )
+
+    def count_overlapping(self, interval: "Interval") -> int:
+        if _reversed(interval):
+            return len([1 for i in self._intervals if i.overlaps(interval)])
+        return self._count_ordered(interval.lower, interval.upper) + len(
+            [1 for i in self._reversed if i.overlaps(interval)]
+        )
+
+
 if __name__ == "__main__":
     v = IntervalCounter(
         [Interval(1, 4), Interval(2, 6), Interval(None, 2)]
@@ -0,0 +1,113 @@
+import gzip
+import hashlib
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple, Optional
+
+import jkrimporter
+from jkrimporter import conf
+
+if TYPE_CHECKING:
+    from datetime import date
+
+    from jkrimporter.model import JkrData
+
+logger = logging.getLogger(__name__)
+
+# Translated data of the latest transfers kept in config_dir
+JKRDATA_CACHE_SIZE = 5
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class CachedJkrData(NamedTuple):
+    jkr_data: "JkrData"
+    # Contents of the kohdentumattomat file after parsing the siirtotiedosto, i.e.
+    # the rows failing validation
+    kohdentumattomat: Optional[bytes] = None
+
+
+def _source_files() -> Iterator[Path]:
+    # Any change in the importer may change the translated data
+    yield from sorted(Path(jkrimporter.__file__).parent.rglob("*.py"))
+
+
+def _update_with_file(key: "hashlib._Hash", file: Path):
+    key.update(f"{file.name}\n".encode())
+    with open(file, "rb") as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), b""):
+            key.update(block)
+
+
+def get_cache_key(
+    input_files: Iterable[Path],
+    tiedontuottajatunnus: str,
+    translator: type,
+    alkupvm: "Optional[date]",
+    loppupvm: "Optional[date]",
+) -> str:
+    """
+    Returns a hash of the input files, the importer source and the parameters of
+    the translation. The input files are those the siirtotiedosto reads.
+    """
+    key = hashlib.sha256()
+    for part in (
+        f"{translator.__module__}.{translator.__qualname__}",
+        tiedontuottajatunnus,
+        alkupvm,
+        loppupvm,
+    ):
+        key.update(f"{part}\n".encode())
+    for file in _source_files():
+        _update_with_file(key, file)
+    for file in sorted(input_files, key=lambda file: file.name):
+        _update_with_file(key, file)
+    return key.hexdigest()
+
+
+def get_cache_dir() -> str:
+    return os.path.join(conf.config_dir, "jkrdata")
+
+
+def get_cache_path(key: str) -> str:
+    return os.path.join(get_cache_dir(), f"{key}.pickle.gz")
+
+
+def read_jkr_data(key: str) -> "Optional[CachedJkrData]":
+    path = get_cache_path(key)
+    try:
+        with gzip.open(path, "rb") as cache_file:
+            data = pickle.load(cache_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Välimuistitiedostoa %s ei voitu lukea: %s", path, e)
+        return None
+    logger.info("Siirtotiedoston data luettu välimuistista: %s", path)
+    return data
+
+
+def _remove_old(cache_dir: str):
+    paths = sorted(
+        (entry.path for entry in os.scandir(cache_dir) if entry.name.endswith(".gz")),
+        key=os.path.getmtime,
+    )
+    for path in paths[:-JKRDATA_CACHE_SIZE]:
+        os.remove(path)
+
+
+def write_jkr_data(key: str, data: CachedJkrData):
+    path = get_cache_path(key)
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(tmp_path, "wb") as cache_file:
+            pickle.dump(data, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        _remove_old(os.path.dirname(path))
+    except OSError as e:
+        logger.warning("Välimuistitiedostoa %s ei voitu tallentaa: %s", path, e)
+        return
+    logger.info("Siirtotiedoston data tallennettu välimuistiin: %s", path)
@@ -0,0 +1,152 @@
+import csv
+import logging
+from operator import attrgetter
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from jkrimporter.conf import get_kohdentumattomat_siirtotiedosto_filename
+from jkrimporter.datasheets import get_siirtotiedosto_headers
+
+if TYPE_CHECKING:
+    from typing import IO
+
+    from jkrimporter.model import Asiakas
+
+logger = logging.getLogger(__name__)
+
+# Rows written to the file at a time
+KOHDENTUMATTOMAT_BUFFER_SIZE = 1000
+
+
+def _field(name: str) -> "Callable[[Asiakas, int], Any]":
+    get = attrgetter(f"ulkoinen_asiakastieto.{name}")
+    return lambda asiakas, ii: get(asiakas)
+
+
+def _rowwise(name: str, step: int = 1, offset: int = 0):
+    get = attrgetter(f"ulkoinen_asiakastieto.{name}")
+    return lambda asiakas, ii: get(asiakas)[ii * step + offset]
+
+
+def _date(name: str):
+    get = attrgetter(f"voimassa.{name}")
+    return lambda asiakas, ii: get(asiakas).strftime("%d.%m.%Y")
+
+
+# Value of each column on the ii:th row of asiakas. Lahti asiakas has two
+# tyhjennysvälit per row.
+KOHDENTUMATTOMAT_COLUMNS: "Dict[str, Callable[[Asiakas, int], Any]]" = {
+    "UrakoitsijaId": _field("UrakoitsijaId"),
+    "UrakoitsijankohdeId": _field("UrakoitsijankohdeId"),
+    "Kiinteistotunnus": _field("Kiinteistotunnus"),
+    "Kiinteistonkatuosoite": _field("Kiinteistonkatuosoite"),
+    "Kiinteistonposti": _field("Kiinteistonposti"),
+    "Haltijannimi": _field("Haltijannimi"),
+    "Haltijanyhteyshlo": _field("Haltijanyhteyshlo"),
+    "Haltijankatuosoite": _field("Haltijankatuosoite"),
+    "Haltijanposti": _field("Haltijanposti"),
+    "Haltijanmaakoodi": _field("Haltijanmaakoodi"),
+    "Pvmalk": _date("lower"),
+    "Pvmasti": _date("upper"),
+    "tyyppiIdEWC": _field("tyyppiIdEWC"),
+    "COUNT(kaynnit)": _rowwise("kaynnit"),
+    "SUM(astiamaara)": _field("astiamaara"),
+    "koko": _field("koko"),
+    "SUM(paino)": _rowwise("paino"),
+    "tyhjennysvali": _rowwise("tyhjennysvali", 2),
+    "kertaaviikossa": _rowwise("kertaaviikossa", 2),
+    "Voimassaoloviikotalkaen": _rowwise("Voimassaoloviikotalkaen", 2),
+    "Voimassaoloviikotasti": _rowwise("Voimassaoloviikotasti", 2),
+    "Voimassaoloviikotalkaen2": _rowwise("Voimassaoloviikotalkaen", 2, 1),
+    "Voimassaoloviikotasti2": _rowwise("Voimassaoloviikotasti", 2, 1),
+    "tyhjennysvali2": _rowwise("tyhjennysvali", 2, 1),
+    "kertaaviikossa2": _rowwise("kertaaviikossa", 2, 1),
+    "palveluKimppakohdeId": _field("palveluKimppakohdeId"),
+    "KimpanNimi": _field("kimpanNimi"),
+    "Kimpanyhteyshlo": _field("Kimpanyhteyshlo"),
+    "Kimpankatuosoite": _field("Kimpankatuosoite"),
+    "Kimpanposti": _field("Kimpanposti"),
+    "Kuntatun": _field("Kuntatun"),
+    "Keskeytysalkaen": _field("Keskeytysalkaen"),
+    "Keskeytysasti": _field("Keskeytysasti"),
+}
+
+
+def _empty(asiakas: "Asiakas", ii: int):
+    return None
+
+
+def read_kohdentumattomat(folder: Path) -> Optional[bytes]:
+    """
+    Returns the contents of the kohdentumattomat CSV file in the siirtotiedosto
+    folder, or None if there is no such file.
+    """
+    path = Path(folder) / get_kohdentumattomat_siirtotiedosto_filename()
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def write_kohdentumattomat(folder: Path, content: bytes):
+    """
+    Replaces the kohdentumattomat CSV file in the siirtotiedosto folder, e.g. with
+    the rows failing validation when the siirtotiedosto was parsed.
+    """
+    path = Path(folder) / get_kohdentumattomat_siirtotiedosto_filename()
+    path.write_bytes(content)
+
+
+class KohdentumattomatKuljetukset:
+    """
+    Appends the rows of asiakkaat without kohde to the kohdentumattomat CSV file in
+    the siirtotiedosto folder. The file is opened once, when the first rows are
+    written, and rows are written in batches. Use as a context manager, so that the
+    buffered rows are written also in case of errors.
+    """
+
+    def __init__(
+        self, folder: Path, buffer_size: int = KOHDENTUMATTOMAT_BUFFER_SIZE
+    ):
+        self.path = Path(folder) / get_kohdentumattomat_siirtotiedosto_filename()
+        self.buffer_size = buffer_size
+        self.count = 0
+        # Columns in file order
+        self._columns = [
+            KOHDENTUMATTOMAT_COLUMNS.get(header, _empty)
+            for header in get_siirtotiedosto_headers()
+        ]
+        self._rows: List[List[Any]] = []
+        self._file: "Optional[IO[str]]" = None
+        self._writer = None
+
+    def __enter__(self) -> "KohdentumattomatKuljetukset":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, asiakas: "Asiakas"):
+        for ii, _ in enumerate(asiakas.ulkoinen_asiakastieto.kaynnit):
+            self._rows.append([column(asiakas, ii) for column in self._columns])
+        self.count += 1
+        if len(self._rows) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        if self._writer is None:
+            self._file = open(self.path, mode="a", encoding="cp1252", newline="")
+            self._writer = csv.writer(self._file, delimiter=";", quotechar='"')
+        self._writer.writerows(self._rows)
+        self._rows = []
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._writer = None
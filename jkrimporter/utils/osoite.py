@@ -1,10 +1,31 @@
-from typing import TYPE_CHECKING
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Optional, Tuple
 
+import addrparser
+from addrparser import AddressParser
+
+from jkrimporter import conf
 from jkrimporter.model import Osoite
 
 if TYPE_CHECKING:
     from addrparser import Address
 
+logger = logging.getLogger(__name__)
+
+address_parser = AddressParser("fi")
+
+# Parsed addresses kept in memory
+OSOITE_CACHE_SIZE = 100000
+
+OSOITE_CACHE_FILENAME = "osoitteet.sqlite"
+
+# katunimi, osoitenumero and huoneistotunnus, or None if the address is invalid
+ParsedOsoite = Optional[Tuple[Optional[str], Optional[str], Optional[str]]]
+
 
 def osoite_from_parsed_address(address: "Address") -> Osoite:
 
@@ -20,3 +41,146 @@ def osoite_from_parsed_address(address: "Address") -> Osoite:
         osoitenumero=address.house_number,
         huoneistotunnus=huoneistotunnus,
     )
+
+
+def _parse(address: str) -> ParsedOsoite:
+    try:
+        osoite = osoite_from_parsed_address(address_parser.parse(address))
+    except ValueError:
+        return None
+    return osoite.katunimi, osoite.osoitenumero, osoite.huoneistotunnus
+
+
+class OsoiteCache:
+    """
+    Parsed addresses by address string. The same addresses repeat on many rows of
+    the input files, and parsing them with the address grammar is slow.
+
+    Addresses are kept in memory up to maxsize. Optionally, they are also saved to
+    a SQLite file, so that they may be reused in later runs.
+    """
+
+    def __init__(self, maxsize: int = OSOITE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._parsed: "OrderedDict[str, ParsedOsoite]" = OrderedDict()
+        self._connection: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.file_hits = 0
+        self.misses = 0
+
+    def open(self, path: str):
+        """
+        Reads and saves parsed addresses in the given file. Addresses parsed with
+        another addrparser version are discarded.
+        """
+        # When streaming, addresses are parsed in another thread
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS versio (addrparser TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS osoite ("
+            "osoite TEXT PRIMARY KEY, katunimi TEXT, osoitenumero TEXT, "
+            "huoneistotunnus TEXT, virheellinen INTEGER NOT NULL)"
+        )
+        versions = [
+            row[0] for row in self._connection.execute("SELECT addrparser FROM versio")
+        ]
+        if versions != [addrparser.__version__]:
+            self._connection.execute("DELETE FROM versio")
+            self._connection.execute("DELETE FROM osoite")
+            self._connection.execute(
+                "INSERT INTO versio VALUES (?)", (addrparser.__version__,)
+            )
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.commit()
+            self._connection.close()
+            self._connection = None
+
+    def clear(self):
+        self._parsed.clear()
+        self.hits = self.file_hits = self.misses = 0
+
+    @contextmanager
+    def persisted(self):
+        """
+        Uses the cache file in config_dir, if enabled with JKR_OSOITE_CACHE.
+        """
+        if conf.osoite_cache:
+            os.makedirs(conf.config_dir, exist_ok=True)
+            self.open(os.path.join(conf.config_dir, OSOITE_CACHE_FILENAME))
+        try:
+            yield self
+        finally:
+            self.close()
+            logger.info(
+                "Osoitteita jäsennetty %s, välimuistista %s, tiedostosta %s",
+                self.misses,
+                self.hits,
+                self.file_hits,
+            )
+
+    def _read(self, key: str) -> "Tuple[bool, ParsedOsoite]":
+        if self._connection is None:
+            return False, None
+        row = self._connection.execute(
+            "SELECT katunimi, osoitenumero, huoneistotunnus, virheellinen "
+            "FROM osoite WHERE osoite = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return False, None
+        if row[3]:
+            return True, None
+        return True, row[:3]
+
+    def _write(self, key: str, parsed: ParsedOsoite):
+        if self._connection is None:
+            return
+        self._connection.execute(
+            "INSERT OR REPLACE INTO osoite VALUES (?, ?, ?, ?, ?)",
+            (key, *(parsed or (None, None, None)), parsed is None),
+        )
+
+    def get(self, address: str) -> ParsedOsoite:
+        # Whitespace does not change the parsed address
+        key = " ".join(address.split())
+        try:
+            parsed = self._parsed[key]
+        except KeyError:
+            pass
+        else:
+            self._parsed.move_to_end(key)
+            self.hits += 1
+            return parsed
+
+        found, parsed = self._read(key)
+        if found:
+            self.file_hits += 1
+        else:
+            parsed = _parse(key)
+            self._write(key, parsed)
+            self.misses += 1
+        self._parsed[key] = parsed
+        if len(self._parsed) > self.maxsize:
+            self._parsed.popitem(last=False)
+        return parsed
+
+
+osoite_cache = OsoiteCache()
+
+
+def parse_osoite(address: str) -> Osoite:
+    """
+    Parses the katunimi, osoitenumero and huoneistotunnus of the address. Raises
+    ValueError if the address cannot be parsed.
+    """
+    parsed = osoite_cache.get(address)
+    if parsed is None:
+        raise ValueError(f"Osoitetta ei voitu jäsentää: {address}")
+    katunimi, osoitenumero, huoneistotunnus = parsed
+    return Osoite(
+        katunimi=katunimi, osoitenumero=osoitenumero, huoneistotunnus=huoneistotunnus
+    )
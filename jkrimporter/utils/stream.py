@@ -0,0 +1,51 @@
+import queue
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+def prefetch(items: Iterable[T], maxsize: int) -> Iterator[T]:
+    """
+    Yields the items, producing them in a background thread. At most maxsize items
+    are produced ahead of the consumer. Errors in producing the items are raised in
+    the consumer.
+    """
+    buffer: "queue.Queue" = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item, error=None) -> bool:
+        # Give up if the consumer has stopped reading
+        while not stopped.is_set():
+            try:
+                buffer.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_DONE, e)
+        else:
+            put(_DONE)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
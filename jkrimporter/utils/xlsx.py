@@ -0,0 +1,87 @@
+import logging
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import openpyxl
+
+logger = logging.getLogger(__name__)
+
+
+class XlsxExport:
+    """
+    Rows to be appended to an XLSX file. The file is written in openpyxl write-only
+    mode. Rows already in the file are kept.
+    """
+
+    def __init__(self, path: str, headers: List[str]):
+        self.path = path
+        self.headers = headers
+        self.rows: List[List[Any]] = []
+
+    def extend(self, rows: Iterable[List[Any]]):
+        self.rows.extend(rows)
+
+    def _existing_rows(self) -> "Iterator[List[Any]]":
+        workbook = openpyxl.load_workbook(self.path, read_only=True)
+        try:
+            sheet = workbook[workbook.sheetnames[0]]
+            for row in sheet.iter_rows(values_only=True):
+                yield list(row)
+        finally:
+            workbook.close()
+
+    def save(self):
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        if os.path.exists(self.path):
+            for row in self._existing_rows():
+                sheet.append(row)
+        else:
+            sheet.append(self.headers)
+        for row in self.rows:
+            sheet.append(row)
+        workbook.save(self.path)
+
+
+# Exports collected by collect_exports, by file path
+_exports: Optional[Dict[str, XlsxExport]] = None
+
+
+@contextmanager
+def collect_exports():
+    """
+    Collects the rows exported with export_rows, and writes each file only once at
+    the end, also in case of errors.
+    """
+    global _exports
+    if _exports is not None:
+        # Already collecting
+        yield
+        return
+    _exports = {}
+    try:
+        yield
+    finally:
+        exports, _exports = _exports, None
+        for export in exports.values():
+            logger.debug(
+                "Tallennetaan %s riviä tiedostoon %s", len(export.rows), export.path
+            )
+            export.save()
+
+
+def export_rows(path: str, headers: List[str], rows: Iterable[List[Any]]):
+    """
+    Appends the rows to the XLSX file, or to the file written at the end of
+    collect_exports.
+    """
+    if _exports is None:
+        export = XlsxExport(path, headers)
+        export.extend(rows)
+        export.save()
+        return
+    key = os.path.abspath(path)
+    if key not in _exports:
+        _exports[key] = XlsxExport(path, headers)
+    _exports[key].extend(rows)
@@ -0,0 +1,190 @@
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from jkrimporter import conf
+from jkrimporter.model import AsiakasAvain, Osoite, Tunnus, Yhteystieto
+from jkrimporter.providers.db.database import json_dumps
+from jkrimporter.providers.db.models import (
+    Katu,
+    Osapuoli,
+    Osoite as OsoiteModel,
+    RakennuksenVanhimmat,
+    Rakennus,
+)
+from jkrimporter.providers.db.services import indexes
+from jkrimporter.providers.db.services.buildings import (
+    _find_by_kiinteisto,
+    _find_by_prt,
+    _find_by_ytunnus,
+    _query_by_address,
+)
+from jkrimporter.providers.db.services.indexes import (
+    address_index,
+    address_query,
+    building_index,
+)
+from jkrimporter.utils.intervals import Interval
+
+
+@pytest.fixture(scope="module", autouse=True)
+def engine():
+    engine = create_engine(
+        "postgresql://{username}:{password}@{host}:{port}/{dbname}".format(
+            **conf.dbconf
+        ),
+        future=True,
+        json_serializer=json_dumps,
+    )
+    return engine
+
+
+@pytest.fixture
+def session(engine):
+    with Session(engine) as session:
+        yield session
+    building_index.clear()
+    address_index.clear()
+
+
+def _avain(numero, haltija, kiinteistot=(), rakennukset=()):
+    return AsiakasAvain(
+        asiakasnumero=Tunnus("LSJ", str(numero)),
+        voimassa=Interval(None, None),
+        haltija=haltija,
+        kiinteistot=list(kiinteistot),
+        rakennukset=list(rakennukset),
+    )
+
+
+def _ids(rakennukset):
+    return sorted({rakennus.id for rakennus in rakennukset})
+
+
+def test_building_index_matches_database(session, monkeypatch):
+    # Several chunks of keys
+    monkeypatch.setattr(indexes, "IN_LIST_SIZE", 2)
+    rakennukset = session.execute(select(Rakennus)).scalars().all()
+    prts = sorted({rakennus.prt for rakennus in rakennukset if rakennus.prt})
+    kiinteistot = sorted(
+        {
+            rakennus.kiinteistotunnus
+            for rakennus in rakennukset
+            if rakennus.kiinteistotunnus
+        }
+    )
+    haltijat = [
+        Yhteystieto(nimi="As Oy Testi", osoite=Osoite(), ytunnus=ytunnus)
+        for ytunnus in sorted(
+            set(session.execute(select(Osapuoli.ytunnus)).scalars()) - {None}
+        )
+    ]
+    assert prts and kiinteistot and haltijat
+
+    avaimet = [_avain(0, haltijat[0], kiinteistot, prts)] + [
+        _avain(numero, haltija) for numero, haltija in enumerate(haltijat)
+    ]
+    # Keys of the import and a key not in the database
+    building_index.load(session, avaimet)
+    keys = [[prt] for prt in prts] + [prts[:3], ["eiole"]]
+    by_prt = [_ids(_find_by_prt(session, prt_list)) for prt_list in keys]
+    kitu_keys = [[kitu] for kitu in kiinteistot] + [kiinteistot[:3], ["eiole"]]
+    by_kiinteisto = [_ids(_find_by_kiinteisto(session, kitu)) for kitu in kitu_keys]
+    by_ytunnus = [_ids(_find_by_ytunnus(session, haltija)) for haltija in haltijat]
+    assert building_index.by_prt(["eiole"]) is None
+
+    # The same buildings are found in the database
+    building_index.clear()
+    assert by_prt == [_ids(_find_by_prt(session, prt_list)) for prt_list in keys]
+    assert by_kiinteisto == [
+        _ids(_find_by_kiinteisto(session, kitu)) for kitu in kitu_keys
+    ]
+    assert by_ytunnus == [
+        _ids(_find_by_ytunnus(session, haltija)) for haltija in haltijat
+    ]
+
+
+def _huoneistotunnukset(osoitenumero, huoneistot):
+    """
+    Yields osoitenumero and huoneistotunnus of addresses around the osoite.
+    """
+    yield osoitenumero, None
+    yield None, None
+    if not osoitenumero:
+        return
+    if osoitenumero.isdigit():
+        yield f"{osoitenumero}-{int(osoitenumero) + 2}", None
+        yield f"{int(osoitenumero) - 2}-{osoitenumero}", None
+    for kirjain in ("A", "B"):
+        yield osoitenumero, kirjain
+    for huoneistokirjain, huoneistonumero in huoneistot:
+        if huoneistokirjain:
+            yield osoitenumero, huoneistokirjain
+            if huoneistonumero is not None:
+                yield osoitenumero, f"{huoneistokirjain} {huoneistonumero}"
+                yield osoitenumero, f"{huoneistokirjain} {huoneistonumero + 1}"
+
+
+def test_address_index_matches_database(session, monkeypatch):
+    monkeypatch.setattr(indexes, "IN_LIST_SIZE", 2)
+    huoneistot = {}
+    for rakennus_id, huoneistokirjain, huoneistonumero in session.execute(
+        select(
+            RakennuksenVanhimmat.rakennus_id,
+            RakennuksenVanhimmat.huoneistokirjain,
+            RakennuksenVanhimmat.huoneistonumero,
+        )
+    ):
+        huoneistot.setdefault(rakennus_id, set()).add(
+            (huoneistokirjain, huoneistonumero)
+        )
+    osoitteet = set()
+    for postinumero, katunimi, osoitenumero, rakennus_id in session.execute(
+        select(
+            OsoiteModel.posti_numero,
+            Katu.katunimi_fi,
+            OsoiteModel.osoitenumero,
+            OsoiteModel.rakennus_id,
+        ).join(Katu)
+    ):
+        if not katunimi:
+            continue
+        for numero, huoneistotunnus in _huoneistotunnukset(
+            osoitenumero, huoneistot.get(rakennus_id, ())
+        ):
+            osoitteet.add((katunimi.upper(), numero, huoneistotunnus, postinumero))
+    queries = [
+        address_query(
+            Yhteystieto(
+                nimi="Testi",
+                osoite=Osoite(
+                    katunimi=katunimi,
+                    osoitenumero=numero,
+                    huoneistotunnus=huoneistotunnus,
+                    postinumero=postinumero,
+                ),
+            )
+        )
+        for katunimi, numero, huoneistotunnus, postinumero in sorted(
+            osoitteet, key=str
+        )
+    ]
+    assert queries
+
+    avaimet = [
+        _avain(
+            numero,
+            Yhteystieto(
+                nimi="Testi",
+                osoite=Osoite(katunimi="Katu", postinumero=query.postinumero),
+            ),
+        )
+        for numero, query in enumerate(queries)
+    ]
+    address_index.load(session, avaimet)
+    for query in queries:
+        found = address_index.find(query)
+        # Addresses without postinumero are queried from the database
+        assert (found is None) == (query.postinumero is None)
+        if found is not None:
+            assert _ids(found) == _ids(_query_by_address(session, query)), query
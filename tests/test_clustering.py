@@ -0,0 +1,67 @@
+import math
+import random
+
+import pytest
+
+from jkrimporter.utils.clustering import cluster_points
+
+
+def _brute_force_clusters(points, distance_limit):
+    clusters = []
+    remaining = list(range(len(points)))
+    while remaining:
+        cluster = {remaining.pop(0)}
+        grown = True
+        while grown:
+            grown = False
+            for index in list(remaining):
+                if any(
+                    math.dist(points[index], points[other]) < distance_limit
+                    for other in cluster
+                ):
+                    cluster.add(index)
+                    remaining.remove(index)
+                    grown = True
+        clusters.append(cluster)
+    return clusters
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_cluster_points_matches_brute_force(seed):
+    rng = random.Random(seed)
+    points = [(rng.uniform(0, 3000), rng.uniform(0, 3000)) for _ in range(200)]
+    assert cluster_points(points, 300) == _brute_force_clusters(points, 300)
+
+
+def test_cluster_points_empty():
+    assert cluster_points([], 300) == []
+    assert cluster_points([(0, 0)], 300, [0]) == []
+
+
+def test_cluster_points_chain():
+    points = [(0, 0), (1000, 0), (200, 0), (400, 0)]
+    assert cluster_points(points, 300) == [{0, 2, 3}, {1}]
+
+
+def test_cluster_points_unlocated_join_first_cluster():
+    points = [(1000, 0), None, (0, 0)]
+    assert cluster_points(points, 300) == [{0, 1}, {2}]
+    assert cluster_points([None, None], 300) == [{0, 1}]
+
+
+def test_cluster_points_existing_cluster():
+    points = [(0, 0), (100, 0), (350, 0), (2000, 0), None]
+    assert cluster_points(points, 300, [0, 1]) == [{0, 1, 2, 4}, {3}]
+
+
+@pytest.mark.parametrize(
+    ["points", "expected"],
+    [
+        # 2 is close to both separated points and joins the cluster
+        ([(0, 0), (500, 0), (250, 0), (2000, 0)], [{0, 1, 2}, {3}]),
+        # nothing is close to both separated points
+        ([(0, 0), (500, 0), (100, 0), (2000, 0)], [{0, 1}, {2}, {3}]),
+    ],
+)
+def test_cluster_points_separated_existing_cluster(points, expected):
+    assert cluster_points(points, 300, [0, 1]) == expected
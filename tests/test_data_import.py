@@ -1,8 +1,10 @@
+import shutil
 import subprocess
+from collections import Counter
 from datetime import datetime
 
 import pytest
-from sqlalchemy import and_, create_engine, distinct, func, or_, select
+from sqlalchemy import Text, and_, cast, create_engine, distinct, func, or_, select
 from sqlalchemy.orm import Session
 
 from jkrimporter import conf
@@ -28,6 +30,7 @@ from jkrimporter.providers.db.models import (
     RakennuksenVanhimmat,
     Sopimus,
     Tiedontuottaja,
+    UlkoinenAsiakastieto,
     Viranomaispaatokset,
 )
 
@@ -217,12 +220,22 @@ def test_import_dvv_kohteet(engine, datadir):
     # Lisätään kuljetukset kohteelle Kemp
     tiedontuottaja_add_new("LSJ", "Testituottaja")
     import_data(
-        datadir + "/kuljetus1", "LSJ", False, False, True, "1.1.2022", "31.12.2022"
+        datadir + "/kuljetus1", "LSJ", False, False, True, "1.1.2022", "31.12.2022",
+        massatuonti=False,
+        commit_every=1,
+        workers=1,
+        cache=False,
+        stream=False,
     )
     _assert_kohde_has_sopimus_with_jatelaji(session, "Kemp", "Sekajäte")
     _assert_kohde_has_kuljetus_with_jatelaji(session, "Kemp", "Sekajäte")
     import_data(
-        datadir + "/kuljetus2", "LSJ", False, False, True, "1.1.2023", "31.12.2023"
+        datadir + "/kuljetus2", "LSJ", False, False, True, "1.1.2023", "31.12.2023",
+        massatuonti=False,
+        commit_every=1,
+        workers=1,
+        cache=False,
+        stream=False,
     )
     _assert_kohde_has_sopimus_with_jatelaji(session, "Kemp", "Kartonki")
     _assert_kohde_has_kuljetus_with_jatelaji(session, "Kemp", "Kartonki")
@@ -400,7 +413,12 @@ def test_update_dvv_kohteet(engine, datadir):
 
     # Kyykoskelle syntyy tilaajarooli seuraavasta kuljetuksesta
     import_data(
-        datadir + "/kuljetus3", "LSJ", False, False, True, "1.4.2023", "30.6.2023"
+        datadir + "/kuljetus3", "LSJ", False, False, True, "1.4.2023", "30.6.2023",
+        massatuonti=False,
+        commit_every=1,
+        workers=1,
+        cache=False,
+        stream=False,
     )
     _assert_kohde_has_osapuoli_with_rooli(session, "Kyykoski", "Tilaaja sekajäte")
     _remove_kuljetusdata_from_database(session)
@@ -457,3 +475,89 @@ def test_update_dvv_kohteet(engine, datadir):
     )
 
     _remove_kompostoridata_from_database(session)
+
+
+def _import_kuljetukset(datadir, kansio, massatuonti, commit_every):
+    # Each import gets a copy of its own, as the import writes the kohdentumattomat
+    # file next to the siirtotiedosto and reads it on the next run.
+    tiedontuottaja_add_new("LSJ", "Testituottaja")
+    for kuljetus, alkupvm, loppupvm in (
+        ("kuljetus1", "1.1.2022", "31.12.2022"),
+        ("kuljetus2", "1.1.2023", "31.12.2023"),
+    ):
+        siirtotiedosto = str(kansio / kuljetus)
+        shutil.copytree(datadir + "/" + kuljetus, siirtotiedosto)
+        import_data(
+            siirtotiedosto, "LSJ", False, False, True, alkupvm, loppupvm,
+            massatuonti=massatuonti,
+            commit_every=commit_every,
+            workers=1,
+            cache=False,
+            stream=False,
+        )
+
+
+def _kuljetusdata(session):
+    kohteet = select(
+        Kohde.nimi, Kohde.kohdetyyppi_id, Kohde.alkupvm, Kohde.loppupvm
+    )
+    sopimukset = select(
+        Kohde.nimi,
+        Sopimus.sopimustyyppi_id,
+        Sopimus.jatetyyppi_id,
+        Sopimus.alkupvm,
+        Sopimus.loppupvm,
+        Sopimus.tiedontuottaja_tunnus,
+    ).join(Kohde, Sopimus.kohde_id == Kohde.id)
+    kuljetukset = select(
+        Kohde.nimi,
+        Kuljetus.jatetyyppi_id,
+        Kuljetus.alkupvm,
+        Kuljetus.loppupvm,
+        Kuljetus.tyhjennyskerrat,
+        Kuljetus.massa,
+        Kuljetus.tilavuus,
+        Kuljetus.tiedontuottaja_tunnus,
+    ).join(Kohde, Kuljetus.kohde_id == Kohde.id)
+    asiakastiedot = select(
+        Kohde.nimi,
+        UlkoinenAsiakastieto.tiedontuottaja_tunnus,
+        UlkoinenAsiakastieto.ulkoinen_id,
+        cast(UlkoinenAsiakastieto.ulkoinen_asiakastieto, Text),
+    ).join(Kohde, UlkoinenAsiakastieto.kohde_id == Kohde.id)
+    # Ids differ between the imports, so the rows are compared as multisets.
+    return {
+        taulu: Counter(tuple(row) for row in session.execute(query))
+        for taulu, query in (
+            ("kohde", kohteet),
+            ("sopimus", sopimukset),
+            ("kuljetus", kuljetukset),
+            ("ulkoinen_asiakastieto", asiakastiedot),
+        )
+    }
+
+
+def _remove_imported_kuljetusdata(session, kohde_ids):
+    session.query(Kohde).filter(~Kohde.id.in_(kohde_ids)).delete(
+        synchronize_session=False
+    )
+    session.query(UlkoinenAsiakastieto).delete()
+    _remove_kuljetusdata_from_database(session)
+
+
+def test_massatuonti(engine, datadir, tmp_path):
+    session = Session(engine)
+    kohde_ids = session.execute(select(Kohde.id)).scalars().all()
+
+    _import_kuljetukset(datadir, tmp_path / "oletus", False, 1)
+    oletus = _kuljetusdata(session)
+    _remove_imported_kuljetusdata(session, kohde_ids)
+
+    _import_kuljetukset(datadir, tmp_path / "massatuonti", True, 3)
+    massatuonti = _kuljetusdata(session)
+    _remove_imported_kuljetusdata(session, kohde_ids)
+
+    # Massatuonti tallentaa samat rivit kuin tavallinen tuonti.
+    assert oletus["sopimus"]
+    assert oletus["kuljetus"]
+    assert massatuonti == oletus
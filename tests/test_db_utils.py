@@ -1,6 +1,18 @@
+from datetime import date, timedelta
+
 import pytest
 
-from jkrimporter.providers.db.utils import is_asoy, is_company
+from jkrimporter.providers.db.utils import (
+    NameClassification,
+    NameIndex,
+    classify_name,
+    is_asoy,
+    is_company,
+    match_name_tokens,
+    name_tokens,
+    overlaps_voimassa,
+)
+from jkrimporter.utils.intervals import Interval
 
 
 @pytest.mark.parametrize(
@@ -35,3 +47,139 @@ def test_is_asoy(name, expected):
 )
 def test_is_company(name, expected):
     assert is_company(name) is expected
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("Matti Henrikson", NameClassification(False, False, False)),
+        ("As Oy Kehrääjä", NameClassification(True, True, False)),
+        ("Bost. Ab Foo", NameClassification(True, True, False)),
+        ("Kehrääjä oy.", NameClassification(False, True, False)),
+        ("Lahden kaupunki", NameClassification(False, False, True)),
+        ("Urheiluseura r.y. ", NameClassification(False, False, True)),
+        ("Testi asunto-osakeyhtiö", NameClassification(True, False, True)),
+    ],
+)
+def test_classify_name(name, expected):
+    assert classify_name(name) == expected
+
+
+@pytest.mark.parametrize(
+    "first, second, expected",
+    [
+        ("Matti Virtanen", "matti virtanen", True),
+        ("Matti Virtanen", "Virtanen Matti Juhani", True),
+        ("Matti Virtanen", "Liisa Virtanen", False),
+        ("Matti Virtanen ja Liisa Virtanen", "Liisa Virtanen", True),
+        ("Matti Virtanen & Liisa Virtanen", "Liisa Maria Virtanen", True),
+        ("Matti ja Liisa Virtanen", "Maija Virtanen", False),
+        ("Jaana Virtanen", "Jaana", True),
+        ("", "Matti Virtanen", True),
+    ],
+)
+def test_match_name_tokens(first, second, expected):
+    assert match_name_tokens(name_tokens(first), name_tokens(second)) is expected
+    assert match_name_tokens(name_tokens(second), name_tokens(first)) is expected
+
+
+def test_name_index():
+    index = NameIndex()
+    index.add(1, "Matti Virtanen")
+    index.add(1, "Liisa Virtanen")
+    index.add(2, "As Oy Kehrääjä")
+    index.add(3, "Kehrääjä Oy")
+
+    assert index.matching(["Virtanen"]) == {1}
+    assert index.matching(["Liisa Maria Virtanen"]) == {1}
+    assert index.matching(["Kehrääjä"]) == {2, 3}
+    assert index.matching(["Kehrääjä As Oy"]) == {2, 3}
+    assert index.matching(["Maija Meikäläinen", "Matti Virtanen"]) == {1}
+    assert index.matching(["Maija Meikäläinen"]) == set()
+    assert index.matching([]) == set()
+    # Empty names match any name
+    assert index.matching([""]) == {1, 2, 3}
+    index.add(4, "")
+    assert index.matching(["Maija Meikäläinen"]) == {4}
+
+
+def test_name_index_keys():
+    index = NameIndex()
+    index.add(1, "Matti Virtanen")
+    index.add(2, "Liisa Virtanen")
+    index.add(3, "")
+
+    assert index.matching(["Virtanen"], [2, 5]) == {2}
+    assert index.matching(["Maija Meikäläinen"], [1, 2]) == set()
+    assert index.matching(["Maija Meikäläinen"], [2, 3]) == {3}
+    assert index.matching([""], [1, 5]) == {1}
+    assert index.matching(["Virtanen"], []) == set()
+
+
+D = [date(2023, 1, 1) + timedelta(days=n) for n in range(4)]
+
+
+@pytest.mark.parametrize(
+    "alkupvm, loppupvm, voimassa, expected",
+    [
+        # The kohde includes its loppupvm
+        (D[0], D[1], Interval(D[1], D[2]), True),
+        (D[0], D[1], Interval(D[2], D[3]), False),
+        # The asiakas excludes its upper date
+        (D[2], D[3], Interval(D[0], D[2]), False),
+        (D[1], D[3], Interval(D[0], D[2]), True),
+        # Kohde on a single day
+        (D[1], D[1], Interval(D[1], D[2]), True),
+        (D[1], D[1], Interval(D[0], D[1]), False),
+        # Open ends
+        (None, None, Interval(D[0], D[1]), True),
+        (None, D[0], Interval(D[0], D[1]), True),
+        (None, D[0], Interval(D[1], None), False),
+        (D[3], None, Interval(D[0], D[3]), False),
+        (D[3], None, Interval(None, None), True),
+        (D[0], D[1], Interval(None, D[0]), False),
+        (D[0], D[1], Interval(None, D[1]), True),
+        # Asiakas with lower == upper is an empty range
+        (None, None, Interval(D[1], D[1]), False),
+        (D[0], D[3], Interval(D[1], D[1]), False),
+    ],
+)
+def test_overlaps_voimassa(alkupvm, loppupvm, voimassa, expected):
+    assert overlaps_voimassa(alkupvm, loppupvm, voimassa) is expected
+
+
+def test_overlaps_voimassa_all_dates():
+    # Compare with the days in daterange(alkupvm, loppupvm, '[]') and
+    # daterange(lower, upper, '[)'), open ends extending past the dates
+    days = [D[0] - timedelta(days=1)] + D + [D[-1] + timedelta(days=1)]
+    dates = [None] + D
+
+    def kohde_days(alkupvm, loppupvm):
+        return {
+            day
+            for day in days
+            if (alkupvm is None or alkupvm <= day)
+            and (loppupvm is None or day <= loppupvm)
+        }
+
+    def asiakas_days(voimassa):
+        return {
+            day
+            for day in days
+            if (voimassa.lower is None or voimassa.lower <= day)
+            and (voimassa.upper is None or day < voimassa.upper)
+        }
+
+    for alkupvm in dates:
+        for loppupvm in dates:
+            if alkupvm and loppupvm and alkupvm > loppupvm:
+                continue
+            for lower in dates:
+                for upper in dates:
+                    voimassa = Interval(lower, upper)
+                    expected = bool(
+                        kohde_days(alkupvm, loppupvm) & asiakas_days(voimassa)
+                    )
+                    assert (
+                        overlaps_voimassa(alkupvm, loppupvm, voimassa) is expected
+                    ), (alkupvm, loppupvm, voimassa)
@@ -0,0 +1,179 @@
+from typing import List, NamedTuple
+
+import pytest
+
+from jkrimporter.model import Osoite, Yhteystieto
+from jkrimporter.providers.db.services.indexes import (
+    AddressIndex,
+    BuildingIndex,
+    _add_buildings,
+    _lookup,
+    address_query,
+)
+
+
+class Rakennus(NamedTuple):
+    id: int
+    prt: str
+    kiinteistotunnus: str
+    ytunnukset: List[str] = []
+
+
+RAKENNUKSET = [
+    Rakennus(1, "100", "398-1-1-1", ["1234567-8"]),
+    Rakennus(2, "101", "398-1-1-1", ["1234567-8", "1234567-8"]),
+    Rakennus(3, "102", "398-1-1-2", ["2345678-9"]),
+    Rakennus(4, "103", "398-1-1-3"),
+]
+
+
+@pytest.fixture
+def building_index():
+    index = BuildingIndex()
+    _add_buildings(
+        index._by_prt,
+        ["100", "101", "102", "999"],
+        RAKENNUKSET,
+        lambda rakennus: [rakennus.prt],
+    )
+    _add_buildings(
+        index._by_kiinteisto,
+        ["398-1-1-1", "398-1-1-2"],
+        RAKENNUKSET,
+        lambda rakennus: [rakennus.kiinteistotunnus],
+    )
+    _add_buildings(
+        index._by_ytunnus,
+        ["1234567-8"],
+        RAKENNUKSET,
+        lambda rakennus: rakennus.ytunnukset,
+    )
+    return index
+
+
+def _ids(rakennukset):
+    return None if rakennukset is None else [rakennus.id for rakennus in rakennukset]
+
+
+def test_add_buildings():
+    index = {"100": [RAKENNUKSET[3]]}
+    _add_buildings(index, ["100", "101"], RAKENNUKSET, lambda rakennus: [rakennus.prt])
+    # Buildings of the keys not being loaded are not added
+    assert {key: _ids(rakennukset) for key, rakennukset in index.items()} == {
+        "100": [1],
+        "101": [2],
+    }
+
+
+def test_lookup():
+    index = {"a": [RAKENNUKSET[0], RAKENNUKSET[1]], "b": [RAKENNUKSET[1]], "c": []}
+    assert _ids(_lookup(index, ["a", "b"])) == [1, 2]
+    assert _ids(_lookup(index, ["b", "a"])) == [2, 1]
+    assert _ids(_lookup(index, ["c"])) == []
+    assert _ids(_lookup(index, [])) == []
+    # The database must be queried if any key is not loaded
+    assert _lookup(index, ["a", "d"]) is None
+
+
+def test_building_index(building_index):
+    assert _ids(building_index.by_prt(["100"])) == [1]
+    assert _ids(building_index.by_prt(["102", "100"])) == [3, 1]
+    assert _ids(building_index.by_prt(["999"])) == []
+    assert building_index.by_prt(["100", "103"]) is None
+
+    assert _ids(building_index.by_kiinteisto(["398-1-1-1", "398-1-1-2"])) == [1, 2, 3]
+    assert building_index.by_kiinteisto(["398-1-1-3"]) is None
+
+    # Buildings with several owners with the same y-tunnus are found once
+    assert _ids(building_index.by_ytunnus("1234567-8")) == [1, 2]
+    assert building_index.by_ytunnus("2345678-9") is None
+
+    building_index.clear()
+    assert building_index.by_prt(["100"]) is None
+
+
+# Addresses as rakennus id, postinumero, katunimi, osoitenumero and the
+# huoneistokirjain and huoneistonumero of the vanhimmat
+OSOITTEET = [
+    (1, "15100", "Metsätie", "33", []),
+    (2, "15100", "Metsätie", "33a", []),
+    (3, "15100", "Metsätie", "33b", [("B", None)]),
+    (4, "15100", "Metsätie", "31", [("A", 1), ("A", 2)]),
+    (5, "15100", "METSÄTIE", "35", [("B", 2)]),
+    (6, "15100", "Metsätie", None, []),
+    (7, "15100", "Metsätähtikatu", "3", [("A", None)]),
+    (8, "15100", "Metsätähtikatu", "3", [("B", None)]),
+    (9, "15100", None, "33", []),
+    (10, "15200", "Metsätie", "33", []),
+    # Building with two addresses
+    (11, "15100", "Metsätie", "37", []),
+    (11, "15100", "Metsätie", "37a", []),
+]
+
+
+@pytest.fixture
+def address_index():
+    index = AddressIndex()
+    for id, postinumero, katunimi, osoitenumero, huoneistot in OSOITTEET:
+        rakennus = Rakennus(id, str(id), "")
+        index.add(rakennus, postinumero, katunimi, osoitenumero, huoneistot)
+    index.add_postinumerot(["15100", "15300"])
+    return index
+
+
+def _query(katuosoite, postinumero="15100"):
+    parts = katuosoite.split(" ", 2)
+    katunimi, osoitenumero, huoneistotunnus = parts + [None] * (3 - len(parts))
+    return address_query(
+        Yhteystieto(
+            nimi="Testi",
+            osoite=Osoite(
+                katunimi=katunimi,
+                osoitenumero=osoitenumero,
+                huoneistotunnus=huoneistotunnus,
+                postinumero=postinumero,
+            ),
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "katuosoite, expected",
+    [
+        # Metsätie 33 does not find 33a
+        ("Metsätie 33", [1]),
+        ("metsätie 33a", [2]),
+        # Metsätie 33 A may mean 33a
+        ("Metsätie 33 A", [2]),
+        ("Metsätie 33 B", [3]),
+        ("Metsätie 33 C", []),
+        ("Metsätie 31-33", [1, 4]),
+        ("Metsätie 31 A 2", [4]),
+        ("Metsätie 31 A 3", []),
+        ("Metsätie 35", [5]),
+        ("Metsätie 35 B 2", [5]),
+        # Paritalo, where the halves have different huoneistokirjain
+        ("Metsätähtikatu 3 B", [8]),
+        ("Metsätähtikatu 3", [7, 8]),
+        # Huoneistonumero is an integer in the database
+        ("Metsätie 31 A 1b", []),
+        ("Metsätie 37", [11]),
+        ("Metsätie 37 A", [11]),
+    ],
+)
+def test_address_index_find(address_index, katuosoite, expected):
+    assert _ids(address_index.find(_query(katuosoite))) == expected
+
+
+def test_address_index_find_empty(address_index):
+    # Buildings without osoitenumero are not found, as NULL equals nothing
+    assert _ids(address_index.find(_query("Metsätie"))) == []
+    # Postinumero loaded without buildings
+    assert _ids(address_index.find(_query("Metsätie 33", "15300"))) == []
+    # Buildings are queried from the database in other postinumerot
+    assert address_index.find(_query("Metsätie 33", "15200")) is None
+    assert address_index.find(_query("Metsätie 33", None)) is None
+    assert address_query(Yhteystieto(nimi="Testi", osoite=Osoite())) is None
+
+    address_index.clear()
+    assert address_index.find(_query("Metsätie 33")) is None
@@ -1,6 +1,8 @@
+import random
+
 import pytest
 
-from jkrimporter.utils.intervals import Interval, IntervalCounter
+from jkrimporter.utils.intervals import Interval, IntervalCounter, IntervalIndex
 
 
 @pytest.mark.parametrize(
@@ -49,9 +51,9 @@ def test_range_contains(interval: Interval, value, expected):
     assert interval.contains(value) == expected
 
 
-@pytest.fixture
-def interval_counter():
-    return IntervalCounter([Interval(None, 2), Interval(1, 4), Interval(2, 6)])
+@pytest.fixture(params=[IntervalCounter, IntervalIndex])
+def interval_counter(request):
+    return request.param([Interval(None, 2), Interval(1, 4), Interval(2, 6)])
 
 
 @pytest.mark.parametrize(["value", "expected"], [(-4, 1), (1, 2), (2, 3), (4, 2)])
@@ -67,3 +69,29 @@ def test_interval_counter_containing(
 )
 def test_interval_overlapping(interval, expected, interval_counter: IntervalCounter):
     assert interval_counter.count_overlapping(interval) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_interval_index_matches_counter(seed):
+    rng = random.Random(seed)
+
+    def value():
+        return None if rng.random() < 0.2 else rng.randint(0, 20)
+
+    # Includes intervals with lower > upper
+    intervals = [Interval(value(), value()) for _ in range(50)]
+    counter = IntervalCounter(intervals)
+    index = IntervalIndex(intervals)
+    for _ in range(200):
+        interval = Interval(value(), value())
+        assert index.count_overlapping(interval) == counter.count_overlapping(
+            interval
+        )
+        assert index.count_containing(interval) == counter.count_containing(interval)
+        point = value()
+        assert index.count_containing(point) == counter.count_containing(point)
+
+
+def test_interval_index_empty():
+    assert IntervalIndex().count_overlapping(Interval(None, None)) == 0
+    assert IntervalIndex().count_containing(1) == 0
@@ -0,0 +1,81 @@
+import datetime
+import os
+from pathlib import Path
+from shutil import copytree
+
+import pytest
+
+from jkrimporter import conf
+from jkrimporter.model import JkrData
+from jkrimporter.providers.lahti.lahtiprovider import LahtiTranslator
+from jkrimporter.providers.lahti.siirtotiedosto import LahtiSiirtotiedosto
+from jkrimporter.utils import jkrdata_cache
+from jkrimporter.utils.jkrdata_cache import (
+    CachedJkrData,
+    get_cache_key,
+    read_jkr_data,
+    write_jkr_data,
+)
+from jkrimporter.utils.kuljetus import read_kohdentumattomat
+
+DATADIR = Path(__file__).parent / "data" / "test_lahti_siirtotiedosto"
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(conf, "config_dir", str(tmp_path / "jkr"))
+    return tmp_path / "jkr"
+
+
+def _key(path, alkupvm=None):
+    return get_cache_key(
+        LahtiSiirtotiedosto(path).input_files(), "LSJ", LahtiTranslator, alkupvm, None
+    )
+
+
+def test_cache_key(tmp_path):
+    copytree(DATADIR, tmp_path, dirs_exist_ok=True)
+    key = _key(tmp_path)
+    assert _key(DATADIR) == key
+    assert _key(tmp_path, datetime.date(2023, 1, 1)) != key
+
+    # Files not read by the import do not change the key
+    (tmp_path / "muistiinpanot.txt").write_text("")
+    assert _key(tmp_path) == key
+
+    # Corrected kohdentumattomat are read by the next import
+    kohdentumattomat = tmp_path / conf.get_kohdentumattomat_siirtotiedosto_filename()
+    kohdentumattomat.write_text("a")
+    corrected_key = _key(tmp_path)
+    assert corrected_key != key
+    kohdentumattomat.write_text("b")
+    assert _key(tmp_path) not in (key, corrected_key)
+
+    (tmp_path / "uusi.csv").write_text("")
+    assert _key(tmp_path) not in (key, corrected_key)
+
+
+def test_read_and_write_jkr_data(tmp_path, config_dir):
+    copytree(DATADIR, tmp_path, dirs_exist_ok=True)
+    key = _key(tmp_path)
+    assert read_jkr_data(key) is None
+
+    data = LahtiTranslator(LahtiSiirtotiedosto(tmp_path), "LSJ").as_jkr_data(
+        None, None
+    )
+    # The rows failing validation are cached with the data
+    kohdentumattomat = read_kohdentumattomat(tmp_path)
+    assert len(kohdentumattomat.splitlines()) == 4
+    write_jkr_data(key, CachedJkrData(data, kohdentumattomat))
+    assert read_jkr_data(key) == CachedJkrData(data, kohdentumattomat)
+
+
+def test_old_jkr_data_removed(config_dir, monkeypatch):
+    monkeypatch.setattr(jkrdata_cache, "JKRDATA_CACHE_SIZE", 2)
+    for mtime, key in enumerate(("a", "b", "c")):
+        write_jkr_data(key, CachedJkrData(JkrData()))
+        os.utime(config_dir / "jkrdata" / f"{key}.pickle.gz", (mtime, mtime))
+    assert sorted(path.name for path in (config_dir / "jkrdata").iterdir()) == [
+        "b.pickle.gz",
+        "c.pickle.gz",
+    ]
@@ -0,0 +1,315 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from jkrimporter import conf
+from jkrimporter.model import Jatelaji, Paatostulos, SopimusTyyppi, Tapahtumalaji
+from jkrimporter.providers.db import codes
+from jkrimporter.providers.db.codes import (
+    OsapuolenrooliTyyppi,
+    RakennuksenKayttotarkoitusTyyppi,
+    init_code_objects,
+)
+from jkrimporter.providers.db.database import json_dumps
+from jkrimporter.providers.db.models import (
+    KohteenOsapuolet,
+    KohteenRakennukset,
+    Kompostori,
+    KompostorinKohteet,
+    Kuljetus,
+    Osapuoli,
+    Osoite,
+    Rakennus,
+    Sopimus,
+    Tiedontuottaja,
+    Viranomaispaatokset,
+)
+from jkrimporter.providers.db.services.kohde import (
+    update_or_create_kohde_from_buildings,
+)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def engine():
+    engine = create_engine(
+        "postgresql://{username}:{password}@{host}:{port}/{dbname}".format(
+            **conf.dbconf
+        ),
+        future=True,
+        json_serializer=json_dumps,
+    )
+    return engine
+
+
+@pytest.fixture
+def session(engine):
+    # The tests only flush, all rows are rolled back in the end.
+    with Session(engine) as session:
+        init_code_objects(session)
+        yield session
+        session.rollback()
+
+
+def _rakennus(session, kayttotarkoitus):
+    rakennus = Rakennus(
+        rakennuksenkayttotarkoitus=codes.rakennuksenkayttotarkoitukset[kayttotarkoitus]
+    )
+    session.add(rakennus)
+    session.flush()
+    return rakennus
+
+
+def _osapuoli(session, nimi):
+    osapuoli = Osapuoli(nimi=nimi)
+    session.add(osapuoli)
+    session.flush()
+    return osapuoli
+
+
+def _rakennustiedot(*rakennukset):
+    return {
+        (rakennus, frozenset(), frozenset(), frozenset()) for rakennus in rakennukset
+    }
+
+
+def _update_or_create(session, rakennukset, asukkaat, omistajat, poimintapvm, loppupvm):
+    dvv_rakennustiedot = {
+        rakennustiedot[0].id: rakennustiedot for rakennustiedot in rakennukset
+    }
+    return update_or_create_kohde_from_buildings(
+        session,
+        dvv_rakennustiedot,
+        rakennukset,
+        asukkaat,
+        omistajat,
+        poimintapvm,
+        loppupvm,
+    )
+
+
+def _kohteen_rakennus_ids(session, kohde):
+    return set(
+        session.execute(
+            select(KohteenRakennukset.rakennus_id).where(
+                KohteenRakennukset.kohde_id == kohde.id
+            )
+        ).scalars()
+    )
+
+
+def test_ending_kohde_replaced(session):
+    talo = _rakennus(session, RakennuksenKayttotarkoitusTyyppi.YKSITTAISTALO)
+    rakennukset = _rakennustiedot(talo)
+    omistaja = _osapuoli(session, "Testi Omistaja")
+    vanha_asukas = _osapuoli(session, "Testi Vanha")
+    uusi_asukas = _osapuoli(session, "Testi Uusi")
+    yhteyshenkilo = _osapuoli(session, "Testi Kompostoija")
+
+    vanha_kohde = _update_or_create(
+        session,
+        rakennukset,
+        {vanha_asukas},
+        {omistaja},
+        datetime.date(2099, 1, 1),
+        datetime.date(2099, 12, 31),
+    )
+
+    session.merge(Tiedontuottaja(tunnus="TST", nimi="Testituottaja"))
+    sekajate_id = codes.jatetyypit[Jatelaji.sekajate].id
+    sopimustyyppi_id = codes.sopimustyypit[SopimusTyyppi.tyhjennyssopimus].id
+    paattynyt_sopimus = Sopimus(
+        kohde_id=vanha_kohde.id,
+        sopimustyyppi_id=sopimustyyppi_id,
+        jatetyyppi_id=sekajate_id,
+        alkupvm=datetime.date(2099, 1, 1),
+        loppupvm=datetime.date(2099, 6, 30),
+        tiedontuottaja_tunnus="TST",
+    )
+    jatkuva_sopimus = Sopimus(
+        kohde_id=vanha_kohde.id,
+        sopimustyyppi_id=sopimustyyppi_id,
+        jatetyyppi_id=sekajate_id,
+        alkupvm=datetime.date(2099, 7, 1),
+        loppupvm=datetime.date(2100, 12, 31),
+        tiedontuottaja_tunnus="TST",
+    )
+    paattynyt_kuljetus = Kuljetus(
+        kohde_id=vanha_kohde.id,
+        jatetyyppi_id=sekajate_id,
+        alkupvm=datetime.date(2099, 1, 1),
+        loppupvm=datetime.date(2099, 3, 31),
+        tiedontuottaja_tunnus="TST",
+    )
+    uusi_kuljetus = Kuljetus(
+        kohde_id=vanha_kohde.id,
+        jatetyyppi_id=sekajate_id,
+        alkupvm=datetime.date(2100, 1, 1),
+        loppupvm=datetime.date(2100, 3, 31),
+        tiedontuottaja_tunnus="TST",
+    )
+    paatos = Viranomaispaatokset(
+        paatosnumero="TESTI/2099",
+        alkupvm=datetime.date(2099, 1, 1),
+        loppupvm=datetime.date(2101, 12, 31),
+        paatostulos_koodi=codes.paatostulokset[Paatostulos.MYONTEINEN].koodi,
+        tapahtumalaji_koodi=codes.tapahtumalajit[Tapahtumalaji.PERUSMAKSU].koodi,
+        jatetyyppi_id=sekajate_id,
+        rakennus_id=talo.id,
+    )
+    osoite = Osoite(rakennus_id=talo.id)
+    session.add_all(
+        [
+            paattynyt_sopimus,
+            jatkuva_sopimus,
+            paattynyt_kuljetus,
+            uusi_kuljetus,
+            paatos,
+            osoite,
+        ]
+    )
+    session.flush()
+    vanha_kompostori = Kompostori(
+        alkupvm=datetime.date(2099, 1, 1),
+        osoite_id=osoite.id,
+        osapuoli_id=vanha_asukas.id,
+    )
+    uusi_kompostori = Kompostori(
+        alkupvm=datetime.date(2100, 2, 1),
+        osoite_id=osoite.id,
+        osapuoli_id=yhteyshenkilo.id,
+    )
+    session.add_all([vanha_kompostori, uusi_kompostori])
+    session.flush()
+    session.add_all(
+        [
+            KompostorinKohteet(
+                kompostori_id=vanha_kompostori.id, kohde_id=vanha_kohde.id
+            ),
+            KompostorinKohteet(
+                kompostori_id=uusi_kompostori.id, kohde_id=vanha_kohde.id
+            ),
+            KohteenOsapuolet(
+                kohde_id=vanha_kohde.id,
+                osapuoli_id=yhteyshenkilo.id,
+                osapuolenrooli=codes.osapuolenroolit[
+                    OsapuolenrooliTyyppi.KOMPOSTI_YHTEYSHENKILO
+                ],
+            ),
+        ]
+    )
+    session.flush()
+
+    # Asukas vaihtuu, joten rakennukselle luodaan uusi kohde.
+    uusi_kohde = _update_or_create(
+        session,
+        rakennukset,
+        {uusi_asukas},
+        {omistaja},
+        datetime.date(2100, 1, 1),
+        None,
+    )
+    session.flush()
+    session.expire_all()
+
+    assert uusi_kohde.id != vanha_kohde.id
+    assert uusi_kohde.alkupvm == datetime.date(2100, 1, 1)
+    assert uusi_kohde.loppupvm is None
+    assert vanha_kohde.loppupvm == datetime.date(2099, 12, 31)
+    assert _kohteen_rakennus_ids(session, uusi_kohde) == {talo.id}
+
+    # Uuden kohteen aikana voimassa olevat sopimukset ja kuljetukset siirtyvät.
+    assert paattynyt_sopimus.kohde_id == vanha_kohde.id
+    assert jatkuva_sopimus.kohde_id == uusi_kohde.id
+    assert paattynyt_kuljetus.kohde_id == vanha_kohde.id
+    assert uusi_kuljetus.kohde_id == uusi_kohde.id
+
+    # Päätös päättyy vanhan kohteen mukana.
+    assert paatos.loppupvm == datetime.date(2099, 12, 31)
+
+    # Vanha kompostori päättyy, myöhemmin alkanut siirtyy yhteyshenkilöineen.
+    assert vanha_kompostori.loppupvm == datetime.date(2099, 12, 31)
+    assert uusi_kompostori.loppupvm is None
+    kompostorien_kohteet = dict(
+        session.execute(
+            select(KompostorinKohteet.kompostori_id, KompostorinKohteet.kohde_id).where(
+                KompostorinKohteet.kompostori_id.in_(
+                    [vanha_kompostori.id, uusi_kompostori.id]
+                )
+            )
+        ).all()
+    )
+    assert kompostorien_kohteet == {
+        vanha_kompostori.id: vanha_kohde.id,
+        uusi_kompostori.id: uusi_kohde.id,
+    }
+    yhteyshenkilon_kohteet = session.execute(
+        select(KohteenOsapuolet.kohde_id).where(
+            KohteenOsapuolet.osapuoli_id == yhteyshenkilo.id
+        )
+    ).scalars().all()
+    assert yhteyshenkilon_kohteet == [uusi_kohde.id]
+
+
+def test_kohde_extended_with_auxiliary_building(session):
+    talo = _rakennus(session, RakennuksenKayttotarkoitusTyyppi.YKSITTAISTALO)
+    talousrakennus = _rakennus(session, RakennuksenKayttotarkoitusTyyppi.TALOUSRAKENNUS)
+    asukas = _osapuoli(session, "Testi Asukas")
+    omistaja = _osapuoli(session, "Testi Omistaja")
+
+    kohde = _update_or_create(
+        session,
+        _rakennustiedot(talo),
+        {asukas},
+        {omistaja},
+        datetime.date(2099, 1, 1),
+        None,
+    )
+    laajennettu_kohde = _update_or_create(
+        session,
+        _rakennustiedot(talo, talousrakennus),
+        {asukas},
+        {omistaja},
+        datetime.date(2100, 1, 1),
+        None,
+    )
+
+    assert laajennettu_kohde.id == kohde.id
+    assert laajennettu_kohde.alkupvm == datetime.date(2099, 1, 1)
+    assert _kohteen_rakennus_ids(session, kohde) == {talo.id, talousrakennus.id}
+
+
+def test_unchanged_kohde_matched(session):
+    talo = _rakennus(session, RakennuksenKayttotarkoitusTyyppi.YKSITTAISTALO)
+    asukas = _osapuoli(session, "Testi Asukas")
+    omistaja = _osapuoli(session, "Testi Omistaja")
+    rakennukset = _rakennustiedot(talo)
+
+    kohde = _update_or_create(
+        session,
+        rakennukset,
+        {asukas},
+        {omistaja},
+        datetime.date(2099, 1, 1),
+        datetime.date(2099, 12, 31),
+    )
+    sama_kohde = _update_or_create(
+        session,
+        rakennukset,
+        {asukas},
+        {omistaja},
+        datetime.date(2100, 1, 1),
+        None,
+    )
+
+    assert sama_kohde.id == kohde.id
+    # Kohde on edelleen voimassa, joten loppupäivämäärä poistetaan.
+    assert sama_kohde.loppupvm is None
+    assert _kohteen_rakennus_ids(session, kohde) == {talo.id}
+    kohteet = session.execute(
+        select(KohteenRakennukset.kohde_id).where(
+            KohteenRakennukset.rakennus_id == talo.id
+        )
+    ).scalars().all()
+    assert kohteet == [kohde.id]
@@ -0,0 +1,86 @@
+import csv
+from pathlib import Path
+from shutil import copytree
+
+import pytest
+
+from jkrimporter.datasheets import get_siirtotiedosto_headers
+from jkrimporter.providers.lahti.lahtiprovider import LahtiTranslator
+from jkrimporter.providers.lahti.siirtotiedosto import LahtiSiirtotiedosto
+from jkrimporter.utils.kuljetus import (
+    KohdentumattomatKuljetukset,
+    read_kohdentumattomat,
+    write_kohdentumattomat,
+)
+
+DATADIR = Path(__file__).parent / "data" / "test_lahti_siirtotiedosto"
+
+
+@pytest.fixture
+def asiakkaat(tmp_path):
+    copytree(DATADIR, tmp_path / "data")
+    translator = LahtiTranslator(LahtiSiirtotiedosto(tmp_path / "data"), "LSJ")
+    return list(translator.as_jkr_data(None, None).asiakkaat.values())
+
+
+def _read(path):
+    with open(path, encoding="cp1252", newline="") as csv_file:
+        return list(
+            csv.DictReader(
+                csv_file, fieldnames=get_siirtotiedosto_headers(), delimiter=";"
+            )
+        )
+
+
+def test_kohdentumattomat_kuljetukset(tmp_path, asiakkaat):
+    with KohdentumattomatKuljetukset(tmp_path, buffer_size=3) as sink:
+        for asiakas in asiakkaat:
+            sink.add(asiakas)
+
+    rows = _read(sink.path)
+    assert sink.count == len(asiakkaat)
+    assert len(rows) == sum(
+        len(asiakas.ulkoinen_asiakastieto.kaynnit) for asiakas in asiakkaat
+    )
+    row = rows[0]
+    asiakas = asiakkaat[0]
+    asiakastieto = asiakas.ulkoinen_asiakastieto
+    assert row["UrakoitsijankohdeId"] == asiakastieto.UrakoitsijankohdeId
+    assert row["Pvmalk"] == asiakas.voimassa.lower.strftime("%d.%m.%Y")
+    assert row["COUNT(kaynnit)"] == str(asiakastieto.kaynnit[0])
+    assert row["Haltijanulkomaanpaikkakunta"] == ""
+
+
+def test_kohdentumattomat_kuljetukset_appended_on_error(tmp_path, asiakkaat):
+    sink = KohdentumattomatKuljetukset(tmp_path)
+    sink.path.write_text("aiempi\r\n", encoding="cp1252")
+    with pytest.raises(RuntimeError):
+        with sink:
+            sink.add(asiakkaat[0])
+            raise RuntimeError()
+
+    rows = _read(sink.path)
+    assert len(rows) == 1 + len(asiakkaat[0].ulkoinen_asiakastieto.kaynnit)
+    assert rows[0]["UrakoitsijaId"] == "aiempi"
+
+
+def test_kohdentumattomat_kuljetukset_no_rows(tmp_path):
+    with KohdentumattomatKuljetukset(tmp_path) as sink:
+        pass
+    assert not sink.path.exists()
+
+
+def test_read_and_write_kohdentumattomat(tmp_path):
+    copytree(DATADIR, tmp_path / "data")
+    assert read_kohdentumattomat(tmp_path / "data") is None
+    # Parsing the siirtotiedosto writes the rows failing validation
+    for _ in LahtiSiirtotiedosto(tmp_path / "data").asiakas_rows():
+        pass
+    content = read_kohdentumattomat(tmp_path / "data")
+    failed = _read(KohdentumattomatKuljetukset(tmp_path / "data").path)
+    assert len(failed) == 4
+
+    write_kohdentumattomat(tmp_path / "data", b"aiempi\r\n")
+    assert read_kohdentumattomat(tmp_path / "data") == b"aiempi\r\n"
+    write_kohdentumattomat(tmp_path / "data", content)
+    assert _read(KohdentumattomatKuljetukset(tmp_path / "data").path) == failed
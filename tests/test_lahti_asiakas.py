@@ -0,0 +1,114 @@
+import random
+from pathlib import Path
+from shutil import copytree
+
+import pytest
+
+from jkrimporter.conf import get_kohdentumattomat_siirtotiedosto_filename
+from jkrimporter.model import AsiakasAvain
+from jkrimporter.providers.lahti import siirtotiedosto as siirtotiedosto_module
+from jkrimporter.providers.lahti.lahtiprovider import LahtiTranslator
+from jkrimporter.providers.lahti.models import Asiakas, AsiakasRow
+from jkrimporter.providers.lahti.siirtotiedosto import LahtiSiirtotiedosto
+from jkrimporter.providers.lahti.validation import validate_asiakas_rows
+from pydantic import ValidationError
+
+
+DATADIR = Path(__file__).parent / "data" / "test_lahti_siirtotiedosto"
+IMPORT_DATADIRS = [
+    Path(__file__).parent / "data" / "test_data_import" / name
+    for name in ("kuljetus1", "kuljetus2", "kuljetus3")
+]
+
+
+@pytest.fixture
+def siirtotiedosto(tmp_path):
+    copytree(DATADIR, tmp_path, dirs_exist_ok=True)
+    return LahtiSiirtotiedosto(tmp_path)
+
+
+def _group_by_scanning(rows):
+    asiakas_list = []
+    for row in rows:
+        for asiakas in asiakas_list:
+            if asiakas.check_and_add_row(row):
+                break
+        else:
+            asiakas_list.append(Asiakas(row))
+    return asiakas_list
+
+
+def test_asiakastiedot_grouping(siirtotiedosto):
+    rows = list(siirtotiedosto.asiakas_rows())
+    expected = [asiakas.dict() for asiakas in _group_by_scanning(rows)]
+    assert [asiakas.dict() for asiakas in siirtotiedosto.asiakastiedot] == expected
+
+
+def test_asiakastiedot_repeated_rows(siirtotiedosto, monkeypatch):
+    # Identical rows cannot be added to the same asiakas
+    rows = list(siirtotiedosto.asiakas_rows())
+    monkeypatch.setattr(siirtotiedosto, "asiakas_rows", lambda: iter(rows * 3))
+    expected = [asiakas.dict() for asiakas in _group_by_scanning(rows * 3)]
+    asiakastiedot = [asiakas.dict() for asiakas in siirtotiedosto.asiakastiedot]
+    assert asiakastiedot == expected
+    assert len(asiakastiedot) > len(_group_by_scanning(rows))
+
+
+def test_asiakastiedot_workers(siirtotiedosto, tmp_path_factory, monkeypatch):
+    filename = get_kohdentumattomat_siirtotiedosto_filename()
+    expected = [asiakas.dict() for asiakas in siirtotiedosto.asiakastiedot]
+    expected_failed = (siirtotiedosto._path / filename).read_bytes()
+
+    # Validate the rows in several chunks
+    monkeypatch.setattr(siirtotiedosto_module, "VALIDATION_CHUNK_SIZE", 3)
+    path = tmp_path_factory.mktemp("parallel")
+    copytree(DATADIR, path, dirs_exist_ok=True)
+    parallel = LahtiSiirtotiedosto(path, workers=2)
+    assert [asiakas.dict() for asiakas in parallel.asiakastiedot] == expected
+    assert (path / filename).read_bytes() == expected_failed
+
+
+def _parse_obj(data):
+    try:
+        return AsiakasRow.parse_obj(data), None
+    except ValidationError as e:
+        return None, str(e)
+
+
+def _result(result):
+    asiakas_row, error = result
+    if asiakas_row is None:
+        return error
+    # repr, since nan != nan
+    return repr(asiakas_row.dict()), asiakas_row.__fields_set__
+
+
+@pytest.mark.parametrize(
+    "path", [DATADIR] + IMPORT_DATADIRS, ids=lambda path: path.name
+)
+def test_validate_asiakas_rows(path):
+    siirtotiedosto = LahtiSiirtotiedosto(path)
+    rows = list(siirtotiedosto._read(sorted(path.glob("*.csv"))))
+    # Values the fast path leaves to pydantic, or must convert the same way
+    for value in ("", "#N/A", " 3", "1_000", "1,5", "x", "2023-01-31", "31.2.2023"):
+        for name in ("Pvmalk", "COUNT(kaynnit)", "koko", "Voimassaoloviikotasti2"):
+            rows.append({**rows[0], name: value})
+
+    expected = [_result(_parse_obj(data)) for data in rows]
+    assert [_result(result) for result in validate_asiakas_rows(rows)] == expected
+
+
+def test_as_jkr_data_stream(siirtotiedosto, monkeypatch):
+    # Rows of the same asiakas spread around the data
+    asiakastiedot = siirtotiedosto.asiakastiedot
+    random.Random(0).shuffle(asiakastiedot)
+    asiakastiedot = asiakastiedot * 2
+    monkeypatch.setattr(
+        LahtiSiirtotiedosto, "asiakastiedot", property(lambda self: asiakastiedot)
+    )
+    translator = LahtiTranslator(siirtotiedosto, "LSJ")
+
+    expected = translator.as_jkr_data(None, None).asiakkaat.values()
+    stream = translator.as_jkr_data_stream(None, None)
+    assert stream.avaimet == [AsiakasAvain.from_asiakas(a) for a in expected]
+    assert list(stream.asiakkaat) == list(expected)
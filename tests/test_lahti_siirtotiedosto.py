@@ -9,6 +9,10 @@ from sqlalchemy.orm import Session
 from jkrimporter import conf
 from jkrimporter.cli.jkr import import_data, tiedontuottaja_add_new
 from jkrimporter.providers.db.database import json_dumps
+from jkrimporter.providers.db.dbprovider import (
+    TranslationError,
+    import_asiakastiedot,
+)
 from jkrimporter.providers.db.models import (
     Jatetyyppi,
     Keskeytys,
@@ -16,12 +20,21 @@ from jkrimporter.providers.db.models import (
     KohteenOsapuolet,
     Kuljetus,
     Osapuolenrooli,
+    Osapuoli,
     Sopimus,
     SopimusTyyppi,
     Tiedontuottaja,
     Tyhjennysvali,
+    UlkoinenAsiakastieto,
+)
+from jkrimporter.providers.db.services.kohde import (
+    AsiakasKohdeResolver,
+    find_kohde_by_kiinteisto,
+    find_kohde_by_prt,
 )
+from jkrimporter.providers.lahti.lahtiprovider import LahtiTranslator
 from jkrimporter.providers.lahti.siirtotiedosto import LahtiSiirtotiedosto
+from jkrimporter.utils.date import parse_date_string
 
 
 @pytest.fixture(scope="module", autouse=True)
@@ -56,11 +69,25 @@ def test_kohteet(datadir):
 
 def test_import_faulty_data(faulty_datadir):
     with pytest.raises(RuntimeError):
-        import_data(faulty_datadir, 'LSJ', False, False, True, '1.1.2023', '31.3.2023')
+        import_data(
+            faulty_datadir, 'LSJ', False, False, True, '1.1.2023', '31.3.2023',
+            massatuonti=False,
+            commit_every=1,
+            workers=1,
+            cache=False,
+            stream=False,
+        )
 
 
 def test_import_data(engine, datadir):
-    import_data(datadir, 'LSJ', False, False, True, '1.1.2023', '31.3.2023')
+    import_data(
+        datadir, 'LSJ', False, False, True, '1.1.2023', '31.3.2023',
+        massatuonti=False,
+        commit_every=1,
+        workers=1,
+        cache=False,
+        stream=False,
+    )
 
     session = Session(engine)
 
@@ -267,8 +294,153 @@ def test_import_data(engine, datadir):
     with open(csv_file_write_path, "w") as csvfile:
         csvfile.write(fixed_content)
 
-    import_data(Path(fixed_folder), "LSJ", False, False, True, "1.1.2023", "31.3.2023")
+    import_data(
+        Path(fixed_folder), "LSJ", False, False, True, "1.1.2023", "31.3.2023",
+        massatuonti=False,
+        commit_every=1,
+        workers=1,
+        cache=False,
+        stream=False,
+    )
 
     # Korjattu kuljetus on aiheuttanut uuden sopimuksen sopimus-tauluun.
     lkm_sopimukset += 1
     assert session.query(func.count(Sopimus.id)).scalar() == lkm_sopimukset
+
+
+def _kohde_id(kohde):
+    return kohde.id if kohde is not None else None
+
+
+def test_asiakas_kohde_resolver(engine, datadir):
+    translator = LahtiTranslator(LahtiSiirtotiedosto(datadir), "LSJ")
+    jkr_data = translator.as_jkr_data(
+        parse_date_string("1.1.2023"), parse_date_string("31.3.2023")
+    )
+    asiakkaat = list(jkr_data.asiakkaat.values())
+    session = Session(engine)
+    # Several chunks of asiakkaat
+    resolver = AsiakasKohdeResolver(session, asiakkaat, chunk_size=2)
+
+    # The resolver finds the same kohteet as the queries of each asiakas
+    found = 0
+    for asiakas in asiakkaat:
+        kohde_id = _kohde_id(find_kohde_by_prt(session, asiakas))
+        assert _kohde_id(resolver.find_kohde_by_prt(asiakas)) == kohde_id
+        kiinteisto_kohde_id = _kohde_id(find_kohde_by_kiinteisto(session, asiakas))
+        assert (
+            _kohde_id(resolver.find_kohde_by_kiinteisto(asiakas))
+            == kiinteisto_kohde_id
+        )
+        found += kohde_id is not None or kiinteisto_kohde_id is not None
+    assert found > 0
+
+
+def test_import_data_stream_translation_error(engine, datadir):
+    # Liete is not imported from siirtotiedosto, so translating the last row fails
+    # after the other asiakkaat have been imported
+    path = Path(datadir) / "kuljetustiedot_original_csv.csv"
+    lines = path.read_bytes().splitlines()
+    row = lines[1].split(b";")
+    row[lines[0].split(b";").index(b"tyyppiIdEWC")] = b"Liete"
+    path.write_bytes(b"\r\n".join(lines + [b";".join(row)]) + b"\r\n")
+
+    with pytest.raises(TranslationError):
+        import_data(
+            Path(datadir), "LSJ", False, False, True, "1.1.2023", "31.3.2023",
+            massatuonti=False,
+            commit_every=1,
+            workers=1,
+            cache=False,
+            stream=True,
+        )
+
+
+def _remove_kuljetusdata_from_database(session):
+    session.query(Kuljetus).delete()
+    session.query(Sopimus).delete()
+    session.query(UlkoinenAsiakastieto).delete()
+    session.query(Osapuoli).filter(
+        Osapuoli.tiedontuottaja_tunnus == "0000000-9"
+    ).delete()
+    session.commit()
+
+
+@pytest.mark.parametrize("massatuonti", [False, True])
+def test_import_data_failing_asiakas(engine, datadir, monkeypatch, massatuonti):
+    session = Session(engine)
+    _remove_kuljetusdata_from_database(session)
+    lkm_kohteet = session.query(func.count(Kohde.id)).scalar()
+
+    # The first asiakas fails after its rows have been flushed. The next asiakkaat
+    # are committed in the same batch.
+    virheellinen = "01-0000001-00"
+
+    def failing_import_asiakastiedot(session, asiakas, *args):
+        kohdentumaton = import_asiakastiedot(session, asiakas, *args)
+        if asiakas.asiakasnumero.tunnus == virheellinen:
+            session.flush()
+            raise RuntimeError("Testivirhe")
+        return kohdentumaton
+
+    monkeypatch.setattr(
+        "jkrimporter.providers.db.dbprovider.import_asiakastiedot",
+        failing_import_asiakastiedot,
+    )
+    import_data(
+        Path(datadir), "LSJ", False, False, True, "1.1.2023", "31.3.2023",
+        massatuonti=massatuonti,
+        commit_every=5,
+        workers=1,
+        cache=False,
+        stream=False,
+    )
+
+    # Virheellinen asiakas kirjoitetaan kohdentumattomiin.
+    csv_file_path = os.path.join(datadir, "kohdentumattomat_kuljetukset.csv")
+    with open(csv_file_path, encoding="cp1252", newline="") as csvfile:
+        asiakasnumerot = {
+            row["UrakoitsijankohdeId"]
+            for row in csv.DictReader(csvfile, delimiter=";")
+        }
+    assert virheellinen in asiakasnumerot
+
+    # Virheellisestä asiakkaasta ei jää tietoja tietokantaan.
+    assert session.query(func.count(Kohde.id)).scalar() == lkm_kohteet
+    assert (
+        session.query(UlkoinenAsiakastieto)
+        .filter(UlkoinenAsiakastieto.ulkoinen_id == virheellinen)
+        .first()
+        is None
+    )
+    kohde_id = (
+        session.query(Kohde.id)
+        .filter(Kohde.nimi == "Asunto Oy Kahden Laulumuisto")
+        .scalar()
+    )
+    assert (
+        session.query(func.count(Kuljetus.id))
+        .filter(Kuljetus.kohde_id == kohde_id)
+        .scalar()
+        == 0
+    )
+    assert (
+        session.query(func.count(Sopimus.id))
+        .filter(Sopimus.kohde_id == kohde_id)
+        .scalar()
+        == 0
+    )
+
+    # Samassa erässä myöhemmin tuodut asiakkaat tallentuvat.
+    for asiakasnumero in ("01-0000123-01", "01-0000123-02"):
+        asiakastieto = (
+            session.query(UlkoinenAsiakastieto)
+            .filter(UlkoinenAsiakastieto.ulkoinen_id == asiakasnumero)
+            .one()
+        )
+        assert (
+            session.query(func.count(Kuljetus.id))
+            .filter(Kuljetus.kohde_id == asiakastieto.kohde_id)
+            .scalar()
+            > 0
+        )
@@ -0,0 +1,60 @@
+import pytest
+
+from jkrimporter.utils.osoite import (
+    OsoiteCache,
+    address_parser,
+    osoite_from_parsed_address,
+    parse_osoite,
+)
+
+ADDRESSES = [
+    "Harjukatu 44",
+    "Harjukatu 44 A 5",
+    "Paavo Nurmen Tie 1 B",
+    "PL 12",
+    "Harjukatu 44 ??",
+]
+
+
+def _parse_uncached(address):
+    try:
+        return osoite_from_parsed_address(address_parser.parse(address))
+    except ValueError:
+        return None
+
+
+@pytest.mark.parametrize("address", ADDRESSES)
+def test_parse_osoite(address):
+    expected = _parse_uncached(address)
+    if expected is None:
+        with pytest.raises(ValueError):
+            parse_osoite(address)
+    else:
+        assert parse_osoite(address) == expected
+        assert parse_osoite(f" {address.replace(' ', '  ')} ") == expected
+
+
+def test_osoite_cache_hits():
+    cache = OsoiteCache(maxsize=2)
+    for address in ["Harjukatu 44", "Harjukatu  44", "Harjukatu 44 ??"] * 2:
+        cache.get(address)
+    assert (cache.misses, cache.hits) == (2, 4)
+    # The least recently used address is dropped
+    cache.get("PL 12")
+    cache.get("Harjukatu 44")
+    assert (cache.misses, cache.hits) == (4, 4)
+
+
+def test_osoite_cache_file(tmp_path):
+    path = str(tmp_path / "osoitteet.sqlite")
+    cache = OsoiteCache()
+    cache.open(path)
+    expected = [cache.get(address) for address in ADDRESSES]
+    cache.close()
+
+    cache = OsoiteCache()
+    cache.open(path)
+    assert [cache.get(address) for address in ADDRESSES] == expected
+    cache.close()
+    assert (cache.misses, cache.file_hits) == (0, len(ADDRESSES))
+    assert expected[-1] is None
@@ -0,0 +1,109 @@
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, event
+from sqlalchemy.pool import StaticPool
+
+from jkrimporter import conf
+from jkrimporter.providers.db import models
+from jkrimporter.providers.db.snapshot import (
+    get_schema_version,
+    get_snapshot_path,
+    load_schema,
+)
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(conf, "config_dir", str(tmp_path / "jkr"))
+    return tmp_path / "jkr"
+
+
+@pytest.fixture
+def engine():
+    # SQLite database with the tables in schema jkr
+    engine = create_engine("sqlite://", future=True, poolclass=StaticPool)
+    event.listen(
+        engine,
+        "connect",
+        lambda connection, _: connection.execute("ATTACH ':memory:' AS jkr"),
+    )
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE jkr.flyway_schema_history "
+            "(installed_rank INTEGER, version TEXT, success BOOLEAN)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO jkr.flyway_schema_history VALUES "
+            "(1, '1', 1), (2, '2', 1), (3, '3', 0)"
+        )
+        connection.exec_driver_sql(
+            "CREATE TABLE jkr.kohde (id INTEGER PRIMARY KEY, nimi TEXT)"
+        )
+    return engine
+
+
+def _declared_metadata():
+    metadata = MetaData()
+    Table("kohde", metadata, Column("id", Integer, primary_key=True), schema="jkr")
+    return metadata
+
+
+def test_get_schema_version(engine):
+    assert get_schema_version(engine) == "2"
+
+
+def test_load_schema(engine, config_dir):
+    metadata = _declared_metadata()
+    load_schema(engine, metadata, "jkr")
+    assert set(metadata.tables["jkr.flyway_schema_history"].columns.keys()) == {
+        "installed_rank",
+        "version",
+        "success",
+    }
+    # Columns already defined are not replaced
+    assert metadata.tables["jkr.kohde"].columns.keys() == ["id", "nimi"]
+    assert (config_dir / "schema_2.pickle").exists()
+
+    # Tables are read from the snapshot, even if the database changes
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE jkr.pysakki (id INTEGER)")
+    metadata = _declared_metadata()
+    load_schema(engine, metadata, "jkr")
+    assert sorted(metadata.tables) == ["jkr.flyway_schema_history", "jkr.kohde"]
+    assert set(metadata.tables["jkr.flyway_schema_history"].columns.keys()) == {
+        "installed_rank",
+        "version",
+        "success",
+    }
+    # Tables already defined are kept as they are
+    assert metadata.tables["jkr.kohde"].columns.keys() == ["id"]
+
+
+def test_load_schema_unreadable_snapshot(engine, config_dir):
+    path = config_dir / "schema_2.pickle"
+    config_dir.mkdir()
+    path.write_bytes(b"rikki")
+
+    metadata = MetaData()
+    load_schema(engine, metadata, "jkr")
+    assert sorted(metadata.tables) == ["jkr.flyway_schema_history", "jkr.kohde"]
+    assert get_snapshot_path("2") == str(path)
+    assert path.read_bytes() != b"rikki"
+
+
+def test_models_prepared_when_first_used(monkeypatch):
+    prepared = []
+
+    def prepare_models():
+        prepared.append(True)
+        monkeypatch.setitem(vars(models), "Kohde", "kohde")
+
+    monkeypatch.delitem(vars(models), "Kohde", raising=False)
+    monkeypatch.setattr(models, "prepare_models", prepare_models)
+    assert prepared == []
+    assert models.Kohde == "kohde"
+    assert models.Kohde == "kohde"
+    assert prepared == [True]
+
+    with pytest.raises(AttributeError):
+        models.EiMallia
+    assert prepared == [True]
@@ -0,0 +1,34 @@
+import pytest
+
+from jkrimporter.utils.stream import prefetch
+
+
+def test_prefetch():
+    assert list(prefetch(range(100), 3)) == list(range(100))
+    assert list(prefetch([], 3)) == []
+
+
+def test_prefetch_error():
+    def items():
+        yield 1
+        raise ValueError("virhe")
+
+    stream = prefetch(items(), 3)
+    assert next(stream) == 1
+    with pytest.raises(ValueError, match="virhe"):
+        next(stream)
+
+
+def test_prefetch_consumer_stops():
+    produced = []
+
+    def items():
+        for item in range(100):
+            produced.append(item)
+            yield item
+
+    stream = prefetch(items(), 3)
+    assert next(stream) == 0
+    stream.close()
+    # The producer stops when the queue is full
+    assert len(produced) < 10
@@ -0,0 +1,53 @@
+import openpyxl
+import pytest
+
+from jkrimporter.utils.xlsx import collect_exports, export_rows
+
+HEADERS = ["Nimi", "Osoite"]
+
+
+def _read(path):
+    workbook = openpyxl.load_workbook(path)
+    sheet = workbook[workbook.sheetnames[0]]
+    return [list(row) for row in sheet.iter_rows(values_only=True)]
+
+
+def test_export_rows(tmp_path):
+    path = tmp_path / "kohdentumattomat.xlsx"
+    export_rows(path, HEADERS, [["a", "Katu 1"]])
+    export_rows(path, HEADERS, [["b", "Katu 2"], ["c", ""]])
+
+    assert _read(path) == [HEADERS, ["a", "Katu 1"], ["b", "Katu 2"], ["c", None]]
+
+
+def test_collect_exports(tmp_path, monkeypatch):
+    path = tmp_path / "kohdentumattomat.xlsx"
+    export_rows(path, HEADERS, [["a", "Katu 1"]])
+
+    saves = []
+    save = openpyxl.Workbook.save
+    monkeypatch.setattr(
+        openpyxl.Workbook,
+        "save",
+        lambda self, filename: saves.append(filename) or save(self, filename),
+    )
+    with collect_exports():
+        export_rows(str(path), HEADERS, [["b", "Katu 2"]])
+        with collect_exports():
+            export_rows(path, HEADERS, [["c", "Katu 3"]])
+        assert saves == []
+
+    assert len(saves) == 1
+    assert _read(path) == [
+        HEADERS, ["a", "Katu 1"], ["b", "Katu 2"], ["c", "Katu 3"]
+    ]
+
+
+def test_collect_exports_error(tmp_path):
+    path = tmp_path / "kohdentumattomat.xlsx"
+    with pytest.raises(RuntimeError):
+        with collect_exports():
+            export_rows(path, HEADERS, [["a", "Katu 1"]])
+            raise RuntimeError
+
+    assert _read(path) == [HEADERS, ["a", "Katu 1"]]